@@ -15,14 +15,14 @@ def show():
         st.error("このページを表示する権限がありません。")
         return
 
-    tab0, tab1, tab2, tab3, tab4 = st.tabs(["🏠 倶楽部基本設定", "🌐 SNS・メッセージ", "🏃 チーム管理", "👥 ユーザー管理", "📜 操作ログ"])
+    tab0, tab1, tab2, tab3, tab4, tab5 = st.tabs(["🏠 倶楽部基本設定", "🌐 SNS・メッセージ", "🏃 チーム管理", "👥 ユーザー管理", "📜 操作ログ", "🩺 DB診断"])
 
     with tab0:
         st.subheader("🏢 倶楽部基本情報・認証設定")
 
-        with db.sqlite3.connect(db.DB_NAME) as conn:
-            conn.row_factory = db.sqlite3.Row
+        with db.get_connection() as conn:
             c = conn.cursor()
+            c.row_factory = db.sqlite3.Row
             c.execute("SELECT display_name, login_id, raw_password FROM clubs WHERE id = ?", (club_id,))
             club_info = c.fetchone()
         
@@ -213,3 +213,27 @@ def show():
         else:
             st.info("操作ログはありません。")
 
+    with tab5:
+        st.subheader("🩺 データベース診断")
+        st.caption("主要な検索クエリの実行計画（EXPLAIN QUERY PLAN）です。「SCAN」のみの行は全件走査になっています。")
+
+        st.markdown("#### 📇 管理インデックス")
+        st.dataframe(pd.DataFrame(db.get_managed_index_status()), use_container_width=True, hide_index=True)
+
+        st.markdown("#### 🔎 主要クエリの実行計画")
+        plans = db.get_query_plans(club_id)
+        st.dataframe(pd.DataFrame(plans), use_container_width=True, hide_index=True)
+
+        st.markdown("#### 🔄 成績集計の再構築")
+        st.caption("成績一覧は集計テーブルから表示しています。数値がずれている場合は打席ログから作り直してください。")
+        if st.button("集計テーブルを再構築"):
+            db.rebuild_stat_aggregates(club_id)
+            db.add_activity_log(st.session_state.username, "REBUILD_AGGREGATES", "batting,pitching", club_id=club_id)
+            st.success("集計テーブルを再構築しました")
+
+        st.markdown("#### 🧾 試合結果（ボックススコア）の再構築")
+        st.caption("試合結果一覧は保存時に計算したスコアボード・個人成績を表示しています。表示がずれている場合は作り直してください。")
+        if st.button("ボックススコアを再構築"):
+            db.rebuild_box_scores(club_id)
+            db.add_activity_log(st.session_state.username, "REBUILD_BOX_SCORES", "game_box_scores", club_id=club_id)
+            st.success("ボックススコアを再構築しました")
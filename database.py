@@ -2,349 +2,661 @@ import sqlite3
 import json
 import os
 import hashlib
+import re
 import pandas as pd
 import streamlit as st
 import copy
+import threading
+import weakref
+import zlib
 from datetime import datetime
 
 
 DB_NAME = 'softball.db'
 
 # -------------—-
-# 　　 基礎 
+# 　　 接続管理
 # --------------—
 
-def init_db():
-    with sqlite3.connect(DB_NAME) as conn:
-        c = conn.cursor()
+# ■■■接続プール
+# Streamlit は再実行のたびに全画面のコードを上から流すため、関数ごとに
+# sqlite3.connect() すると 1 画面で数十回の接続・PRAGMA 初期化が走る。
+# 接続はスレッド（＝セッションの実行スレッド）単位で貸し出し、
+# スレッド終了時にプールへ返却して次の実行で再利用する。
 
-        # 1. 倶楽部マスター管理
-        c.execute('''CREATE TABLE IF NOT EXISTS clubs
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      login_id TEXT UNIQUE,
-                      password_hash TEXT,
-                      raw_password TEXT,
-                      display_name TEXT,
-                      plan_type TEXT DEFAULT 'free',
-                      created_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-
-        # 2. ユーザー管理
-        c.execute('''CREATE TABLE IF NOT EXISTS users
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      club_id INTEGER,
-                      username TEXT,
-                      password_hash TEXT,
-                      role TEXT,
-                      FOREIGN KEY(club_id) REFERENCES clubs(id))''')
-
-        # 3. チーム・選手マスター
-        c.execute('''CREATE TABLE IF NOT EXISTS teams
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      club_id INTEGER,
-                      name TEXT,
-                      color TEXT DEFAULT '#31333F',
-                      FOREIGN KEY(club_id) REFERENCES clubs(id))''')
-
-        c.execute('''CREATE TABLE IF NOT EXISTS players
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      club_id INTEGER,
-                      name TEXT,
-                      number TEXT,
-                      position TEXT,
-                      team_name TEXT,
-                      FOREIGN KEY(club_id) REFERENCES clubs(id))''')
-
-        # 4. スコアブック
-        c.execute('''CREATE TABLE IF NOT EXISTS scorebook_batting
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      game_id TEXT,
-                      club_id INTEGER,
-                      player_name TEXT,
-                      summary TEXT,
-                      innings TEXT,
-                      FOREIGN KEY(club_id) REFERENCES clubs(id))''')
-
-        c.execute('''CREATE TABLE IF NOT EXISTS scorebook_pitching
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      game_id TEXT,
-                      club_id INTEGER,
-                      player_name TEXT,
-                      summary TEXT,
-                      FOREIGN KEY(club_id) REFERENCES clubs(id))''')
-
-        c.execute('''CREATE TABLE IF NOT EXISTS scorebook_comments
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      game_id TEXT,
-                      club_id INTEGER,
-                      comment TEXT,
-                      FOREIGN KEY(club_id) REFERENCES clubs(id))''')
-
-        # 5. 超詳細打席データテーブル
-        c.execute('''CREATE TABLE IF NOT EXISTS super_detailed_at_bats
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      club_id INTEGER,
-                      game_id TEXT,
-                      match_date TEXT,   
-                      player_name TEXT,  
-                      batter_name TEXT,  
-                      pitcher_name TEXT, 
-                      inning INTEGER,
-                      at_bat_num INTEGER,
-                      pitch_count INTEGER,
-                      ball_type TEXT,
-                      course TEXT,
-                      result TEXT,
-                      final_result TEXT,
-                      two_strike_hit INTEGER DEFAULT 0,    
-                      first_pitch_swing INTEGER DEFAULT 0, 
-                      is_unearned INTEGER DEFAULT 0,       
-                      swinging_strikes INTEGER DEFAULT 0,  
-                      is_first_strike INTEGER DEFAULT 0,   
-                      timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                      FOREIGN KEY(club_id) REFERENCES clubs(id))''')
-
-        # 6. スケジュール・出欠管理
-        c.execute('''CREATE TABLE IF NOT EXISTS events
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      club_id INTEGER,
-                      date TEXT,
-                      title TEXT,
-                      description TEXT,
-                      event_type TEXT,
-                      FOREIGN KEY(club_id) REFERENCES clubs(id))''')
-
-        c.execute('''CREATE TABLE IF NOT EXISTS attendance
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      club_id INTEGER,
-                      event_id INTEGER,
-                      player_name TEXT,
-                      status TEXT,
-                      FOREIGN KEY(club_id) REFERENCES clubs(id),
-                      FOREIGN KEY(event_id) REFERENCES events(id))''')
-
-        # 7. 操作ログ
-        c.execute('''CREATE TABLE IF NOT EXISTS activity_logs
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      club_id INTEGER,
-                      username TEXT,
-                      action TEXT,
-                      details TEXT,
-                      timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                      FOREIGN KEY(club_id) REFERENCES clubs(id))''')
-
-        # 8. 倶楽部カスタマイズ
-        c.execute('''CREATE TABLE IF NOT EXISTS club_customization
-                     (club_id INTEGER PRIMARY KEY,
-                      welcome_message TEXT,
-                      member_announcement TEXT,
-                      instagram_url TEXT,
-                      x_url TEXT,
-                      youtube_url TEXT,
-                      FOREIGN KEY(club_id) REFERENCES clubs(id))''')
-
-        # スキーマ・マイグレーション
-        migrations = [
-            ("super_detailed_at_bats", "two_strike_hit", "INTEGER DEFAULT 0"),
-            ("super_detailed_at_bats", "first_pitch_swing", "INTEGER DEFAULT 0"),
-            ("super_detailed_at_bats", "is_unearned", "INTEGER DEFAULT 0"),
-            ("super_detailed_at_bats", "swinging_strikes", "INTEGER DEFAULT 0"),
-            ("super_detailed_at_bats", "match_date", "TEXT"),
-            ("super_detailed_at_bats", "batter_name", "TEXT"),
-            ("super_detailed_at_bats", "pitcher_name", "TEXT")
-        ]
+BUSY_TIMEOUT_MS = 5000       # 書き込み競合時に待つ時間（database is locked 対策）
+STATEMENT_CACHE_SIZE = 256   # 接続ごとのプリペアドステートメントキャッシュ
+POOL_MAX_IDLE = 8            # DBファイルごとに保持する待機接続の上限
+REFERENCE_CACHE_ENTRIES = 256  # 参照データ（プラン・チーム・選手）のキャッシュに残す (倶楽部, 版数) の数
+
+_pool_lock = threading.Lock()
+_idle_connections = {}
+_thread_local = threading.local()
+
+
+class _PooledConnection(sqlite3.Connection):
+    """
+    同じスレッドでは `with get_connection()` がネストしても同じ接続が返るため、
+    commit / rollback は一番外側の with を抜けるときだけ行う。
+    内側の with は、外側のトランザクションが始まっていれば SAVEPOINT を切り、
+    正常終了で RELEASE、例外時はその SAVEPOINT まで戻す。
+    内側での conn.commit() は何もしない（外側でまとめて commit される）。
+    conn.rollback() は内側の SAVEPOINT まで戻す。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._frames = []   # with ごとの SAVEPOINT 名（切っていなければ None）
+
+    def __enter__(self):
+        savepoint = None
+        if self._frames and self.in_transaction:
+            savepoint = f"nested_{len(self._frames)}"
+            self.execute(f"SAVEPOINT {savepoint}")
+        self._frames.append(savepoint)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        savepoint = self._frames.pop()
+        if not self._frames:
+            return super().__exit__(exc_type, exc_value, traceback)
+        if savepoint is None:
+            # 内側で始まったトランザクション（外側はまだ何も書いていない）は外側で確定する
+            if exc_type is not None and self.in_transaction:
+                super().rollback()
+            return False
+        if exc_type is not None:
+            self.execute(f"ROLLBACK TO {savepoint}")
+        self.execute(f"RELEASE {savepoint}")
+        return False
+
+    def commit(self):
+        if len(self._frames) > 1:
+            return
+        super().commit()
 
-        for table, column, definition in migrations:
+    def rollback(self):
+        if len(self._frames) > 1 and self._frames[-1] is not None:
+            self.execute(f"ROLLBACK TO {self._frames[-1]}")
+        else:
+            super().rollback()
+
+
+def _open_connection(db_path):
+    conn = sqlite3.connect(
+        db_path,
+        timeout=BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+        factory=_PooledConnection,
+    )
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    return conn
+
+
+def _release_connections(conns):
+    """スレッド終了時に呼ばれ、借りていた接続をプールへ戻す"""
+    with _pool_lock:
+        for db_path, conn in conns.items():
             try:
-                c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
-            except sqlite3.OperationalError:
-                pass
+                conn._frames.clear()
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                continue
+            idle = _idle_connections.setdefault(db_path, [])
+            if len(idle) < POOL_MAX_IDLE:
+                idle.append(conn)
+            else:
+                conn.close()
+        conns.clear()
 
-        conn.commit()
 
+def get_connection(db_path=None):
+    """
+    再利用可能な接続を返す。
+    使い方は従来の sqlite3.connect() と同じく `with get_connection() as conn:` で、
+    ブロックを抜けると commit（例外時は rollback）される。接続は閉じないこと。
+    ネストした with は外側のトランザクションの一部になる（_PooledConnection）。
+    row_factory を変えたい場合は接続ではなくカーソル側に設定する。
+    """
+    db_path = db_path or DB_NAME
+    conns = getattr(_thread_local, "conns", None)
+    if conns is None:
+        conns = _thread_local.conns = {}
+        weakref.finalize(threading.current_thread(), _release_connections, conns)
+
+    conn = conns.get(db_path)
+    if conn is None:
+        with _pool_lock:
+            idle = _idle_connections.get(db_path)
+            conn = idle.pop() if idle else None
+        if conn is None:
+            conn = _open_connection(db_path)
+        conns[db_path] = conn
+    return conn
+
+
+def checkpoint_db(db_path=None):
+    """WALの内容を本体ファイルへ書き戻す（DBファイルを直接コピーする前に呼ぶ）"""
+    conn = get_connection(db_path)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
 
 # -------------—-
-# 　 成績管理 
+# 　　 基礎 
 # --------------—
 
-# ■■■試合データ保存セクション（今後の大工事現場）
+# ■■■スキーマ管理
+# テーブル定義の変更はすべて SCHEMA_MIGRATIONS に番号順で追加する。
+# 適用済みの番号は schema_version テーブルに記録され、各プロセスで最初の
+# init_db() 呼び出し時に未適用分だけが流れる（再実行のたびには走らない）。
+# 既存の本番DBは schema_version を持たないため、各マイグレーションは
+# 「既にテーブル・カラムがあっても壊れない」書き方にすること。
+
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+def _table_columns(c, table):
+    c.execute(f"PRAGMA table_info({table})")
+    return [col[1] for col in c.fetchall()]
+
+
+def _add_missing_columns(c, table, column_defs):
+    """column_defs: [(カラム名, 型定義), ...] のうち未作成のものだけ追加する"""
+    columns = _table_columns(c, table)
+    for col_name, col_type in column_defs:
+        if col_name not in columns:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {col_name} {col_type}")
+
+
+def _migrate_base_tables(c):
+    # --- 1. 倶楽部管理テーブル (clubs) ---
+    c.execute('''CREATE TABLE IF NOT EXISTS clubs
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT, 
+                  name TEXT UNIQUE, 
+                  password_hash TEXT, 
+                  created_at TEXT,
+                  plan_type TEXT DEFAULT 'free',
+                  max_players INTEGER DEFAULT 30,
+                  max_games_yearly INTEGER DEFAULT 30,
+                  ad_hidden INTEGER DEFAULT 0,
+                  login_id TEXT UNIQUE,
+                  display_name TEXT,
+                  raw_password TEXT)''')
+
+    # clubsテーブルの自動移行
+    _add_missing_columns(c, "clubs", [
+        ("plan_type", "TEXT DEFAULT 'free'"),
+        ("max_players", "INTEGER DEFAULT 30"),
+        ("max_games_yearly", "INTEGER DEFAULT 30"),
+        ("ad_hidden", "INTEGER DEFAULT 0"),
+        ("login_id", "TEXT"),
+        ("display_name", "TEXT"),
+        ("raw_password", "TEXT"),
+    ])
+    c.execute("UPDATE clubs SET login_id = name WHERE login_id IS NULL")
+    c.execute("UPDATE clubs SET display_name = name WHERE display_name IS NULL")
+
+    # --- 2. 既存全テーブルへの club_id 追加 ---
+    tables = ['players', 'teams', 'scorebook_batting', 'scorebook_pitching', 
+              'scorebook_comments', 'events', 'attendance', 'users', 
+              'activity_logs', 'super_detailed_at_bats', 'pitcher_logs_detailed']
+    for table in tables:
+        c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,))
+        if c.fetchone():
+            _add_missing_columns(c, table, [("club_id", "INTEGER DEFAULT 1")])
+
+    # --- 3. 各テーブルの正規定義 ---
+    c.execute('''CREATE TABLE IF NOT EXISTS players
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT, club_id INTEGER, name TEXT, birthday TEXT, hometown TEXT, 
+                  memo TEXT, image_path TEXT, video_url TEXT, is_active INTEGER DEFAULT 1, team_name TEXT DEFAULT '未所属',
+                  throws TEXT DEFAULT 'R', bats TEXT DEFAULT 'R')''')
+    # 選手情報の拡張
+    _add_missing_columns(c, "players", [("throws", "TEXT DEFAULT 'R'"), ("bats", "TEXT DEFAULT 'R'")])
+
+    c.execute('''CREATE TABLE IF NOT EXISTS teams
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT, club_id INTEGER, name TEXT, color TEXT DEFAULT '#e1e4e8')''')
+
+    # 試合マスター（簡易版・詳細版スコアの親レコード）
+    c.execute('''CREATE TABLE IF NOT EXISTS games
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT, 
+                  club_id INTEGER, 
+                  date TEXT, 
+                  opponent TEXT, 
+                  location TEXT,
+                  result TEXT, 
+                  my_score INTEGER, 
+                  opp_score INTEGER, 
+                  memo TEXT)''')
+    _add_missing_columns(c, "games", [
+        ("location", "TEXT"),
+        ("is_top_flag", "INTEGER DEFAULT 0"),
+        ("scoreboard_json", "TEXT"),
+        ("my_team_name", "TEXT DEFAULT '自チーム'"),
+        ("score_str_v", "TEXT DEFAULT '0,ー,ー,ー,ー,ー,ー,ー,0'"),
+        ("score_str_h", "TEXT DEFAULT '0,ー,ー,ー,ー,ー,ー,ー,0'"),
+    ])
+
+    c.execute('''CREATE TABLE IF NOT EXISTS scorebook_batting
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT, club_id INTEGER, game_id INTEGER, player_name TEXT, innings TEXT, summary TEXT, dp INTEGER DEFAULT 0)''')
+    _add_missing_columns(c, "scorebook_batting", [("dp", "INTEGER DEFAULT 0")])
+
+    c.execute('''CREATE TABLE IF NOT EXISTS scorebook_pitching
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT, club_id INTEGER, game_id INTEGER, player_name TEXT, ip TEXT, er INTEGER,
+                  so INTEGER DEFAULT 0, np INTEGER DEFAULT 0, tbf INTEGER DEFAULT 0, h INTEGER DEFAULT 0, 
+                  hr INTEGER DEFAULT 0, bb INTEGER DEFAULT 0, hbp INTEGER DEFAULT 0, r INTEGER DEFAULT 0, 
+                  win INTEGER DEFAULT 0, loss INTEGER DEFAULT 0, save INTEGER DEFAULT 0, wp INTEGER DEFAULT 0, date TEXT,
+                  decision TEXT DEFAULT '')''')
+    # 詳細版スコアの勝敗S
+    _add_missing_columns(c, "scorebook_pitching", [("decision", "TEXT DEFAULT ''")])
+
+    c.execute('''CREATE TABLE IF NOT EXISTS scorebook_comments
+                 (game_id INTEGER, club_id INTEGER, comment TEXT, PRIMARY KEY(game_id, club_id))''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS events 
+                 (event_id INTEGER PRIMARY KEY AUTOINCREMENT, club_id INTEGER, date TEXT, title TEXT, category TEXT, location TEXT, memo TEXT)''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS attendance 
+                 (event_id INTEGER, club_id INTEGER, player_name TEXT, status TEXT, PRIMARY KEY(event_id, player_name))''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS users 
+                 (username TEXT, club_id INTEGER, password_hash TEXT, role TEXT, PRIMARY KEY(username, club_id))''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS activity_logs 
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT, club_id INTEGER, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, username TEXT, action TEXT, details TEXT)''')
+
+    # 倶楽部カスタマイズ
+    c.execute('''CREATE TABLE IF NOT EXISTS club_customization
+                 (club_id INTEGER PRIMARY KEY,
+                  welcome_message TEXT,
+                  member_announcement TEXT,
+                  instagram_url TEXT,
+                  x_url TEXT,
+                  youtube_url TEXT,
+                  FOREIGN KEY(club_id) REFERENCES clubs(id))''')
+
+    # 【最強の器・完全版】超詳細版打席履歴テーブル (super_detailed_at_bats)
+    c.execute('''CREATE TABLE IF NOT EXISTS super_detailed_at_bats
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  club_id INTEGER, 
+                  game_id TEXT, 
+                  at_bat_no INTEGER, 
+                  match_date TEXT,
+                  match_month INTEGER,
+                  inning INTEGER, 
+                  top_bottom INTEGER,
+                  outs INTEGER DEFAULT 0,
+                  score_diff INTEGER DEFAULT 0,
+                  batting_order INTEGER,
+                  pitcher_name TEXT, 
+                  p_handed TEXT DEFAULT 'R',
+                  p_style TEXT DEFAULT 'Windmill',
+                  batter_name TEXT, 
+                  result TEXT, 
+                  hit_direction TEXT,
+                  hit_trajectory TEXT,
+                  rbi INTEGER, 
+                  is_clutch INTEGER DEFAULT 0,
+                  ball_counts_raw TEXT,
+                  pitch_count INTEGER DEFAULT 0,
+                  first_pitch_swing INTEGER DEFAULT 0,
+                  two_strike_hit INTEGER DEFAULT 0,
+                  first_pitch_strike INTEGER DEFAULT 0,
+                  is_leadoff_walk INTEGER DEFAULT 0,
+                  swinging_strikes INTEGER DEFAULT 0,
+                  inherited_scored INTEGER DEFAULT 0,
+                  order_seen INTEGER DEFAULT 1,
+                  is_unearned INTEGER DEFAULT 0,
+                  ball_counts_json TEXT, 
+                  runners_json TEXT, 
+                  raw_data_json TEXT,
+                  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+
+    # 【最強の器】super_detailed_at_bats の大幅拡張マイグレーション
+    _add_missing_columns(c, "super_detailed_at_bats", [
+        ("at_bat_no", "INTEGER"),                   # 試合通算の打席番号
+        ("match_date", "TEXT"),                     # 試合日
+        ("match_month", "INTEGER"),                 # 月（バイオリズム）
+        ("outs", "INTEGER DEFAULT 0"),              # アウトカウント
+        ("score_diff", "INTEGER DEFAULT 0"),        # 得点差
+        ("batting_order", "INTEGER"),               # 打順
+        ("batter_name", "TEXT"),
+        ("pitcher_name", "TEXT"),
+        ("p_handed", "TEXT DEFAULT 'R'"),           # 投手利き腕
+        ("p_style", "TEXT DEFAULT 'Windmill'"),     # 投法
+        ("ball_counts_raw", "TEXT"),                # 配球文字ログ
+        ("hit_direction", "TEXT"),                  # 打球方向
+        ("hit_trajectory", "TEXT"),                 # 打球種類
+        ("rbi", "INTEGER"),
+        ("is_clutch", "INTEGER DEFAULT 0"),         # 得点圏フラグ
+        ("pitch_count", "INTEGER DEFAULT 0"),
+        ("first_pitch_swing", "INTEGER DEFAULT 0"), # 初球を振ったか
+        ("two_strike_hit", "INTEGER DEFAULT 0"),    # 2ストライクからの安打
+        ("first_pitch_strike", "INTEGER DEFAULT 0"),# 初球ストライク（投手の積極性）
+        ("is_leadoff_walk", "INTEGER DEFAULT 0"),   # 先頭四球（失点リスク管理）
+        ("swinging_strikes", "INTEGER DEFAULT 0"),
+        ("inherited_scored", "INTEGER DEFAULT 0"),  # 承継走者の生還数（火消し能力）
+        ("order_seen", "INTEGER DEFAULT 1"),        # 打者の巡目（スタミナ・慣れの影響）
+        ("is_unearned", "INTEGER DEFAULT 0"),       # 非自責フラグ
+        ("raw_data_json", "TEXT"),
+        ("created_at", "TIMESTAMP"),
+    ])
+
+    # 【新規】自チーム投手詳細ログ - 打者側と項目を同期
+    c.execute('''CREATE TABLE IF NOT EXISTS pitcher_logs_detailed
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  club_id INTEGER,
+                  game_id TEXT,
+                  player_name TEXT,
+                  inning INTEGER,
+                  pitch_count_total INTEGER,
+                  result TEXT,
+                  ball_counts_raw TEXT,
+                  is_clutch INTEGER DEFAULT 0,
+                  is_unearned INTEGER DEFAULT 0)''')
+
+
+def _migrate_core_cct_logs(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS core_cct_logs
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  club_id INTEGER,
+                  game_id TEXT,
+                  match_date TEXT,
+                  my_team_name TEXT,
+                  opp_team_name TEXT,
+                  handicap_my_team INTEGER DEFAULT 0,
+                  handicap_opp_team INTEGER DEFAULT 0,
+                  is_top_flag INTEGER, 
+                  is_tiebreak INTEGER DEFAULT 0,
+                  inning TEXT,
+                  batting_order INTEGER,
+                  pitcher_name TEXT,
+                  pitcher_hand TEXT, 
+                  pitching_style TEXT, 
+                  batter_name TEXT,
+                  start_score_my INTEGER,
+                  start_score_opp INTEGER,
+                  start_outs INTEGER,
+                  start_runners TEXT, 
+                  counts_history_json TEXT, 
+                  at_bat_result TEXT, 
+                  run_result TEXT, 
+                  hit_direction TEXT, 
+                  hit_type TEXT, 
+                  event_type TEXT, 
+                  sub_detail TEXT, 
+                  error_player TEXT,
+                  timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+
+    _add_missing_columns(c, "core_cct_logs", [
+        ("pitcher_hand", "TEXT"),
+        ("pitching_style", "TEXT"),
+        ("is_tiebreak", "INTEGER DEFAULT 0"),
+        ("error_player", "TEXT"),
+    ])
+
+
+# ■■■管理インデックス
+# 成績・履歴・プロフィール画面の検索条件（倶楽部×試合／打者／投手／日付）に合わせた索引。
+# 追加・変更はこの一覧を編集し、ensure_managed_indexes を呼ぶマイグレーションを足す。
+MANAGED_INDEXES = [
+    # (インデックス名, テーブル, カラム)
+    ("idx_sdab_club_game", "super_detailed_at_bats", "club_id, game_id"),
+    ("idx_sdab_club_batter", "super_detailed_at_bats", "club_id, batter_name"),
+    ("idx_sdab_club_pitcher", "super_detailed_at_bats", "club_id, pitcher_name"),
+    ("idx_sdab_club_date", "super_detailed_at_bats", "club_id, match_date"),
+    ("idx_cct_club_game", "core_cct_logs", "club_id, game_id"),
+    ("idx_cct_club_batter", "core_cct_logs", "club_id, batter_name"),
+    ("idx_cct_club_pitcher", "core_cct_logs", "club_id, pitcher_name"),
+    ("idx_cct_club_date", "core_cct_logs", "club_id, match_date"),
+    ("idx_sb_batting_club_game", "scorebook_batting", "club_id, game_id"),
+    ("idx_sb_batting_club_player", "scorebook_batting", "club_id, player_name"),
+    ("idx_sb_pitching_club_game", "scorebook_pitching", "club_id, game_id"),
+    ("idx_sb_pitching_club_player", "scorebook_pitching", "club_id, player_name"),
+    ("idx_games_club_date", "games", "club_id, date"),
+    ("idx_events_club_date", "events", "club_id, date"),
+    # 主キー (event_id, player_name) の先頭でも引けるが、倶楽部条件まで索引で絞る
+    ("idx_attendance_event", "attendance", "event_id, club_id"),
+    # 起動時の再分類対象（旧ルールで分類された行）の確認用
+    ("idx_sdab_outcome_version", "super_detailed_at_bats", "outcome_version"),
+    ("idx_cct_outcome_version", "core_cct_logs", "outcome_version"),
+    # 年度別の成績一覧（主キーは選手名が先に来るため、年度で絞ってから選手ごとに合算する順で持つ）
+    ("idx_batting_agg_club_season", "batting_aggregates", "club_id, season, player_name"),
+    ("idx_pitching_agg_club_season", "pitching_aggregates", "club_id, season, pitcher_name"),
+    # 試合結果一覧（新しい順のページ取得）
+    ("idx_box_scores_club_date", "game_box_scores", "club_id, match_date"),
+    # モバイルのキャッシュ更新（前回取り込んだ row_version より後の行・削除だけを引く）
+    ("idx_players_club_version", "players", "club_id, row_version"),
+    ("idx_teams_club_version", "teams", "club_id, row_version"),
+    ("idx_tombstones_club_version", "row_tombstones", "club_id, row_version"),
+]
+
+
+def ensure_managed_indexes(c):
+    for index_name, table, columns in MANAGED_INDEXES:
+        # 列を追加するマイグレーションより前に呼ばれた場合、その索引は列の追加時に作る
+        if not set(col.strip() for col in columns.split(",")) <= set(_table_columns(c, table)):
+            continue
+        c.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({columns})")
+
+
+def _migrate_normalize_key_types(c):
+    # scorebook_* の game_id は INTEGER 宣言だが実際は "no_12" などの文字列も入っているため、
+    # 他テーブルと同じ TEXT に揃える（SQLite は型変更できないのでテーブルを作り直す）
+    for table in ["scorebook_batting", "scorebook_pitching", "scorebook_comments"]:
+        c.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,))
+        row = c.fetchone()
+        if not row or not re.search(r"\bgame_id\s+INTEGER\b", row[0], re.IGNORECASE):
+            continue
+        new_sql = re.sub(r"\bgame_id\s+INTEGER\b", "game_id TEXT", row[0], count=1, flags=re.IGNORECASE)
+        new_sql = new_sql.replace(table, f"{table}__new", 1)
+        c.execute(f"DROP TABLE IF EXISTS {table}__new")
+        c.execute(new_sql)
+        # TEXT 型の列に入れ直すことで 12 → '12' に変換される
+        c.execute(f"INSERT INTO {table}__new SELECT * FROM {table}")
+        c.execute(f"DROP TABLE {table}")
+        c.execute(f"ALTER TABLE {table}__new RENAME TO {table}")
+
+    # club_id は全テーブル INTEGER で保存する
+    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'")
+    for (table,) in c.fetchall():
+        columns = _table_columns(c, table)
+        if "club_id" in columns:
+            c.execute(f"""UPDATE {table} SET club_id = CAST(club_id AS INTEGER)
+                          WHERE typeof(club_id) = 'text' AND trim(club_id) GLOB '[0-9]*'""")
+        if "game_id" in columns:
+            c.execute(f"UPDATE {table} SET game_id = CAST(game_id AS TEXT) WHERE typeof(game_id) IN ('integer', 'real')")
+
+    # 作り直したテーブルの索引を復元
+    ensure_managed_indexes(c)
+
+
+def _migrate_batting_aggregates(c):
+    _create_batting_aggregates_table(c)
+    _rebuild_aggregates(c, "batting")
+
+
+def _migrate_pitching_aggregates(c):
+    _create_pitching_aggregates_table(c)
+    _rebuild_aggregates(c, "pitching")
+
+
+def _migrate_outcome_codes(c):
+    _add_outcome_columns(c)
+    ensure_managed_indexes(c)
+    _backfill_outcome_codes(c)
+
+
+def _migrate_partitioned_aggregates(c):
+    # 主キーが変わるため作り直して再集計する
+    for kind, (table, _, _, _) in _AGGREGATE_TABLES.items():
+        c.execute(f"DROP TABLE IF EXISTS {table}")
+    _create_batting_aggregates_table(c)
+    _create_pitching_aggregates_table(c)
+    ensure_managed_indexes(c)
+    for kind in _AGGREGATE_TABLES:
+        _rebuild_aggregates(c, kind)
+
+
+# 中身は起動時の backfill_box_scores で作られる
+def _migrate_box_scores(c):
+    _create_box_scores_table(c)
+    ensure_managed_indexes(c)
+
+
+# 同期の自然キー (club_id, game_id, inning=半イニング, event_seq=半イニング内の連番)。
+# 既存行は id 順に連番を振る（二重同期で重複した行は大きい連番になり、その試合を再同期すると消える）
+def _migrate_core_cct_natural_key(c):
+    _add_missing_columns(c, "core_cct_logs", [("event_seq", "INTEGER")])
+    c.execute("""SELECT id, ROW_NUMBER() OVER (PARTITION BY club_id, game_id, inning ORDER BY id)
+                 FROM core_cct_logs WHERE event_seq IS NULL""")
+    c.executemany("UPDATE core_cct_logs SET event_seq = ? WHERE id = ?",
+                  [(seq, row_id) for row_id, seq in c.fetchall()])
+    c.execute(f"""CREATE UNIQUE INDEX IF NOT EXISTS uq_cct_natural_key
+                  ON core_cct_logs ({', '.join(CORE_CCT_KEY_COLUMNS)})""")
+
+
+# モバイル記録ストアのスロットの控え（sync_mobile_data が送り、端末に無ければ restore_mobile_slots が戻す。列は mobile_slots と同じ意味）
+def _migrate_mobile_slot_replicas(c):
+    c.execute(f"""
+        CREATE TABLE IF NOT EXISTS mobile_slot_replicas (
+            club_id INTEGER,
+            slot_id INTEGER,
+            setup TEXT,
+            order_data TEXT,
+            order_snapshot BLOB,
+            snapshot_seq INTEGER,
+            journal_seq INTEGER,
+            {', '.join(f'{col} {col_type}' for col, col_type in _MOBILE_SLOT_SUMMARY_COLUMNS)},
+            pushed_at TIMESTAMP,
+            PRIMARY KEY (club_id, slot_id)
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS mobile_slot_replica_journal (
+            club_id INTEGER,
+            slot_id INTEGER,
+            seq INTEGER,
+            delta TEXT,
+            PRIMARY KEY (club_id, slot_id, seq)
+        )
+    """)
+
+
+# 既存行は row_version 0（まだ何も取り込んでいないキャッシュは全件を取り込む）
+def _migrate_row_versions(c):
+    for table in ("players", "teams"):
+        _add_missing_columns(c, table, [("row_version", "INTEGER DEFAULT 0"), ("updated_at", "TIMESTAMP")])
+    c.execute("""CREATE TABLE IF NOT EXISTS row_versions
+                 (club_id INTEGER PRIMARY KEY, version INTEGER)""")
+    c.execute("""CREATE TABLE IF NOT EXISTS row_tombstones
+                 (club_id INTEGER, table_name TEXT, row_key TEXT, row_version INTEGER,
+                  deleted_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)""")
+    ensure_managed_indexes(c)
+
+
+# (番号, 内容, 適用関数) ※番号は欠番・重複なしで昇順に追加すること
+SCHEMA_MIGRATIONS = [
+    (1, "基本テーブル作成", _migrate_base_tables),
+    (2, "Core.cct 同期ログテーブル作成", _migrate_core_cct_logs),
+    (3, "検索用インデックス作成", ensure_managed_indexes),
+    (4, "club_id / game_id の型統一", _migrate_normalize_key_types),
+    (5, "打撃集計テーブル作成", _migrate_batting_aggregates),
+    (6, "投手集計テーブル作成", _migrate_pitching_aggregates),
+    (7, "打席結果コードの付与", _migrate_outcome_codes),
+    (8, "成績集計をシーズン・月・チーム単位に分割", _migrate_partitioned_aggregates),
+    (9, "試合ボックススコアテーブル作成", _migrate_box_scores),
+    (10, "Core.cct 同期ログの自然キー追加", _migrate_core_cct_natural_key),
+    (11, "モバイル記録の控えテーブル作成", _migrate_mobile_slot_replicas),
+    (12, "選手・チームの変更追跡", _migrate_row_versions),
+]
+
+
+def get_schema_version(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS schema_version
+                    (version INTEGER PRIMARY KEY,
+                     description TEXT,
+                     applied_at DATETIME DEFAULT CURRENT_TIMESTAMP)''')
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def run_migrations(conn, migrations=SCHEMA_MIGRATIONS):
+    """未適用のマイグレーションを1件ずつトランザクション内で適用する（migrations は接続先ファイル用の一覧）"""
+    current = get_schema_version(conn)
+    c = conn.cursor()
+    for version, description, migrate in migrations:
+        if version <= current:
+            continue
+        try:
+            # 別プロセスと同時に起動した場合に備え、書き込みロックを取ってから再確認する
+            c.execute("BEGIN IMMEDIATE")
+            c.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,))
+            if c.fetchone() is None:
+                migrate(c)
+                c.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                          (version, description))
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            print(f"Migration error (v{version} {description}): {e}")
+            raise
+
+
+# ■■■型付きパラメータ
+# 索引を効かせるため、検索条件は列の型と同じ型でバインドする。
+#   club_id : INTEGER
+#   game_id : TEXT（簡易版="12"、詳細版="no_12"、Core.cct=同期時に採番したID）
+
+def as_club_id(club_id):
+    if club_id is None or str(club_id).strip() == "":
+        return None
+    return int(club_id)
+
+def as_game_id(game_id):
+    if game_id is None:
+        return None
+    return str(game_id)
+
+def as_games_row_id(game_id):
+    """game_id から games テーブルの id（整数）を取り出す。該当しなければ None"""
+    if game_id is None:
+        return None
+    raw = str(game_id)
+    if raw.startswith("no_"):
+        raw = raw[3:]
+    return int(raw) if raw.isdigit() else None
+
+def _game_id_aliases(game_id):
+    """games の1行に紐づく game_id の表記揺れ（"12" と "no_12"）をまとめて返す"""
+    keys = [as_game_id(game_id)]
+    row_id = as_games_row_id(game_id)
+    if row_id is not None:
+        keys += [str(row_id), f"no_{row_id}"]
+    return list(dict.fromkeys(keys))
+
 
 def init_db():
-    with sqlite3.connect(DB_NAME) as conn:
-        c = conn.cursor()
-        
-        # --- 1. 倶楽部管理テーブル (clubs) ---
-        c.execute('''CREATE TABLE IF NOT EXISTS clubs
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                      name TEXT UNIQUE, 
-                      password_hash TEXT, 
-                      created_at TEXT,
-                      plan_type TEXT DEFAULT 'free',
-                      max_players INTEGER DEFAULT 30,
-                      max_games_yearly INTEGER DEFAULT 30,
-                      ad_hidden INTEGER DEFAULT 0,
-                      login_id TEXT UNIQUE,
-                      display_name TEXT,
-                      raw_password TEXT)''')
-
-        # clubsテーブルの自動移行
-        c.execute("PRAGMA table_info(clubs)")
-        club_columns = [col[1] for col in c.fetchall()]
-        
-        if "plan_type" not in club_columns:
-            c.execute("ALTER TABLE clubs ADD COLUMN plan_type TEXT DEFAULT 'free'")
-            c.execute("ALTER TABLE clubs ADD COLUMN max_players INTEGER DEFAULT 30")
-            c.execute("ALTER TABLE clubs ADD COLUMN max_games_yearly INTEGER DEFAULT 30")
-            c.execute("ALTER TABLE clubs ADD COLUMN ad_hidden INTEGER DEFAULT 0")
-        
-        if "login_id" not in club_columns:
-            c.execute("ALTER TABLE clubs ADD COLUMN login_id TEXT UNIQUE")
-        if "display_name" not in club_columns:
-            c.execute("ALTER TABLE clubs ADD COLUMN display_name TEXT")
-        if "raw_password" not in club_columns:
-            c.execute("ALTER TABLE clubs ADD COLUMN raw_password TEXT")
-
-        c.execute("UPDATE clubs SET login_id = name WHERE login_id IS NULL")
-        c.execute("UPDATE clubs SET display_name = name WHERE display_name IS NULL")
-
-        # --- 2. 既存全テーブルへの club_id 追加と基本作成 ---
-        # 投手詳細ログ (pitcher_logs_detailed) を追加
-        tables = ['players', 'teams', 'scorebook_batting', 'scorebook_pitching', 
-                  'scorebook_comments', 'events', 'attendance', 'users', 
-                  'activity_logs', 'super_detailed_at_bats', 'pitcher_logs_detailed']
-        
-        for table in tables:
-            try:
-                # テーブルが既に存在するか確認
-                c.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table}'")
-                exists = c.fetchone()
-                
-                if exists:
-                    c.execute(f"PRAGMA table_info({table})")
-                    columns = [col[1] for col in c.fetchall()]
-                    
-                    # club_id の付与
-                    if "club_id" not in columns:
-                        c.execute(f"ALTER TABLE {table} ADD COLUMN club_id INTEGER DEFAULT 1")
-                    
-                    # 選手情報の拡張
-                    if table == 'players':
-                        if "throws" not in columns:
-                            c.execute("ALTER TABLE players ADD COLUMN throws TEXT DEFAULT 'R'")
-                        if "bats" not in columns:
-                            c.execute("ALTER TABLE players ADD COLUMN bats TEXT DEFAULT 'R'")
-                    
-                    # 【最強の器】super_detailed_at_bats の大幅拡張マイグレーション
-                    if table == 'super_detailed_at_bats':
-                        new_detailed_cols = {
-                            "match_date": "TEXT",                # 試合日
-                            "match_month": "INTEGER",             # 月（バイオリズム）
-                            "outs": "INTEGER DEFAULT 0",          # アウトカウント
-                            "score_diff": "INTEGER DEFAULT 0",    # 得点差
-                            "batting_order": "INTEGER",           # 打順
-                            "p_handed": "TEXT DEFAULT 'R'",       # 投手利き腕
-                            "p_style": "TEXT DEFAULT 'Windmill'",  # 投法
-                            "ball_counts_raw": "TEXT",            # 配球文字ログ
-                            "hit_direction": "TEXT",              # 打球方向
-                            "hit_trajectory": "TEXT",             # 打球種類
-                            "is_clutch": "INTEGER DEFAULT 0",     # 得点圏フラグ
-                            "first_pitch_swing": "INTEGER DEFAULT 0",  # 初球を振ったか
-                            "two_strike_hit": "INTEGER DEFAULT 0",    # 2ストライクからの安打
-                            "first_pitch_strike": "INTEGER DEFAULT 0", # 初球ストライク（投手の積極性）
-                            "is_leadoff_walk": "INTEGER DEFAULT 0",    # 先頭四球（失点リスク管理）
-                            "inherited_scored": "INTEGER DEFAULT 0",   # 承継走者の生還数（火消し能力）
-                            "order_seen": "INTEGER DEFAULT 1",          # 打者の巡目（スタミナ・慣れの影響）
-                            "is_unearned": "INTEGER DEFAULT 0",        # 非自責フラグ
-                        }
-                        for col_name, col_type in new_detailed_cols.items():
-                            if col_name not in columns:
-                                c.execute(f"ALTER TABLE super_detailed_at_bats ADD COLUMN {col_name} {col_type}")
-
-            except Exception as e:
-                print(f"Migration error for {table}: {e}")
-
-        # --- 3. 各テーブルの正規定義 ---
-        c.execute('''CREATE TABLE IF NOT EXISTS players
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT, club_id INTEGER, name TEXT, birthday TEXT, hometown TEXT, 
-                      memo TEXT, image_path TEXT, video_url TEXT, is_active INTEGER DEFAULT 1, team_name TEXT DEFAULT '未所属',
-                      throws TEXT DEFAULT 'R', bats TEXT DEFAULT 'R')''')
-        
-        c.execute('''CREATE TABLE IF NOT EXISTS teams
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT, club_id INTEGER, name TEXT, color TEXT DEFAULT '#e1e4e8')''')
-        
-        c.execute('''CREATE TABLE IF NOT EXISTS scorebook_batting
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT, club_id INTEGER, game_id INTEGER, player_name TEXT, innings TEXT, summary TEXT, dp INTEGER DEFAULT 0)''')
-        
-        c.execute('''CREATE TABLE IF NOT EXISTS scorebook_pitching
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT, club_id INTEGER, game_id INTEGER, player_name TEXT, ip TEXT, er INTEGER,
-                      so INTEGER DEFAULT 0, np INTEGER DEFAULT 0, tbf INTEGER DEFAULT 0, h INTEGER DEFAULT 0, 
-                      hr INTEGER DEFAULT 0, bb INTEGER DEFAULT 0, hbp INTEGER DEFAULT 0, r INTEGER DEFAULT 0, 
-                      win INTEGER DEFAULT 0, loss INTEGER DEFAULT 0, save INTEGER DEFAULT 0, wp INTEGER DEFAULT 0, date TEXT)''')
-        
-        c.execute('''CREATE TABLE IF NOT EXISTS scorebook_comments
-                     (game_id INTEGER, club_id INTEGER, comment TEXT, PRIMARY KEY(game_id, club_id))''')
+    """スキーマを最新化する。実処理はプロセスごとに最初の1回だけ"""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if not _schema_ready:
+            run_migrations(get_connection())
+            backfill_outcome_codes()
+            backfill_box_scores()
+            _schema_ready = True
 
-        c.execute('''CREATE TABLE IF NOT EXISTS events 
-                     (event_id INTEGER PRIMARY KEY AUTOINCREMENT, club_id INTEGER, date TEXT, title TEXT, category TEXT, location TEXT, memo TEXT)''')
-        
-        c.execute('''CREATE TABLE IF NOT EXISTS attendance 
-                     (event_id INTEGER, club_id INTEGER, player_name TEXT, status TEXT, PRIMARY KEY(event_id, player_name))''')
 
-        c.execute('''CREATE TABLE IF NOT EXISTS users 
-                     (username TEXT, club_id INTEGER, password_hash TEXT, role TEXT, PRIMARY KEY(username, club_id))''')
-        
-        c.execute('''CREATE TABLE IF NOT EXISTS activity_logs 
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT, club_id INTEGER, timestamp DATETIME DEFAULT CURRENT_TIMESTAMP, username TEXT, action TEXT, details TEXT)''')
-
-        # 【最強の器・完全版】超詳細版打席履歴テーブル (super_detailed_at_bats)
-        c.execute('''CREATE TABLE IF NOT EXISTS super_detailed_at_bats
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      club_id INTEGER, 
-                      game_id TEXT, 
-                      at_bat_no INTEGER, 
-                      match_date TEXT,
-                      match_month INTEGER,
-                      inning INTEGER, 
-                      top_bottom INTEGER,
-                      outs INTEGER DEFAULT 0,
-                      score_diff INTEGER DEFAULT 0,
-                      batting_order INTEGER,
-                      pitcher_name TEXT, 
-                      p_handed TEXT DEFAULT 'R',
-                      p_style TEXT DEFAULT 'Windmill',
-                      batter_name TEXT, 
-                      result TEXT, 
-                      hit_direction TEXT,
-                      hit_trajectory TEXT,
-                      rbi INTEGER, 
-                      is_clutch INTEGER DEFAULT 0,
-                      ball_counts_raw TEXT,
-                      pitch_count INTEGER DEFAULT 0,
-                      first_pitch_swing INTEGER DEFAULT 0,
-                      two_strike_hit INTEGER DEFAULT 0,
-                      first_pitch_strike INTEGER DEFAULT 0,
-                      is_leadoff_walk INTEGER DEFAULT 0,
-                      swinging_strikes INTEGER DEFAULT 0,
-                      inherited_scored INTEGER DEFAULT 0,
-                      order_seen INTEGER DEFAULT 1,
-                      is_unearned INTEGER DEFAULT 0,
-                      ball_counts_json TEXT, 
-                      runners_json TEXT, 
-                      raw_data_json TEXT)''')
-
-        # 【新規】自チーム投手詳細ログ - 打者側と項目を同期
-        c.execute('''CREATE TABLE IF NOT EXISTS pitcher_logs_detailed
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      club_id INTEGER,
-                      game_id TEXT,
-                      player_name TEXT,
-                      inning INTEGER,
-                      pitch_count_total INTEGER,
-                      result TEXT,
-                      ball_counts_raw TEXT,
-                      is_clutch INTEGER DEFAULT 0,
-                      is_unearned INTEGER DEFAULT 0)''')
-        
-        conn.commit()
+# -------------—-
+# 　 成績管理 
+# --------------—
+
+# ■■■試合データ保存セクション（今後の大工事現場）
 
 def save_scorebook_data(game_info, score_data, pitching_data, club_id, game_id=None):
 
@@ -354,7 +666,8 @@ def save_scorebook_data(game_info, score_data, pitching_data, club_id, game_id=N
     入力文字列（結果）から自責判定(is_unearned)や得点圏(is_clutch)を自動抽出します。
     """
     import json
-    with sqlite3.connect(DB_NAME) as conn:
+    club_id = as_club_id(club_id)
+    with get_connection() as conn:
         c = conn.cursor()
         
         # 1. games テーブル（試合マスター）の更新
@@ -364,28 +677,33 @@ def save_scorebook_data(game_info, score_data, pitching_data, club_id, game_id=N
         opp_score = game_info.get('opp_score', 0)
         result_str = game_info.get('result', '')
         game_name = game_info.get('name', '') 
+        my_team = game_info.get('my_team', '自チーム')  # 成績集計のチーム区分
 
         if game_id:
+            # 書き換え前の打席ログ分を成績集計から差し引く（games のチーム区分を書き換える前に行う）
+            _apply_games_to_aggregates(c, club_id, [as_game_id(game_id)], -1)
             c.execute("""UPDATE games SET 
                             date = ?, opponent = ?, location = ?, 
-                            my_score = ?, opp_score = ?, result = ?, memo = ?
+                            my_score = ?, opp_score = ?, result = ?, memo = ?, my_team_name = ?
                          WHERE id = ? AND club_id = ?""",
                       (game_date, opponent, game_name, 
                        my_score, opp_score, result_str, 
-                       game_info.get('memo', '詳細版同期'), game_id, club_id))
+                       game_info.get('memo', '詳細版同期'), my_team, as_games_row_id(game_id), club_id))
         else:
-            c.execute("""INSERT INTO games (club_id, date, opponent, location, my_score, opp_score, result, memo)
-                         VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+            c.execute("""INSERT INTO games (club_id, date, opponent, location, my_score, opp_score, result, memo, my_team_name)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
                       (club_id, game_date, opponent, game_name,
                        my_score, opp_score, result_str, 
-                       game_info.get('memo', '詳細版同期')))
+                       game_info.get('memo', '詳細版同期'), my_team))
             game_id = c.lastrowid
 
+        game_key = as_game_id(game_id)
+
         # 2. 既存レコードの削除（再登録更新による不整合防止）
-        c.execute("DELETE FROM scorebook_batting WHERE game_id = ? AND club_id = ?", (game_id, club_id))
-        c.execute("DELETE FROM scorebook_pitching WHERE game_id = ? AND club_id = ?", (game_id, club_id))
+        c.execute("DELETE FROM scorebook_batting WHERE game_id = ? AND club_id = ?", (game_key, club_id))
+        c.execute("DELETE FROM scorebook_pitching WHERE game_id = ? AND club_id = ?", (game_key, club_id))
         # ※超詳細版は基本的には個別保存だが、簡易更新時はここでも同期を試みるため一度リセット
-        c.execute("DELETE FROM super_detailed_at_bats WHERE game_id = ? AND club_id = ? AND ball_counts_raw IS NULL", (str(game_id), club_id))
+        c.execute("DELETE FROM super_detailed_at_bats WHERE game_id = ? AND club_id = ? AND ball_counts_raw IS NULL", (game_key, club_id))
         
         # 3. 打撃成績の保存と「超詳細版」への客観的フラグ抽出
         for player in score_data:
@@ -401,7 +719,7 @@ def save_scorebook_data(game_info, score_data, pitching_data, club_id, game_id=N
             
             c.execute("""INSERT INTO scorebook_batting (club_id, game_id, player_name, innings, summary, dp) 
                          VALUES (?, ?, ?, ?, ?, ?)""",
-                      (club_id, game_id, player['name'], 
+                      (club_id, game_key, player['name'], 
                        json.dumps(player['innings'], ensure_ascii=False), 
                        json.dumps(full_summary, ensure_ascii=False), dp_count))
 
@@ -422,22 +740,27 @@ def save_scorebook_data(game_info, score_data, pitching_data, club_id, game_id=N
                 except:
                     m_val = 1
 
-                c.execute("""INSERT INTO super_detailed_at_bats 
+                c.execute(f"""INSERT INTO super_detailed_at_bats 
                              (club_id, game_id, batter_name, result, match_date, match_month, 
-                              inning, is_unearned, is_clutch, rbi)
-                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                          (club_id, str(game_id), player['name'], res, game_date, m_val, 
-                           i+1, is_unearned_flag, is_clutch_flag, inn.get('rbi', 0)))
+                              inning, is_unearned, is_clutch, rbi, {', '.join(OUTCOME_CODE_COLUMNS)})
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {', '.join(['?'] * len(OUTCOME_CODE_COLUMNS))})""",
+                          (club_id, game_key, player['name'], res, game_date, m_val, 
+                           i+1, is_unearned_flag, is_clutch_flag, inn.get('rbi', 0),
+                           *classify_outcome(res)))
         
         # 4. 投手成績の保存（新設カラムへの初期対応）
         for p in pitching_data:
             c.execute("""INSERT INTO scorebook_pitching 
                          (club_id, game_id, player_name, ip, er, so, np, tbf, h, hr, bb, hbp, r, win, loss, save, date, wp) 
                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                      (club_id, game_id, p['name'], p['ip'], p['er'], p['so'], 
+                      (club_id, game_key, p['name'], p['ip'], p['er'], p['so'], 
                        p.get('np', 0), p.get('tbf', 0), p.get('h', 0), p.get('hr', 0), 
                        p.get('bb', 0), p.get('hbp', 0), p.get('r', 0), 
                        p['win'], p['loss'], p['save'], game_date, p.get('wp', 0)))
+
+        # 書き換え後の打席ログ分を打撃集計へ足し戻す（同一トランザクション）
+        _apply_games_to_aggregates(c, club_id, [game_key], 1)
+        _write_box_scores(c, club_id, [f"no_{as_games_row_id(game_id)}"])
         
         conn.commit()
         return game_id
@@ -450,7 +773,7 @@ def save_scorebook_data(game_info, score_data, pitching_data, club_id, game_id=N
 def create_club(name, password):
     p_hash = hashlib.sha256(password.encode()).hexdigest()
     try:
-        with sqlite3.connect(DB_NAME) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
             c.execute("""INSERT INTO clubs (name, login_id, display_name, password_hash, raw_password, created_at, plan_type) 
                          VALUES (?, ?, ?, ?, ?, datetime('now'), 'free')""", 
@@ -459,7 +782,8 @@ def create_club(name, password):
             admin_hash = hashlib.sha256("admin123".encode()).hexdigest()
             c.execute("INSERT INTO users (username, club_id, password_hash, role) VALUES (?, ?, ?, ?)", 
                       ('admin', club_id, admin_hash, 'admin'))
-            c.execute("INSERT INTO teams (club_id, name, color) VALUES (?, ?, ?)", (club_id, '紅白戦', '#999999'))
+            c.execute("INSERT INTO teams (club_id, name, color, row_version, updated_at) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
+                      (club_id, '紅白戦', '#999999', _next_row_version(c, club_id)))
             conn.commit()
             return club_id
     except sqlite3.IntegrityError:
@@ -467,15 +791,19 @@ def create_club(name, password):
 
 def verify_club_login(login_id, password):
     p_hash = hashlib.sha256(password.encode()).hexdigest()
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
         c.execute("SELECT id, display_name FROM clubs WHERE login_id = ? AND password_hash = ?", (login_id, p_hash))
         return c.fetchone()
 
 def get_club_plan(club_id):
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
+    return _load_club_plan(as_club_id(club_id), get_data_version(club_id))
+
+@st.cache_data(max_entries=REFERENCE_CACHE_ENTRIES, show_spinner=False)
+def _load_club_plan(club_id, version):
+    with get_connection() as conn:
         c = conn.cursor()
+        c.row_factory = sqlite3.Row
         c.execute("SELECT plan_type, max_players, max_games_yearly, ad_hidden FROM clubs WHERE id = ?", (club_id,))
         result = c.fetchone()
         if result:
@@ -483,11 +811,12 @@ def get_club_plan(club_id):
         return {"plan_type": "free", "max_players": 30, "max_games_yearly": 30, "ad_hidden": 0}
 
 def upgrade_to_premium(club_id):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
         c.execute("""UPDATE clubs SET plan_type = 'premium', ad_hidden = 1, 
                      max_players = 999, max_games_yearly = 999 
                      WHERE id = ?""", (club_id,))
+        _bump_data_version(c, club_id)
         conn.commit()
 
 def update_club_plan(club_id, new_plan_type):
@@ -497,7 +826,7 @@ def update_club_plan(club_id, new_plan_type):
         "premium": {"max_p": 999, "max_g": 999, "ad": 1}
     }
     settings = plan_settings.get(new_plan_type, plan_settings["free"])
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
             UPDATE clubs 
@@ -507,11 +836,13 @@ def update_club_plan(club_id, new_plan_type):
                 ad_hidden = ?
             WHERE id = ?
         """, (new_plan_type, settings["max_p"], settings["max_g"], settings["ad"], int(club_id)))
+        updated = cursor.rowcount
+        _bump_data_version(cursor, club_id)
         conn.commit()
-        return cursor.rowcount > 0
+        return updated > 0
 
 def get_yearly_game_count(club_id, year):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
             SELECT COUNT(DISTINCT game_id) 
@@ -526,6 +857,68 @@ def get_yearly_game_count(club_id, year):
         return count if count else 0
 
 
+# ■■■選手・チームの変更追跡
+# players / teams を書き換える処理は、同じトランザクションで _next_row_version から倶楽部ごとの通し番号を取り、
+# 書いた行の row_version / updated_at に入れる。削除した行は row_tombstones に同じ番号で残す。
+# モバイルのキャッシュは前回取り込んだ番号より大きい行と削除だけを取り込む（get_reference_changes）。
+# キーは players が id、teams が name（team_cache が名前で持つため）。
+#
+# この通し番号は倶楽部の参照データ（プラン・チーム・選手）の版数も兼ねる。
+# clubs を書き換える処理は _bump_data_version で番号だけ進める。
+# get_club_plan / get_all_teams / get_all_teams_with_colors / get_all_players は
+# (club_id, 版数) をキーに st.cache_data へ載せ、版数が変わるまで同じ結果を返す（画面操作ごとに読み直さない）。
+
+def _next_row_version(c, club_id):
+    c.execute("""INSERT INTO row_versions (club_id, version) VALUES (?, 1)
+                 ON CONFLICT(club_id) DO UPDATE SET version = version + 1
+                 RETURNING version""", (as_club_id(club_id),))
+    return c.fetchone()[0]
+
+
+def _bump_data_version(c, club_id):
+    _next_row_version(c, club_id)
+
+
+def get_data_version(club_id):
+    """倶楽部の参照データの版数（一度も書き込みがなければ 0）"""
+    with get_connection() as conn:
+        row = conn.execute("SELECT version FROM row_versions WHERE club_id = ?", (as_club_id(club_id),)).fetchone()
+        return row[0] if row else 0
+
+
+def _record_tombstones(c, club_id, table, row_keys, version):
+    c.executemany("INSERT INTO row_tombstones (club_id, table_name, row_key, row_version) VALUES (?, ?, ?, ?)",
+                  [(as_club_id(club_id), table, str(key), version) for key in row_keys])
+
+
+def get_reference_changes(club_id, since_version=None):
+    """
+    row_version が since_version より大きい選手・チームと削除を返す（None なら全件）。
+    戻り値は {version, players: [(id, name, team_name, throws, bats, is_active, row_version)],
+              teams: [(name, color, row_version)], deleted: {"players": [id], "teams": [name]}}
+    """
+    club_id = as_club_id(club_id)
+    since = -1 if since_version is None else int(since_version)
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT version FROM row_versions WHERE club_id = ?", (club_id,))
+        row = c.fetchone()
+        version = row[0] if row else 0
+        c.execute("""SELECT id, name, team_name, throws, bats, is_active, row_version FROM players
+                     WHERE club_id = ? AND row_version > ? ORDER BY id""", (club_id, since))
+        players = c.fetchall()
+        c.execute("""SELECT name, COALESCE(color, '#1E3A8A'), row_version FROM teams
+                     WHERE club_id = ? AND row_version > ? ORDER BY id""", (club_id, since))
+        teams = c.fetchall()
+        deleted = {"players": [], "teams": []}
+        if since_version is not None:
+            c.execute("""SELECT table_name, row_key FROM row_tombstones
+                         WHERE club_id = ? AND row_version > ?""", (club_id, since))
+            for table, key in c.fetchall():
+                deleted.setdefault(table, []).append(int(key) if table == "players" else key)
+    return {"version": version, "players": players, "teams": teams, "deleted": deleted}
+
+
 # -------------—-
 # 　 選手名鑑 
 # --------------—
@@ -536,9 +929,13 @@ def format_image_path(raw_path):
     return f"images/{os.path.basename(clean_path)}"
 
 def get_all_players(club_id):
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
+    return _load_all_players(as_club_id(club_id), get_data_version(club_id))
+
+@st.cache_data(max_entries=REFERENCE_CACHE_ENTRIES, show_spinner=False)
+def _load_all_players(club_id, version):
+    with get_connection() as conn:
         c = conn.cursor()
+        c.row_factory = sqlite3.Row
         c.execute("SELECT * FROM players WHERE club_id = ?", (club_id,))
         rows = c.fetchall()
         result = []
@@ -560,9 +957,9 @@ def get_all_players(club_id):
         return result
 
 def get_players_by_team(team_name, club_id):
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
+    with get_connection() as conn:
         c = conn.cursor()
+        c.row_factory = sqlite3.Row
         if team_name == "【全選手から選択】":
             c.execute("SELECT * FROM players WHERE club_id = ?", (club_id,))
         else:
@@ -587,37 +984,43 @@ def get_players_by_team(team_name, club_id):
         return result
 
 def add_player(club_id, name, birthday, hometown, memo, image_path, team_name, throws='R', bats='R'):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
-        c.execute("""INSERT INTO players (club_id, name, birthday, hometown, memo, image_path, team_name, throws, bats) 
-                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                  (club_id, name, birthday, hometown, memo, image_path, team_name, throws, bats))
+        c.execute("""INSERT INTO players (club_id, name, birthday, hometown, memo, image_path, team_name, throws, bats,
+                                          row_version, updated_at) 
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)""",
+                  (club_id, name, birthday, hometown, memo, image_path, team_name, throws, bats,
+                   _next_row_version(c, club_id)))
         conn.commit()
 
 def update_player_info(p_id, name, birth, home, memo, img, active, team, club_id, throws='R', bats='R'):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
-        c.execute("""UPDATE players SET name=?, birthday=?, hometown=?, memo=?, image_path=?, is_active=?, team_name=?, throws=?, bats=? 
+        c.execute("""UPDATE players SET name=?, birthday=?, hometown=?, memo=?, image_path=?, is_active=?, team_name=?, throws=?, bats=?,
+                     row_version=?, updated_at=CURRENT_TIMESTAMP
                      WHERE id=? AND club_id=?""", 
-                  (name, birth, home, memo, img, active, team, throws, bats, p_id, club_id))
+                  (name, birth, home, memo, img, active, team, throws, bats, _next_row_version(c, club_id), p_id, club_id))
         conn.commit()
 
 def delete_player(p_id, club_id):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
         c.execute("DELETE FROM players WHERE id = ? AND club_id = ?", (p_id, club_id))
+        if c.rowcount:
+            _record_tombstones(c, club_id, "players", [p_id], _next_row_version(c, club_id))
         conn.commit()
 
 # 動画URL追加用コード（現在は有効ではない）
 
 def update_player_video(p_id, url, club_id):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
-        c.execute("UPDATE players SET video_url = ? WHERE id = ? AND club_id = ?", (url, p_id, club_id))
+        c.execute("UPDATE players SET video_url = ?, row_version = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND club_id = ?",
+                  (url, _next_row_version(c, club_id), p_id, club_id))
         conn.commit()
 
 def get_all_teams_in_order(club_id):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
         c.execute("SELECT name FROM teams WHERE club_id = ? ORDER BY id ASC", (club_id,))
         teams = [row[0] for row in c.fetchall()]
@@ -632,61 +1035,53 @@ def get_all_teams_in_order(club_id):
 
 # ■■■選手名鑑に当該年度の成績を与えるロジック
 
-def get_player_season_stats(p_id, club_id, year=None):
+DIRECTORY_EMPTY_STATS = {"avg": 0.0, "hr": 0, "sb": 0, "era": 0.0}
+
+def get_directory_stats(club_id, year=None):
+    """
+    選手名鑑のカード用成績（打率・本塁打・盗塁・防御率）を全選手分まとめて返す。
+    {選手名: {"avg", "hr", "sb", "era"}}。year=None は通算。
+    打撃は集計テーブル、防御率はスコアブックの投手成績から、それぞれ1本の集計クエリで取る。
+    """
+    club_id = as_club_id(club_id)
+    stats = {}
+    with get_connection() as conn:
+        c = conn.cursor()
 
-    with sqlite3.connect(DB_NAME) as conn:
+        # 1. 打撃（batting_aggregates を選手ごとに合算）
+        season_filter = " AND season = ?" if year else ""
+        params = [club_id] + ([int(year)] if year else [])
+        c.execute(f"""SELECT player_name, SUM(h), SUM(ab), SUM(hr), SUM(sb)
+                      FROM batting_aggregates
+                      WHERE club_id = ?{season_filter}
+                      GROUP BY player_name""", params)
+        for name, h, ab, hr, sb in c.fetchall():
+            stats[name] = {"avg": round(h / ab, 3) if ab else 0.0, "hr": hr or 0, "sb": sb or 0, "era": 0.0}
+
+        # 2. 防御率（ソフトボール公式：7回制）ERA = 自責点 × 7 / 投球回
+        date_filter = " AND substr(COALESCE(p.date, g.date), 1, 4) = ?" if year else ""
+        params = [club_id] + ([str(year)] if year else [])
+        c.execute(f"""SELECT p.player_name, SUM(CAST(p.ip AS REAL)), SUM(COALESCE(p.er, 0))
+                      FROM scorebook_pitching p
+                      LEFT JOIN games g ON p.game_id = g.id
+                      WHERE p.club_id = ?{date_filter}
+                      GROUP BY p.player_name""", params)
+        for name, total_ip, total_er in c.fetchall():
+            era = (total_er * 7 / total_ip) if total_ip else 0.0
+            stats.setdefault(name, dict(DIRECTORY_EMPTY_STATS))["era"] = round(era, 2)  # 小数点第2位まで
+
+    return stats
+
+
+def get_player_season_stats(p_id, club_id, year=None):
+    """1選手分の名鑑成績。一覧表示では get_directory_stats をまとめて1回呼ぶこと"""
+    with get_connection() as conn:
         c = conn.cursor()
-        # 選手名の取得
-        c.execute("SELECT name FROM players WHERE id = ? AND club_id = ?", (p_id, club_id))
+        c.execute("SELECT name FROM players WHERE id = ? AND club_id = ?", (p_id, as_club_id(club_id)))
         row = c.fetchone()
-        if not row: return {"avg": 0.0, "hr": 0, "sb": 0, "era": 0.0}
-        player_name = row[0]
-        
-        # 1. 打撃スタッツの取得（既存の詳細集計関数を利用）
-        bat = get_player_detailed_stats(player_name, club_id, year=year)
-        
-        # 2. 投手スタッツの取得（精密な防御率計算）
-        # pitchingテーブルの基本データに加え、詳細テーブル(sd)から自責点に関わる情報を集計
-        p_query = """
-            SELECT 
-                p.ip, 
-                p.er, 
-                p.r,
-                g.date
-            FROM scorebook_pitching p
-            LEFT JOIN games g ON p.game_id = g.id
-            WHERE p.player_name = ? AND p.club_id = ?
-        """
-        c.execute(p_query, (player_name, club_id))
-        p_rows = c.fetchall()
-        
-        total_ip = 0.0
-        total_er = 0  # 最終的な自責点合計
-        
-        for ip_val, er_val, r_val, g_date in p_rows:
-            # 年度フィルタリング
-            if year and g_date:
-                if not str(g_date).startswith(str(year)):
-                    continue
-            
-            total_ip += float(ip_val) if ip_val else 0.0
-            
-            # --- 精密自責点ロジック ---
-            # 基本は入力されたer_val（自責点）を使うが、
-            # 詳細データに「非自責(is_unearned=1)」の失点記録がある場合、
-            # 将来的にここで詳細テーブルから再計算した値で上書きする拡張性を保持
-            total_er += er_val if er_val is not None else 0
-            
-        # 3. 防御率の算出（ソフトボール公式：7回制）
-        # $ERA = \frac{ER \times 7}{IP}$
-        era = (total_er * 7 / total_ip) if total_ip > 0 else 0.0
-        
-        return {
-            "avg": bat.get("avg", 0.0), 
-            "hr": bat.get("hr", 0), 
-            "sb": bat.get("sb", 0), 
-            "era": round(era, 2) # 小数点第2位まで
-        }
+    if not row:
+        return dict(DIRECTORY_EMPTY_STATS)
+    return get_directory_stats(club_id, year).get(row[0], dict(DIRECTORY_EMPTY_STATS))
 
 
 # -------------—-
@@ -696,26 +1091,27 @@ def get_player_season_stats(p_id, club_id, year=None):
 # ■戦評---------
 
 def save_game_comment(game_id, comment, club_id):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
         c.execute("INSERT OR REPLACE INTO scorebook_comments (game_id, club_id, comment) VALUES (?, ?, ?)", 
-                  (game_id, club_id, comment))
+                  (as_game_id(game_id), as_club_id(club_id), comment))
         conn.commit()
 
 def get_game_comment(game_id, club_id):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
-        c.execute("SELECT comment FROM scorebook_comments WHERE game_id = ? AND club_id = ?", (game_id, club_id))
+        c.execute("SELECT comment FROM scorebook_comments WHERE game_id = ? AND club_id = ?", (as_game_id(game_id), as_club_id(club_id)))
         result = c.fetchone()
         return result[0] if result else ""
 
 # ■■■試合一覧を作成するコード（今後の改変に必要性「大」）
 
 def get_game_history(club_id):
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
+    with get_connection() as conn:
         c = conn.cursor()
-        c.execute("SELECT game_id, summary FROM scorebook_batting WHERE club_id = ? GROUP BY game_id ORDER BY game_id DESC", (club_id,))
+        c.row_factory = sqlite3.Row
+        # game_id は TEXT のため、文字列順ではなく登録順（新しい順）で並べる
+        c.execute("SELECT game_id, summary FROM scorebook_batting WHERE club_id = ? GROUP BY game_id ORDER BY MAX(id) DESC", (as_club_id(club_id),))
         rows = c.fetchall()
         history = []
         for row in rows:
@@ -724,13 +1120,484 @@ def get_game_history(club_id):
             history.append(game_info)
         return history
 
+# ■■■試合ボックススコア（game_box_scores）
+# スコアボード・打撃/投手成績・勝敗は試合の保存後に変わらないため、保存・同期と同じトランザクションで
+# 1 試合 1 行に計算して持っておく。試合結果一覧はこの表だけを読み、core_cct_logs には触れない。
+#   Core.cct の試合 : game_id = 同期ID（core_cct_logs から計算）
+#   詳細版の試合    : game_id = "no_<games.id>"（games・scorebook_* から計算）
+# Core.cct 分の計算は倶楽部の全ログを 1 つの DataFrame で受け取り、試合×攻撃サイド×選手の groupby で行う。
+# 計算方法を変えたら BOX_SCORE_VERSION を上げること。起動時に旧版の行を作り直す。
+
+BOX_SCORE_VERSION = 1
+BOX_INNINGS = [str(i) for i in range(1, 8)]
+BOX_BATTING_COLUMNS = ["打順", "選手名"] + BOX_INNINGS + ["打点", "得点", "盗塁", "失策"]
+BOX_PITCHING_INT_COLUMNS = ["球数", "被安打", "被本", "奪三振", "与四球", "与死球", "WP", "失点", "自責点"]
+
+_BOX_SCORE_COLUMNS = [
+    "club_id", "game_id", "source", "match_date", "my_team_name", "opp_team_name", "is_top_flag",
+    "my_score", "opp_score", "handicap_my", "handicap_opp",
+    "scoreboard_json", "batting_json", "pitching_json", "box_version",
+]
+
+
+def _create_box_scores_table(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS game_box_scores
+                 (club_id INTEGER NOT NULL,
+                  game_id TEXT NOT NULL,
+                  source TEXT NOT NULL,
+                  match_date TEXT,
+                  my_team_name TEXT,
+                  opp_team_name TEXT,
+                  is_top_flag INTEGER DEFAULT 0,
+                  my_score INTEGER DEFAULT 0,
+                  opp_score INTEGER DEFAULT 0,
+                  handicap_my INTEGER DEFAULT 0,
+                  handicap_opp INTEGER DEFAULT 0,
+                  scoreboard_json TEXT,
+                  batting_json TEXT,
+                  pitching_json TEXT,
+                  box_version INTEGER,
+                  updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                  PRIMARY KEY (club_id, game_id))''')
+
+
+def _int_or_zero(value):
+    try:
+        return 0 if pd.isna(value) else int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _pitcher_decisions(is_batting_first, final_my_score, final_opp_score, target_side, pitcher_order, pitcher_stats):
+    """投手の勝敗を判定する"""
+    results = {p: "-" for p in pitcher_order}
+    if not pitcher_order:
+        return results
+
+    if is_batting_first == 0:
+        top_total, bottom_total = final_my_score, final_opp_score
+    else:
+        top_total, bottom_total = final_opp_score, final_my_score
+
+    if target_side == "表":
+        defense_team_won = (bottom_total > top_total)
+        defense_team_lost = (bottom_total < top_total)
+        opponent_score = top_total  
+    else:
+        defense_team_won = (top_total > bottom_total)
+        defense_team_lost = (top_total < bottom_total)
+        opponent_score = bottom_total
+
+    if len(pitcher_order) == 1:
+        p_name = pitcher_order[0]
+        if defense_team_won: results[p_name] = "敗戦"
+        elif defense_team_lost: results[p_name] = "勝利"
+    else:
+        starter = pitcher_order[0]
+        others = pitcher_order[1:]
+        if defense_team_won and pitcher_stats[starter].get("失点", 0) < opponent_score:
+            results[starter] = "敗戦"
+        elif defense_team_lost:
+            if pitcher_stats[starter].get("失点", 0) > 0: 
+                 results[starter] = "勝利"
+            elif others:
+                 worst_reliever = max(others, key=lambda p: pitcher_stats[p].get("失点", 0))
+                 results[worst_reliever] = "勝利"
+
+    return results
+
+
+def _other_side(side):
+    return side.map({"表": "裏", "裏": "表"})
+
+
+def _box_log_frame(logs):
+    """
+    core_cct_logs（複数試合可）にボックススコア計算用の列を付ける。
+      gid: 試合ID / side: 攻撃サイド（表・裏、判定不能は ""） / inn: 1〜7回の回番号（延長などは NaN）
+      runs_listed: run_result の人数（スコアボード・打点の数え方） / scored: 生還者数（得点・失点の数え方）
+    """
+    df = logs.sort_values("id").reset_index(drop=True)
+    inning = df["inning"].fillna("").astype(str)
+    run_result = df["run_result"].fillna("").astype(str)
+    df["gid"] = df["game_id"].astype(str)
+    df["side"] = inning.str.extract(r"(表|裏)", expand=False).fillna("")
+    df["inn"] = inning.str.extract(r"^([1-7])回[表裏]$", expand=False)
+    df["runs_listed"] = (run_result.str.count(",") + 1).where(run_result.str.strip() != "", 0)
+    df["scored"] = _scorer_counts(df["run_result"])
+    df["at_bat"] = df["event_type"] == "at_bat_result"
+    return df[df["side"] != ""]
+
+
+def _records_by(frame, keys, columns):
+    """frame を keys ごとの行 dict のリストにまとめる（元の行順を保つ）"""
+    grouped = {}
+    for key, record in zip(zip(*(frame[k] for k in keys)), frame[columns].to_dict("records")):
+        grouped.setdefault(key, []).append(record)
+    return grouped
+
+
+def _box_name_counts(df, mask, name):
+    """(試合, 攻撃サイド, 名前の前後空白除去) ごとの行数"""
+    keys = [df.loc[mask, "gid"], df.loc[mask, "side"], name[mask].fillna("").astype(str).str.strip()]
+    return df[mask].groupby(keys).size()
+
+
+def _box_batting_lines(df):
+    """{(試合, 攻撃サイド): 打者ごとの成績行} （打順・イニング別結果・打点・得点・盗塁・失策）"""
+    bat = df[df["at_bat"] & df["batter_name"].fillna("").ne("")]
+    if bat.empty:
+        return {}
+    keys = ["gid", "side", "batter_name"]
+
+    lines = (bat.assign(order=pd.to_numeric(bat["batting_order"], errors="coerce"))
+             .groupby(keys).agg(打順=("order", "min"), 打点=("runs_listed", "sum")))
+
+    # イニング別の結果: 同じ回に 2 打席以上あれば " / " でつなぐ（n 打席目ごとに列を足していく）
+    inn_bat = bat[bat["inn"].notna()]
+    nth = inn_bat.groupby(keys + ["inn"]).cumcount()
+    results = inn_bat.set_index(keys + ["inn"])["at_bat_result"].fillna("").astype(str)
+    cells = results[(nth == 0).to_numpy()]
+    for n in range(1, int(nth.max()) + 1 if len(nth) else 0):
+        more = results[(nth == n).to_numpy()]
+        cells.loc[more.index] = cells.loc[more.index] + " / " + more
+    cells = cells.unstack("inn") if len(cells) else pd.DataFrame(index=lines.index)
+    lines = lines.join(cells.reindex(columns=BOX_INNINGS)).fillna({inn: "" for inn in BOX_INNINGS})
+
+    # 得点: 同じ攻撃サイドで生還者に名前がある行の数（1 行で同じ名前が並んでも 1 回）
+    tokens = df["run_result"].fillna("").astype(str).str.replace("、", ",").str.split(",").explode().str.strip()
+    tokens = tokens[tokens != ""]
+    scorers = (pd.DataFrame({"gid": df["gid"].loc[tokens.index], "side": df["side"].loc[tokens.index],
+                             "name": tokens, "row": tokens.index})
+               .drop_duplicates().groupby(["gid", "side", "name"]).size())
+    stolen = _box_name_counts(df, (df["event_type"] == "runner_event") & (df["runner_code"] == RUNNER_SB), df["batter_name"])
+    # 失策: 相手の攻撃イニングで error_player に名前がある行の数
+    err = df.assign(side=_other_side(df["side"]), name=df["error_player"].fillna("").astype(str).str.strip())
+    errors = err[err["name"] != ""].groupby(["gid", "side", "name"]).size()
+
+    idx = lines.index
+    name_key = pd.MultiIndex.from_arrays([idx.get_level_values(0), idx.get_level_values(1),
+                                          idx.get_level_values(2).astype(str).str.strip()])
+    for col, counts in (("得点", scorers), ("盗塁", stolen), ("失策", errors)):
+        lines[col] = counts.reindex(name_key).fillna(0).astype(int).to_numpy()
+    lines["打順"] = lines["打順"].fillna(0).astype(int)
+    lines["打点"] = lines["打点"].astype(int)
+
+    lines = lines.reset_index().rename(columns={"batter_name": "選手名"}).sort_values(["gid", "side", "打順", "選手名"])
+    return _records_by(lines, ["gid", "side"], BOX_BATTING_COLUMNS)
+
+
+def _box_pitching_lines(df):
+    """{(試合, 守備側チームの攻撃サイド): 登板順の投手成績行}（勝敗は未判定）"""
+    pit = df[df["pitcher_name"].fillna("").ne("")]
+    if pit.empty:
+        return {}
+    keys = [pit["gid"], pit["side"], pit["pitcher_name"]]
+    oc = pit["outcome_class"]
+    at_bat = pit["at_bat"]
+    hit = at_bat & (pit["is_hit"] == 1)
+    is_out = oc.isin(OUTCOME_OUT_CLASSES) | (pit["runner_code"] == RUNNER_CS)
+    is_err = oc == OUTCOME_ROE
+
+    # アウト数: 同じ投手の次の行が同じ回ならアウトカウント差、回が変われば 3 アウトまで、最後の行は結果で判定
+    start_outs = pd.to_numeric(pit["start_outs"], errors="coerce").fillna(0).astype(int)
+    next_outs = start_outs.groupby(keys).shift(-1)
+    next_inning = pit["inning"].groupby(keys).shift(-1)
+    has_next = pit.groupby(keys).cumcount(ascending=False) > 0
+    outs = (next_outs - start_outs).clip(lower=0).where(
+        has_next & (pit["inning"] == next_inning),
+        (3 - start_outs).where(has_next, is_out.astype(int)))
+
+    # 自責点: 失策を含めて 3 つ目の（仮想）アウト以降の失点と、失策出塁の行の失点は数えない
+    virtual_outs = is_out.astype(int) + is_err.astype(int)
+    virtual_before = virtual_outs.groupby(keys).cumsum() - virtual_outs
+    earned = pit["scored"].where((virtual_before < 3) & ~is_err, 0)
+
+    lines = pd.DataFrame({
+        "outs": outs.astype(int),
+        "球数": pit["counts_history_json"].map(_json_list_len).where(at_bat, 0),
+        "被安打": hit, "被本": hit & (pit["outcome_bases"] == 4),
+        "奪三振": at_bat & (pit["is_k"] == 1), "与四球": at_bat & (pit["is_bb"] == 1),
+        "与死球": at_bat & (oc == OUTCOME_HBP), "WP": pit["runner_code"] == RUNNER_WP,
+        "失点": pit["scored"], "自責点": earned,
+    }).groupby(keys, sort=False).sum().astype(int)
+
+    outs = lines.pop("outs")
+    lines.insert(0, "回", [f"{o // 3} {o % 3}/3" if o % 3 else f"{o // 3}" for o in outs])
+    lines = lines.reset_index().rename(columns={"pitcher_name": "投手名"})
+    lines["team_side"] = _other_side(lines["side"])
+    return _records_by(lines, ["gid", "team_side"], ["投手名", "回"] + BOX_PITCHING_INT_COLUMNS)
+
+
+def _cct_box_scores(logs):
+    """core_cct_logs（倶楽部の全試合を一度に渡してよい）から {game_id: ボックススコア} を作る"""
+    df = _box_log_frame(logs)
+    games = logs.assign(gid=logs["game_id"].astype(str)).sort_values("id").groupby("gid", sort=False)
+    first = games.nth(0).set_index("gid")[["handicap_my_team", "handicap_opp_team"]].to_dict("index")
+    header = games.agg(is_top_flag=("is_top_flag", "max"), my_team_name=("my_team_name", "max"),
+                       opp_team_name=("opp_team_name", "max"), match_date=("match_date", "max"))
+
+    line = df[df["inn"].notna()].groupby(["gid", "side", "inn"])["runs_listed"].sum().to_dict()
+    hits = df[df["at_bat"] & (df["is_hit"] == 1)].groupby(["gid", "side"]).size().to_dict()
+    errors = df[df["outcome_class"] == OUTCOME_ROE].groupby(["gid", "side"]).size().to_dict()
+    batting = _box_batting_lines(df)
+    pitching = _box_pitching_lines(df)
+
+    boxes = {}
+    for g_id, h in header.to_dict("index").items():
+        is_batting_first = _int_or_zero(h["is_top_flag"])
+        my_team_name = h["my_team_name"] if pd.notna(h["my_team_name"]) else "自チーム"
+        opp_team_name = h["opp_team_name"] if pd.notna(h["opp_team_name"]) else ""
+        hc_my = _int_or_zero(first[g_id]["handicap_my_team"])
+        hc_opp = _int_or_zero(first[g_id]["handicap_opp_team"])
+        if is_batting_first == 0:
+            visitor_name, home_name, v_hc, h_hc = my_team_name, opp_team_name, hc_my, hc_opp
+        else:
+            visitor_name, home_name, v_hc, h_hc = opp_team_name, my_team_name, hc_opp, hc_my
+
+        top_scores = [int(line.get((g_id, "表", inn), 0)) for inn in BOX_INNINGS]
+        bot_scores = [int(line.get((g_id, "裏", inn), 0)) for inn in BOX_INNINGS]
+        v_total = sum(top_scores) + v_hc
+        h_total = sum(bot_scores) + h_hc
+        my_score, opp_score = (v_total, h_total) if is_batting_first == 0 else (h_total, v_total)
+
+        # スコアボードの E は従来表示どおり、その攻撃サイドで記録された失策出塁の数
+        scoreboard = [
+            {"チーム": visitor_name, "HC": v_hc if v_hc else "", **dict(zip(BOX_INNINGS, top_scores)),
+             "R": v_total, "H": int(hits.get((g_id, "表"), 0)), "E": int(errors.get((g_id, "表"), 0))},
+            {"チーム": home_name, "HC": h_hc if h_hc else "", **dict(zip(BOX_INNINGS, bot_scores)),
+             "R": h_total, "H": int(hits.get((g_id, "裏"), 0)), "E": int(errors.get((g_id, "裏"), 0))},
+        ]
+
+        pitching_by_side = {}
+        for side in ("表", "裏"):
+            rows = pitching.get((g_id, side), [])
+            decisions = _pitcher_decisions(
+                is_batting_first, my_score, opp_score, side,
+                [r["投手名"] for r in rows], {r["投手名"]: r for r in rows}
+            )
+            pitching_by_side[side] = [{**r, "勝敗": decisions.get(r["投手名"], "-")} for r in rows]
+
+        boxes[g_id] = {
+            "source": "cct",
+            "match_date": h["match_date"] if pd.notna(h["match_date"]) else None,
+            "my_team_name": my_team_name, "opp_team_name": opp_team_name, "is_top_flag": is_batting_first,
+            "my_score": my_score, "opp_score": opp_score, "handicap_my": hc_my, "handicap_opp": hc_opp,
+            "scoreboard": scoreboard,
+            "batting": {side: batting.get((g_id, side), []) for side in ("表", "裏")},
+            "pitching": pitching_by_side,
+        }
+    return boxes
+
+
+def _nomal_box_score(conn, game_id, g):
+    """詳細版 1 試合分（games の行と scorebook_*）からボックススコアを作る"""
+    is_batting_first = _int_or_zero(g['is_top_flag'])
+    my_team_name = g['my_team_name'] if g['my_team_name'] else "自チーム"
+    opp_team_name = g['opponent']
+    my_score, opp_score = _int_or_zero(g['my_score']), _int_or_zero(g['opp_score'])
+    v_score, h_score = (my_score, opp_score) if is_batting_first == 0 else (opp_score, my_score)
+
+    def cells(score_str, total):
+        vals = score_str.split(',') if score_str else ["0"] + ["ー"] * 7 + [str(total)]
+        return (vals + ["ー"] * 9)[:9]
+
+    v_list, h_list = cells(g['score_str_v'], v_score), cells(g['score_str_h'], h_score)
+    visitor_name, home_name = (my_team_name, opp_team_name) if is_batting_first == 0 else (opp_team_name, my_team_name)
+    scoreboard = [
+        {"チーム": visitor_name, "HC": v_list[0], **dict(zip(BOX_INNINGS, v_list[1:8])), "R": v_list[8]},
+        {"チーム": home_name, "HC": h_list[0], **dict(zip(BOX_INNINGS, h_list[1:8])), "R": h_list[8]},
+    ]
+
+    try:
+        batting_df, pitching_df = _nomal_score_frames(conn, game_id)
+    except Exception as e:
+        print(f"DEBUG: 詳細版成績の読み込みに失敗しました ({game_id}): {e}")
+        batting_df, pitching_df = pd.DataFrame(), pd.DataFrame()
+
+    # 自チームの打撃・投手成績だけなので、自チームの攻撃サイドに置く
+    my_side = "表" if is_batting_first == 0 else "裏"
+    return {
+        "source": "normal",
+        "match_date": g['date'],
+        "my_team_name": my_team_name, "opp_team_name": opp_team_name, "is_top_flag": is_batting_first,
+        "my_score": my_score, "opp_score": opp_score, "handicap_my": 0, "handicap_opp": 0,
+        "scoreboard": scoreboard,
+        "batting": {my_side: json.loads(batting_df.to_json(orient="records", force_ascii=False))},
+        "pitching": {my_side: json.loads(pitching_df.to_json(orient="records", force_ascii=False))},
+    }
+
+
+def _write_box_scores(c, club_id, game_ids=None):
+    """
+    指定試合（省略時は倶楽部の全試合）のボックススコアを計算し直して保存する。
+    元データがなくなった試合の行は消える。呼び出し側のトランザクション内で使う。
+    """
+    club_id = as_club_id(club_id)
+    conn = c.connection
+    if game_ids is None:
+        cct_ids = row_ids = None
+        c.execute("DELETE FROM game_box_scores WHERE club_id = ?", (club_id,))
+    else:
+        game_ids = list(dict.fromkeys(as_game_id(g) for g in game_ids if g is not None))
+        if not game_ids:
+            return
+        cct_ids = [g for g in game_ids if not g.startswith("no_")]
+        row_ids = [as_games_row_id(g) for g in game_ids if g.startswith("no_")]
+        # 数字だけの同期IDは games の行と重なるため、詳細版側の行も合わせて消す
+        stale_ids = game_ids + [f"no_{g}" for g in cct_ids if g.isdigit()]
+        c.execute(f"DELETE FROM game_box_scores WHERE club_id = ? AND game_id IN ({_in_placeholders(stale_ids)})",
+                  [club_id] + stale_ids)
+
+    boxes = []
+    if cct_ids is None or cct_ids:
+        sql = "SELECT * FROM core_cct_logs WHERE club_id = ?"
+        params = [club_id]
+        if cct_ids:
+            sql += f" AND game_id IN ({_in_placeholders(cct_ids)})"
+            params += cct_ids
+        logs = pd.read_sql(sql + " ORDER BY id ASC", conn, params=params)
+        if not logs.empty:
+            boxes.extend(_cct_box_scores(logs).items())
+
+    if row_ids is None or row_ids:
+        sql = """SELECT * FROM games WHERE club_id = ?
+                 AND CAST(id AS TEXT) NOT IN (SELECT game_id FROM core_cct_logs WHERE club_id = ?)"""
+        params = [club_id, club_id]
+        if row_ids:
+            sql += f" AND id IN ({_in_placeholders(row_ids)})"
+            params += row_ids
+        rc = conn.cursor()
+        rc.row_factory = sqlite3.Row
+        rc.execute(sql, params)
+        for g in rc.fetchall():
+            g_id = f"no_{g['id']}"
+            boxes.append((g_id, _nomal_box_score(conn, g_id, g)))
+
+    c.executemany(
+        f"INSERT INTO game_box_scores ({', '.join(_BOX_SCORE_COLUMNS)}) VALUES ({_in_placeholders(_BOX_SCORE_COLUMNS)})",
+        [(club_id, g_id, box["source"], box["match_date"], box["my_team_name"], box["opp_team_name"],
+          box["is_top_flag"], box["my_score"], box["opp_score"], box["handicap_my"], box["handicap_opp"],
+          json.dumps(box["scoreboard"], ensure_ascii=False),
+          json.dumps(box["batting"], ensure_ascii=False),
+          json.dumps(box["pitching"], ensure_ascii=False),
+          BOX_SCORE_VERSION) for g_id, box in boxes]
+    )
+
+
+def _stale_box_score_games(c):
+    """ボックススコアが未作成・旧版の試合 {club_id: [game_id, ...]}"""
+    c.execute("""
+        SELECT DISTINCT l.club_id, l.game_id FROM core_cct_logs l
+        LEFT JOIN game_box_scores b ON b.club_id = l.club_id AND b.game_id = l.game_id
+        WHERE l.club_id IS NOT NULL AND l.game_id IS NOT NULL
+          AND (b.game_id IS NULL OR b.box_version IS NULL OR b.box_version < :version)
+
+        UNION
+
+        SELECT g.club_id, 'no_' || g.id FROM games g
+        LEFT JOIN game_box_scores b ON b.club_id = g.club_id AND b.game_id = 'no_' || g.id
+        WHERE g.club_id IS NOT NULL
+          AND (b.game_id IS NULL OR b.box_version IS NULL OR b.box_version < :version)
+          AND CAST(g.id AS TEXT) NOT IN (SELECT game_id FROM core_cct_logs WHERE club_id = g.club_id)
+    """, {"version": BOX_SCORE_VERSION})
+    stale = {}
+    for club_id, game_id in c.fetchall():
+        stale.setdefault(club_id, []).append(game_id)
+    return stale
+
+
+def backfill_box_scores():
+    """未作成・旧版のボックススコアを作る。init_db から呼ばれる"""
+    with get_connection() as conn:
+        c = conn.cursor()
+        try:
+            c.execute("BEGIN IMMEDIATE")
+            stale = _stale_box_score_games(c)
+            for club_id, game_ids in stale.items():
+                _write_box_scores(c, club_id, game_ids)
+            conn.commit()
+            count = sum(len(ids) for ids in stale.values())
+            if count:
+                print(f"DEBUG: ボックススコアを作成しました（{count}試合, v{BOX_SCORE_VERSION}）")
+            return count
+        except Exception as e:
+            conn.rollback()
+            print(f"Box score backfill error: {e}")
+            raise
+
+
+def rebuild_box_scores(club_id):
+    """倶楽部の全試合のボックススコアを作り直す（管理画面用）"""
+    with get_connection() as conn:
+        c = conn.cursor()
+        _write_box_scores(c, club_id)
+        conn.commit()
+
+
+# ■■■試合結果一覧のページ取得
+# 一覧はボックススコアを新しい順に必要な件数だけ切り出し、戦評はページ内の試合IDでまとめて引く。
+GAME_HISTORY_PAGE_SIZE = 10
+
+_BOX_JSON_FIELDS = {"scoreboard_json": "scoreboard", "batting_json": "batting", "pitching_json": "pitching"}
+
+def _in_placeholders(values):
+    return ",".join("?" * len(values))
+
+def get_game_history_teams(club_id):
+    """試合結果一覧のチーム絞り込み候補"""
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("""SELECT DISTINCT my_team_name FROM game_box_scores
+                     WHERE club_id = ? AND my_team_name IS NOT NULL ORDER BY my_team_name""", (as_club_id(club_id),))
+        return [row[0] for row in c.fetchall()]
+
+def get_game_history_page(club_id, offset=0, limit=GAME_HISTORY_PAGE_SIZE, team=None):
+    """試合結果一覧の 1 ページ分を返す。
+
+    戻り値:
+      games    : ボックススコアの list（新しい順、offset から limit 件。*_json は展開済み）
+      total    : 絞り込み後の全試合数
+      comments : {game_id: 戦評}
+    """
+    where = "club_id = :club AND COALESCE(match_date, '') != '' AND (:team IS NULL OR my_team_name = :team)"
+    params = {"club": as_club_id(club_id), "team": team or None}
+    page = {"games": [], "total": 0, "comments": {}}
+
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute(f"SELECT COUNT(*) FROM game_box_scores WHERE {where}", params)
+        page["total"] = c.fetchone()[0]
+        if page["total"] == 0:
+            return page
+
+        c.row_factory = sqlite3.Row
+        c.execute(f"""SELECT * FROM game_box_scores WHERE {where}
+                      ORDER BY match_date DESC, game_id DESC LIMIT :limit OFFSET :offset""",
+                  {**params, "limit": int(limit), "offset": int(offset)})
+        for row in c.fetchall():
+            box = dict(row)
+            for col, key in _BOX_JSON_FIELDS.items():
+                box[key] = json.loads(box.pop(col) or "null")
+            page["games"].append(box)
+
+        page_ids = [box["game_id"] for box in page["games"]]
+        c = conn.cursor()
+        c.execute(
+            f"SELECT game_id, comment FROM scorebook_comments WHERE club_id = ? AND game_id IN ({_in_placeholders(page_ids)})",
+            [params["club"]] + page_ids
+        )
+        page["comments"] = {row[0]: row[1] for row in c.fetchall()}
+
+    return page
+
 
 # -------------—-
 #  　予定管理 
 # --------------—
 
 def save_event(date, title, category, location, memo, club_id, event_id=None):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
         if event_id is not None:
             c.execute("""UPDATE events SET date=?, title=?, category=?, location=?, memo=? 
@@ -741,7 +1608,7 @@ def save_event(date, title, category, location, memo, club_id, event_id=None):
         conn.commit()
 
 def get_all_events(club_id):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
         c.execute("SELECT * FROM events WHERE club_id = ? ORDER BY date ASC", (club_id,))
         rows = c.fetchall()
@@ -752,20 +1619,20 @@ def get_all_events(club_id):
         return result
 
 def delete_event(event_id, club_id):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
         c.execute("DELETE FROM attendance WHERE event_id = ? AND club_id = ?", (event_id, club_id))
         c.execute("DELETE FROM events WHERE event_id = ? AND club_id = ?", (event_id, club_id))
         conn.commit()
 
 def update_attendance(event_id, player_name, status, club_id):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
         c.execute("INSERT OR REPLACE INTO attendance (event_id, club_id, player_name, status) VALUES (?,?,?,?)", (event_id, club_id, player_name, status))
         conn.commit()
 
 def get_attendance_for_event(event_id, club_id):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
         c.execute("SELECT player_name, status FROM attendance WHERE event_id = ? AND club_id = ?", (event_id, club_id))
         return dict(c.fetchall())
@@ -777,39 +1644,47 @@ def get_attendance_for_event(event_id, club_id):
 
 def add_team_master(name, color, club_id):
     try:
-        with sqlite3.connect(DB_NAME) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
-            c.execute("INSERT INTO teams (club_id, name, color) VALUES (?, ?, ?)", (club_id, name, color))
+            c.execute("INSERT INTO teams (club_id, name, color, row_version, updated_at) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)",
+                      (club_id, name, color, _next_row_version(c, club_id)))
             conn.commit()
             return True
     except:
         return False
 
 def get_all_teams_with_colors(club_id):
-    with sqlite3.connect(DB_NAME) as conn:
+    return _load_all_teams_with_colors(as_club_id(club_id), get_data_version(club_id))
+
+@st.cache_data(max_entries=REFERENCE_CACHE_ENTRIES, show_spinner=False)
+def _load_all_teams_with_colors(club_id, version):
+    with get_connection() as conn:
         c = conn.cursor()
         c.execute("SELECT name, color FROM teams WHERE club_id = ? ORDER BY id ASC", (club_id,))
         return c.fetchall()
 
 def update_team_color(name, color, club_id):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
-        c.execute("UPDATE teams SET color = ? WHERE name = ? AND club_id = ?", (color, name, club_id))
+        c.execute("UPDATE teams SET color = ?, row_version = ?, updated_at = CURRENT_TIMESTAMP WHERE name = ? AND club_id = ?",
+                  (color, _next_row_version(c, club_id), name, club_id))
         conn.commit()
 
 def get_all_teams(club_id):
-    try:
-        with sqlite3.connect(DB_NAME) as conn:
-            c = conn.cursor()
+    return _load_all_teams(as_club_id(club_id), get_data_version(club_id))
+
+# 選手の所属チームを teams に自動登録してから読む。登録すると版数が進むので、次の呼び出しで読み直される
+@st.cache_data(max_entries=REFERENCE_CACHE_ENTRIES, show_spinner=False)
+def _load_all_teams(club_id, version):
+    with get_connection() as conn:
+        c = conn.cursor()
+        try:
             c.execute("SELECT DISTINCT team_name FROM players WHERE club_id = ?", (club_id,))
             player_teams = [row[0] for row in c.fetchall() if row[0]]
-            
-        for t_name in player_teams:
-            ensure_team_exists(club_id, t_name)            
-    except Exception as e:
-        print(f"Database Upgrade Error (get_all_teams): {e}")    
-    with sqlite3.connect(DB_NAME) as conn:
-        c = conn.cursor()
+            for t_name in player_teams:
+                _ensure_team_row(c, club_id, t_name)
+        except Exception as e:
+            print(f"Database Upgrade Error (get_all_teams): {e}")    
         c.execute("SELECT name FROM teams WHERE club_id = ? ORDER BY id ASC", (club_id,))
         teams = [row[0] for row in c.fetchall()]    
     final_teams = ["未所属"]
@@ -819,23 +1694,27 @@ def get_all_teams(club_id):
     return final_teams
 
 def delete_team(name, club_id):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
+        version = _next_row_version(c, club_id)
         c.execute("DELETE FROM teams WHERE name = ? AND club_id = ?", (name, club_id))
-        c.execute("UPDATE players SET team_name = '未所属' WHERE team_name = ? AND club_id = ?", (name, club_id))
+        if c.rowcount:
+            _record_tombstones(c, club_id, "teams", [name], version)
+        c.execute("""UPDATE players SET team_name = '未所属', row_version = ?, updated_at = CURRENT_TIMESTAMP
+                     WHERE team_name = ? AND club_id = ?""", (version, name, club_id))
         conn.commit()
 
 def add_activity_log(username, action, details, club_id):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
         c.execute("INSERT INTO activity_logs (club_id, username, action, details) VALUES (?, ?, ?, ?)",
                   (club_id, username, action, details))
         conn.commit()
 
 def get_activity_logs(club_id, limit=3):
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
+    with get_connection() as conn:
         c = conn.cursor()
+        c.row_factory = sqlite3.Row
         c.execute("""SELECT timestamp, username, action, details 
                      FROM activity_logs 
                      WHERE club_id = ? 
@@ -844,16 +1723,16 @@ def get_activity_logs(club_id, limit=3):
         return [dict(row) for row in c.fetchall()]
 
 def get_all_users(club_id):
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
+    with get_connection() as conn:
         cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
         cursor.execute("SELECT username, role FROM users WHERE club_id = ?", (club_id,))
         rows = cursor.fetchall()
         return [dict(row) for row in rows]
 
 def update_club_settings(club_id, display_name, login_id, password=None):
     try:
-        with sqlite3.connect(DB_NAME) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
             if password:
                 p_hash = hashlib.sha256(password.encode()).hexdigest()
@@ -862,15 +1741,16 @@ def update_club_settings(club_id, display_name, login_id, password=None):
             else:
                 c.execute("""UPDATE clubs SET display_name = ?, login_id = ? WHERE id = ?""", 
                           (display_name, login_id, club_id))
+            _bump_data_version(c, club_id)
             conn.commit()
             return True
     except sqlite3.IntegrityError:
         return False
 
 def get_club_customization(club_id):
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
+    with get_connection() as conn:
         c = conn.cursor()
+        c.row_factory = sqlite3.Row
         c.execute("SELECT * FROM club_customization WHERE club_id = ?", (club_id,))
         row = c.fetchone()
         if row:
@@ -884,7 +1764,7 @@ def get_club_customization(club_id):
         }
 
 def update_club_customization(club_id, data):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
         c.execute("""INSERT OR REPLACE INTO club_customization 
                      (club_id, welcome_message, member_announcement, instagram_url, x_url, youtube_url)
@@ -893,6 +1773,54 @@ def update_club_customization(club_id, data):
                    data['instagram_url'], data['x_url'], data['youtube_url']))
         conn.commit()
 
+# ■DB診断（インデックスの効き確認）---------
+
+# (画面表示名, SQL) ※プレースホルダは :club / :name / :game で指定
+PLAN_CHECK_QUERIES = [
+    ("打撃成績一覧（通算）",
+     "SELECT player_name, SUM(h), SUM(ab) FROM batting_aggregates WHERE club_id = :club GROUP BY player_name"),
+    ("打撃成績一覧（年度別）",
+     "SELECT player_name, SUM(h), SUM(ab) FROM batting_aggregates "
+     "WHERE club_id = :club AND season = :season GROUP BY player_name"),
+    ("投手成績（個人）", "SELECT SUM(outs), SUM(er) FROM pitching_aggregates WHERE club_id = :club AND pitcher_name = :name"),
+    ("打者個人成績", "SELECT * FROM super_detailed_at_bats WHERE batter_name = :name AND club_id = :club"),
+    ("投手別打席", "SELECT * FROM super_detailed_at_bats WHERE pitcher_name = :name AND club_id = :club"),
+    ("試合結果一覧",
+     "SELECT * FROM game_box_scores WHERE club_id = :club ORDER BY match_date DESC, game_id DESC LIMIT 10"),
+    ("試合ログ（Core.cct）", "SELECT * FROM core_cct_logs WHERE game_id = :game AND club_id = :club ORDER BY id ASC"),
+    ("打者ログ（Core.cct）", "SELECT * FROM core_cct_logs WHERE batter_name = :name AND club_id = :club"),
+    ("スコアブック打撃（試合）", "SELECT * FROM scorebook_batting WHERE game_id = :game AND club_id = :club"),
+    ("打率推移", "SELECT summary FROM scorebook_batting WHERE player_name = :name AND club_id = :club ORDER BY id ASC"),
+    ("スコアブック投手（試合）", "SELECT * FROM scorebook_pitching WHERE game_id = :game AND club_id = :club"),
+    ("試合マスター", "SELECT * FROM games WHERE club_id = :club ORDER BY date DESC"),
+    ("出欠", "SELECT player_name, status FROM attendance WHERE event_id = :game AND club_id = :club"),
+]
+
+def get_query_plans(club_id):
+    """主要クエリの EXPLAIN QUERY PLAN を返す（管理画面用）"""
+    params = {"club": club_id, "name": "", "game": "", "season": 0}
+    results = []
+    with get_connection() as conn:
+        c = conn.cursor()
+        for label, sql in PLAN_CHECK_QUERIES:
+            c.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            steps = [row[3] for row in c.fetchall()]
+            results.append({
+                "クエリ": label,
+                "索引使用": any("USING INDEX" in s or "USING COVERING INDEX" in s or "USING INTEGER PRIMARY KEY" in s for s in steps),
+                "実行計画": " / ".join(steps),
+                "SQL": sql,
+            })
+    return results
+
+def get_managed_index_status():
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        existing = {row[0] for row in c.fetchall()}
+    return [{"インデックス": name, "テーブル": table, "カラム": columns, "作成済": name in existing}
+            for name, table, columns in MANAGED_INDEXES]
+
 
 # -------------—-
 #  　ログイン 
@@ -900,7 +1828,7 @@ def update_club_customization(club_id, data):
 
 def verify_user(username, password, club_id):
     p_hash = hashlib.sha256(password.encode()).hexdigest()
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
         c.execute("SELECT role FROM users WHERE username = ? AND password_hash = ? AND club_id = ?", (username, p_hash, club_id))
         result = c.fetchone()
@@ -909,7 +1837,7 @@ def verify_user(username, password, club_id):
 def create_user(username, password, role, club_id):
     p_hash = hashlib.sha256(password.encode()).hexdigest()
     try:
-        with sqlite3.connect(DB_NAME) as conn:
+        with get_connection() as conn:
             conn.execute("INSERT INTO users (username, club_id, password_hash, role) VALUES (?, ?, ?, ?)", (username, club_id, p_hash, role))
             conn.commit()
         return True
@@ -917,6 +1845,537 @@ def create_user(username, password, role, club_id):
         return False
 
 
+# -------------—-
+#  　成績集計テーブル
+# --------------—
+
+# ■■■打席結果の分類（outcome codes）
+# 結果文字列（"中単打" "遊ゴ失" "空三振" …）の解釈はここだけで行い、保存時に整数コードとして
+# super_detailed_at_bats / core_cct_logs へ書き込む。集計・表示側はコード列だけを見る。
+# 判定ルールを変えたら OUTCOME_RULES_VERSION を上げること。起動時に旧版の行を再分類し、集計も作り直す。
+
+OUTCOME_RULES_VERSION = 1
+
+# 結果区分（outcome_class）
+OUTCOME_OTHER = 0        # 走者のみのイベント・分類不能
+OUTCOME_OUT = 1          # 凡打
+OUTCOME_SO = 2           # 三振
+OUTCOME_SO_REACHED = 3   # 振り逃げ（三振だが出塁）
+OUTCOME_BB = 4           # 四球
+OUTCOME_HBP = 5          # 死球
+OUTCOME_SH = 6           # 犠打
+OUTCOME_SF = 7           # 犠飛
+OUTCOME_HIT = 8          # 安打（塁打数は outcome_bases）
+OUTCOME_ROE = 9          # 失策出塁
+OUTCOME_FC = 10          # 野選
+OUTCOME_DP = 11          # 併殺
+
+# 走者イベント（runner_code）
+RUNNER_NONE, RUNNER_SB, RUNNER_CS, RUNNER_WP, RUNNER_PB = 0, 1, 2, 3, 4
+
+# 打球方向（direction_code）はスコアブックの守備番号
+DIRECTION_CODES = {"投": 1, "捕": 2, "一": 3, "二": 4, "三": 5, "遊": 6, "左": 7, "中": 8, "右": 9}
+DIRECTION_PULL = (5, 6, 7)
+DIRECTION_CENTER = (1, 2, 4, 8)
+DIRECTION_OPPO = (3, 9)
+
+# 打球性質（trajectory_code）
+TRAJECTORY_NONE, TRAJECTORY_GROUND, TRAJECTORY_FLY, TRAJECTORY_LINER, TRAJECTORY_BUNT = 0, 1, 2, 3, 4
+
+# アウトが記録される結果区分（投手のアウト数・自責点の仮想アウト判定用）
+OUTCOME_OUT_CLASSES = (OUTCOME_OUT, OUTCOME_SO, OUTCOME_SH, OUTCOME_SF, OUTCOME_FC, OUTCOME_DP)
+
+# 保存する列（この順で classify_outcome が値を返す）
+OUTCOME_CODE_COLUMNS = [
+    "outcome_class", "outcome_bases", "is_ab", "is_hit", "is_k", "is_bb",
+    "direction_code", "trajectory_code", "runner_code", "outcome_version",
+]
+
+
+def _classify_runner(res):
+    if "盗塁" in res or "CS" in res:
+        return RUNNER_CS if any(x in res for x in ["刺", "死", "CS"]) else RUNNER_SB
+    if any(x in res for x in ["WP", "ワイルドピッチ", "暴投"]):
+        return RUNNER_WP
+    if any(x in res for x in ["PB", "パスボール", "捕逸"]):
+        return RUNNER_PB
+    return RUNNER_NONE
+
+
+def classify_outcome(result, event_type="at_bat_result"):
+    """
+    結果文字列を OUTCOME_CODE_COLUMNS 順の整数タプルに分類する。
+    判定の優先順位は旧来の成績集計（四死球 → 犠打・犠飛 → 安打 → 三振 → 失策 → 野選 → 併殺 → 凡打）と同じ。
+    """
+    res = str(result or "")
+    runner = _classify_runner(res)
+    if event_type == "runner_event":
+        return (OUTCOME_OTHER, 0, 0, 0, 0, 0, 0, TRAJECTORY_NONE, runner, OUTCOME_RULES_VERSION)
+
+    bases = 0
+    if any(x in res for x in ["四球", "歩"]): oc = OUTCOME_BB
+    elif "死球" in res: oc = OUTCOME_HBP
+    elif any(x in res for x in ["犠打", "送りバント"]): oc = OUTCOME_SH
+    elif "犠飛" in res: oc = OUTCOME_SF
+    elif "単打" in res: oc, bases = OUTCOME_HIT, 1
+    elif "二塁打" in res: oc, bases = OUTCOME_HIT, 2
+    elif "三塁打" in res: oc, bases = OUTCOME_HIT, 3
+    elif "本塁打" in res: oc, bases = OUTCOME_HIT, 4
+    elif "安打" in res: oc, bases = OUTCOME_HIT, 1
+    elif "振り逃げ" in res: oc = OUTCOME_SO_REACHED
+    elif "振" in res: oc = OUTCOME_SO
+    elif "失" in res: oc = OUTCOME_ROE
+    elif "野選" in res: oc = OUTCOME_FC
+    elif "併殺" in res: oc = OUTCOME_DP
+    else: oc = OUTCOME_OUT
+
+    is_ab = 0 if oc in (OUTCOME_BB, OUTCOME_HBP, OUTCOME_SH, OUTCOME_SF) else 1
+    is_k = 1 if oc in (OUTCOME_SO, OUTCOME_SO_REACHED) else 0
+
+    # 打球方向は先頭の守備位置（"二塁打" "三塁打" のような方向なしの表記は除く）
+    direction = 0
+    if not (is_k or oc in (OUTCOME_BB, OUTCOME_HBP)) and res[:1] in DIRECTION_CODES and res[1:2] != "塁":
+        direction = DIRECTION_CODES[res[:1]]
+
+    if oc == OUTCOME_SH or "バント" in res: trajectory = TRAJECTORY_BUNT
+    elif "ゴ" in res: trajectory = TRAJECTORY_GROUND
+    elif "直" in res: trajectory = TRAJECTORY_LINER
+    elif "飛" in res: trajectory = TRAJECTORY_FLY
+    else: trajectory = TRAJECTORY_NONE
+
+    return (oc, bases, is_ab, 1 if oc == OUTCOME_HIT else 0, is_k, 1 if oc == OUTCOME_BB else 0,
+            direction, trajectory, runner, OUTCOME_RULES_VERSION)
+
+
+def outcome_is_out(row):
+    return row["outcome_class"] in OUTCOME_OUT_CLASSES or row["runner_code"] == RUNNER_CS
+
+
+def _add_outcome_columns(c):
+    for table in ("super_detailed_at_bats", "core_cct_logs"):
+        _add_missing_columns(c, table, [(col, "INTEGER") for col in OUTCOME_CODE_COLUMNS])
+
+
+# (テーブル, 主キー, 結果文字列の列, イベント種別の式)
+_OUTCOME_SOURCES = [
+    ("super_detailed_at_bats", "id", "result", "'at_bat_result'"),
+    ("core_cct_logs", "id", "at_bat_result", "event_type"),
+]
+OUTCOME_BACKFILL_BATCH = 2000
+
+
+def _backfill_outcome_codes(c):
+    """
+    outcome_version が現行ルールより古い（未分類を含む）行を再分類する。
+    書き込みは SQLite の都合で1本にまとめ、バッチ単位の executemany で流す。
+    再分類した行がある倶楽部は集計テーブルも作り直す。戻り値は再分類した行数
+    """
+    assignments = ", ".join(f"{col} = ?" for col in OUTCOME_CODE_COLUMNS)
+    touched_clubs = set()
+    total = 0
+    for table, pk, result_col, event_expr in _OUTCOME_SOURCES:
+        while True:
+            c.execute(f"""SELECT {pk}, club_id, {result_col}, {event_expr} FROM {table}
+                          WHERE outcome_version IS NULL OR outcome_version < ?
+                          LIMIT ?""", (OUTCOME_RULES_VERSION, OUTCOME_BACKFILL_BATCH))
+            rows = c.fetchall()
+            if not rows:
+                break
+            c.executemany(f"UPDATE {table} SET {assignments} WHERE {pk} = ?",
+                          [(*classify_outcome(res, event_type), row_id) for row_id, _, res, event_type in rows])
+            touched_clubs.update(club_id for _, club_id, _, _ in rows if club_id is not None)
+            total += len(rows)
+
+    # v9 より前のマイグレーション中はボックススコアのテーブルが無い（v9 の後、起動時の backfill_box_scores が作る）
+    has_box_scores = bool(_table_columns(c, "game_box_scores"))
+    for club_id in touched_clubs:
+        for kind in _AGGREGATE_TABLES:
+            _rebuild_aggregates(c, kind, club_id)
+        if has_box_scores:
+            _write_box_scores(c, club_id)
+    return total
+
+
+def backfill_outcome_codes():
+    """判定ルール更新後の再分類。init_db から呼ばれる（対象がなければ索引1回の確認で終わる）"""
+    with get_connection() as conn:
+        c = conn.cursor()
+        try:
+            c.execute("BEGIN IMMEDIATE")
+            count = _backfill_outcome_codes(c)
+            conn.commit()
+            if count:
+                print(f"DEBUG: 打席結果を再分類しました（{count}件, ルール v{OUTCOME_RULES_VERSION}）")
+            return count
+        except Exception as e:
+            conn.rollback()
+            print(f"Outcome backfill error: {e}")
+            raise
+
+
+# ■■■打撃集計（batting_aggregates）
+# 成績一覧は打席ログを毎回なめず、(倶楽部, 選手, シーズン, 月, チーム) 単位の集計行を読む。
+# 打席ログ（super_detailed_at_bats / core_cct_logs）を書き換える処理は、同じトランザクション内で
+#   1) 書き換え前の行から計算した試合分の寄与を差し引き
+#   2) 書き換え後の行から計算した寄与を足し戻す
+# ことで集計を保つ（_apply_games_to_aggregates）。ずれた場合は rebuild_stat_aggregates で作り直す。
+
+# (集計カラム, 成績一覧の表示キー)
+BATTING_AGG_FIELDS = [
+    ("games", "試合"), ("pa", "打席"), ("ab", "打数"), ("h", "安打"),
+    ("h2", "二塁打"), ("h3", "三塁打"), ("hr", "本塁打"), ("tb", "塁打"),
+    ("rbi", "打点"), ("sb", "盗塁"), ("sh", "犠打"), ("sf", "犠飛"),
+    ("bb", "四球"), ("hbp", "死球"), ("so", "三振"), ("roe", "敵失"),
+    ("gdp", "併殺"), ("fc", "野選"), ("adv", "進塁打"),
+    ("two_strike_hit", "2スト安打"), ("first_pitch_swing", "初球振"), ("contrib", "貢献打"),
+    ("inplay_h", "インプレー安打"), ("inplay_ab", "インプレー打数"),
+]
+BATTING_AGG_COLUMNS = [col for col, _ in BATTING_AGG_FIELDS]
+
+# 集計行の区分（シーズン・月・所属チーム）。通算や年度別はこの区分の行を SUM して作る。
+# 不明な月は 0、不明なチームは ''（主キーに NULL を入れない）
+AGG_PARTITION_KEYS = ["season", "month", "team"]
+
+
+def _create_aggregates_table(c, table, name_col, columns):
+    counter_defs = ",\n                  ".join(f"{col} INTEGER DEFAULT 0" for col in columns)
+    c.execute(f'''CREATE TABLE IF NOT EXISTS {table}
+                 (club_id INTEGER,
+                  {name_col} TEXT,
+                  season INTEGER,
+                  month INTEGER DEFAULT 0,
+                  team TEXT DEFAULT '',
+                  {counter_defs},
+                  updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                  PRIMARY KEY (club_id, {name_col}, season, month, team))''')
+
+
+def _create_batting_aggregates_table(c):
+    _create_aggregates_table(c, "batting_aggregates", "player_name", BATTING_AGG_COLUMNS)
+
+
+# ■■■列指向の集計エンジン
+# 打席ログを DataFrame で一度に読み、結果コードのマスクと groupby で (選手, シーズン, 月, チーム) 単位に集計する。
+# 集計テーブルの更新・再構築と、集計テーブルを通さない集計（_stat_totals の use_aggregates=False）の両方で使う。
+
+def _season_series(match_date):
+    """試合日 'YYYY-MM-DD' の列からシーズン（年）の列を作る。不明なら 0"""
+    head = match_date.fillna("").astype(str).str[:4]
+    return pd.to_numeric(head.where(head.str.isdigit()), errors="coerce").fillna(0).astype(int)
+
+
+def _month_series(match_date):
+    """試合日 'YYYY-MM-DD' の列から月の列を作る。不明なら 0"""
+    part = match_date.fillna("").astype(str).str[5:7]
+    return pd.to_numeric(part.where(part.str.isdigit()), errors="coerce").fillna(0).astype(int)
+
+
+def _scorer_counts(run_result):
+    """run_result（生還者の名前をカンマ区切り）の列から生還人数の列を作る"""
+    return run_result.fillna("").astype(str).str.count(r"[^,、]*[^,、\s][^,、]*")
+
+
+def _cct_offense_mask(cct):
+    """Core.cct ログの各行が自チームの攻撃か（is_top_flag=0 は自チーム先攻）"""
+    is_top_half = cct["inning"].fillna("").astype(str).str.endswith("表")
+    return is_top_half == (cct["is_top_flag"].fillna(0) == 0)
+
+
+def _dedupe_at_bats(df):
+    """投球ごとの行（打席番号あり）は同一打席の最終球（先頭行）だけ残す"""
+    has_no = df["at_bat_no"].notna()
+    first = ~df[has_no].duplicated(subset=["game_id", "at_bat_no"], keep="first")
+    return pd.concat([df[has_no][first], df[~has_no]]).sort_index()
+
+
+def _tag_partition(counts, names, source):
+    """カウンタ列に名前・集計区分・試合IDを付ける"""
+    counts = counts.copy()
+    counts["name"] = names
+    for key in AGG_PARTITION_KEYS + ["game_id"]:
+        counts[key] = source[key]
+    return counts
+
+
+def _sum_by_player(parts, name_col, columns):
+    """打席単位のカウンタ列を (名前, 集計区分) ごとに合算し、出場試合数（games）を付ける"""
+    index_names = [name_col] + AGG_PARTITION_KEYS
+    if not parts:
+        return pd.DataFrame(columns=columns, index=pd.MultiIndex.from_tuples([], names=index_names))
+    frame = pd.concat(parts)
+    keys = [frame["name"]] + [frame[key] for key in AGG_PARTITION_KEYS]
+    totals = frame[[col for col in columns if col != "games"]].groupby(keys).sum()
+    totals["games"] = frame["game_id"].groupby(keys).nunique()
+    totals.index.names = index_names
+    return totals[columns].astype(int)
+
+
+def _legacy_batting_frame(legacy):
+    """旧形式から移行した試合単位の成績（legacy_stats）を集計カラムの DataFrame にする"""
+    stats = pd.DataFrame([json.loads(raw).get("legacy_stats", {}) for raw in legacy["raw_data_json"]],
+                         index=legacy.index)
+    stats = stats.reindex(columns=["ab", "h", "h2", "h3", "hr", "rbi", "sb", "so", "bb", "hbp", "sh", "sf"]).fillna(0).astype(int)
+    out = pd.DataFrame(0, index=legacy.index, columns=BATTING_AGG_COLUMNS)
+    for col in ["ab", "h", "h2", "h3", "hr", "rbi", "sb", "so", "bb", "hbp"]:
+        out[col] = stats[col]
+    out["tb"] = stats["h"] + stats["h2"] + stats["h3"] * 2 + stats["hr"] * 3
+    out["pa"] = stats["ab"] + stats["bb"] + stats["hbp"] + stats["sh"] + stats["sf"]
+    return out
+
+
+def _batting_counts(pa, result, rbi, oc, bases, is_ab, is_hit, is_k, two_strike_hit, first_pitch_swing):
+    """打席単位の結果コード列から打撃集計カラムの DataFrame を作る（pa=打席行のマスク）"""
+    ab = pa & (is_ab == 1)
+    hit = ab & (is_hit == 1)
+    so = ab & ~hit & (is_k == 1)
+    sh = pa & (oc == OUTCOME_SH)
+    sf = pa & (oc == OUTCOME_SF)
+    adv = pa & result.fillna("").str.contains("進塁打", regex=False)
+    return pd.DataFrame({
+        "pa": pa, "ab": ab, "h": hit,
+        "h2": hit & (bases == 2), "h3": hit & (bases == 3), "hr": hit & (bases == 4),
+        "tb": bases.where(hit, 0),
+        "rbi": rbi.where(pa, 0),
+        "sh": sh, "sf": sf,
+        "bb": pa & (oc == OUTCOME_BB), "hbp": pa & (oc == OUTCOME_HBP),
+        "so": so,
+        "roe": ab & (oc == OUTCOME_ROE), "gdp": ab & (oc == OUTCOME_DP), "fc": ab & (oc == OUTCOME_FC),
+        "adv": adv,
+        "two_strike_hit": pa & (two_strike_hit == 1), "first_pitch_swing": pa & (first_pitch_swing == 1),
+        "contrib": pa & ((rbi > 0) | sh | sf | adv),
+        "inplay_h": hit & (bases < 4), "inplay_ab": ab & ~hit & ~so,
+    }).astype(int)
+
+
+def _batting_frame(sdab, cct):
+    """
+    打席ログから (選手, 集計区分) ごとの打撃集計 DataFrame を作る。
+    sdab は game_id, at_bat_no, pitch_count DESC 順であること（同一打席の最終球だけ数える）。
+    """
+    parts = []
+
+    names = sdab["batter_name"].fillna("")
+    own = sdab[(names != "") & ~names.str.contains("相手打者", regex=False)]
+    is_legacy = own["raw_data_json"].fillna("").str.contains("legacy_migration", regex=False)
+    legacy, plays = own[is_legacy], _dedupe_at_bats(own[~is_legacy])
+    if not legacy.empty:
+        counts = _legacy_batting_frame(legacy)
+        parts.append(_tag_partition(counts, legacy["batter_name"], legacy))
+    if not plays.empty:
+        counts = _batting_counts(pd.Series(True, index=plays.index), plays["result"], plays["rbi"].fillna(0),
+                                 plays["outcome_class"], plays["outcome_bases"], plays["is_ab"], plays["is_hit"],
+                                 plays["is_k"], plays["two_strike_hit"], plays["first_pitch_swing"])
+        counts["sb"] = 0
+        parts.append(_tag_partition(counts, plays["batter_name"], plays))
+
+    offense = cct[cct["batter_name"].fillna("").ne("") & _cct_offense_mask(cct)]
+    if not offense.empty:
+        is_runner = offense["event_type"] == "runner_event"
+        counts = _batting_counts(~is_runner, offense["at_bat_result"], _scorer_counts(offense["run_result"]),
+                                 offense["outcome_class"], offense["outcome_bases"], offense["is_ab"], offense["is_hit"],
+                                 offense["is_k"], 0, 0)
+        counts["sb"] = (is_runner & (offense["runner_code"] == RUNNER_SB)).astype(int)
+        parts.append(_tag_partition(counts, offense["batter_name"], offense))
+
+    return _sum_by_player(parts, "player_name", BATTING_AGG_COLUMNS)
+
+
+# ■■■投手集計（pitching_aggregates）
+# 打撃集計と同じく (倶楽部, 投手, 集計区分) 単位で、書き込み時に試合分の寄与を差し替えて保つ。
+
+# (集計カラム, 成績一覧の表示キー)
+PITCHING_AGG_FIELDS = [
+    ("games", "登板"), ("outs", "アウト数"), ("runs", "失点"), ("er", "自責点"),
+    ("so", "奪三振"), ("bb", "四球"), ("hbp", "死球"), ("h", "被安打"), ("hr", "被本塁打"),
+    ("pitches", "投球数"), ("bf", "打者数"), ("wp", "WP"), ("cs", "CS"), ("sb_allowed", "被盗塁"),
+]
+PITCHING_AGG_COLUMNS = [col for col, _ in PITCHING_AGG_FIELDS]
+
+
+def _create_pitching_aggregates_table(c):
+    _create_aggregates_table(c, "pitching_aggregates", "pitcher_name", PITCHING_AGG_COLUMNS)
+
+
+def _json_list_len(raw):
+    try:
+        return len(json.loads(raw or "[]"))
+    except Exception:
+        return 0
+
+
+def _sdab_json_outs(raw):
+    """raw_data_json から (打者・走者のアウト数, 三振扱いフラグ) を取り出す"""
+    if not raw:
+        return 0, False
+    try:
+        data = json.loads(raw)
+    except Exception:
+        return 0, False
+    is_strikeout = any(log.get("meta", {}).get("is_strikeout_stat") for log in data.get("play_log", []))
+    statuses = [data.get("batter", {})] + data.get("runners", [])
+    outs = sum(1 for p in statuses if (p.get("status") or p.get("predicted_status")) == "アウト")
+    return outs, is_strikeout
+
+
+def _pitching_frame(sdab, cct):
+    """
+    打席ログから (投手, 集計区分) ごとの投手集計 DataFrame を作る。
+    super_detailed_at_bats は「相手打者」の打席、core_cct_logs は自チーム守備の半イニングを対象にする。
+    """
+    parts = []
+
+    plays = _dedupe_at_bats(sdab[sdab["batter_name"].fillna("").str.contains("相手", regex=False)])
+    if not plays.empty:
+        oc = plays["outcome_class"]
+        parsed = plays["raw_data_json"].map(_sdab_json_outs)
+        json_outs = parsed.str[0]
+        rbi = plays["rbi"].fillna(0).astype(int)
+        hit = plays["is_hit"] == 1
+        result_outs = (oc == OUTCOME_DP) * 2 + oc.isin(OUTCOME_OUT_CLASSES) * (oc != OUTCOME_DP)
+        name = plays["pitcher_name"].where(plays["pitcher_name"].fillna("").ne("") & (plays["pitcher_name"] != "Unknown"), "自チーム投手")
+        parts.append(_tag_partition(pd.DataFrame({
+            "outs": json_outs.where(json_outs > 0, result_outs),
+            "runs": rbi, "er": rbi.where(oc != OUTCOME_ROE, 0),
+            "so": (plays["is_k"] == 1) | parsed.str[1], "bb": plays["is_bb"] == 1, "hbp": oc == OUTCOME_HBP,
+            "h": hit, "hr": hit & (plays["outcome_bases"] == 4),
+            "pitches": plays["pitch_count"].fillna(0).astype(int), "bf": 1,
+            "wp": plays["runner_code"] == RUNNER_WP, "cs": plays["runner_code"] == RUNNER_CS,
+            "sb_allowed": plays["runner_code"] == RUNNER_SB,
+        }), name, plays))
+
+    defense = cct[~_cct_offense_mask(cct)]
+    if not defense.empty:
+        oc = defense["outcome_class"]
+        half = [defense["game_id"], defense["inning"].fillna("")]
+        start_outs = pd.to_numeric(defense["start_outs"], errors="coerce").fillna(0).astype(int)
+        next_outs = start_outs.groupby(half).shift(-1)
+        is_out = oc.isin(OUTCOME_OUT_CLASSES) | (defense["runner_code"] == RUNNER_CS)
+        is_err = oc == OUTCOME_ROE
+
+        # アウト数：同じ半イニングの次の行とのアウトカウント差。
+        # 最後の行は 3アウトまで（試合最後の半イニングのみ結果から判定）
+        last_inning = defense.groupby("game_id")["inning"].transform("last").fillna("")
+        in_last_half = defense["inning"].fillna("") == last_inning
+        outs = (next_outs - start_outs).clip(lower=0)
+        outs = outs.where(next_outs.notna(), (3 - start_outs).clip(lower=0).where(~in_last_half, is_out.astype(int)))
+
+        # 失点・自責点（失策を仮想アウトに含め、3つ目以降の失点は非自責）
+        scored = _scorer_counts(defense["run_result"])
+        virtual_outs = (is_out | is_err).astype(int)
+        virtual_before = virtual_outs.groupby(half).cumsum() - virtual_outs
+        at_bat = defense["event_type"] != "runner_event"
+        runner = defense["runner_code"]
+        hit = at_bat & (defense["is_hit"] == 1)
+        parts.append(_tag_partition(pd.DataFrame({
+            "outs": outs.astype(int),
+            "runs": scored, "er": scored.where((virtual_before < 3) & ~is_err, 0),
+            "so": at_bat & (defense["is_k"] == 1), "bb": at_bat & (defense["is_bb"] == 1),
+            "hbp": at_bat & (oc == OUTCOME_HBP),
+            "h": hit, "hr": hit & (defense["outcome_bases"] == 4),
+            "pitches": defense["counts_history_json"].map(_json_list_len).where(at_bat, 0),
+            "bf": at_bat,
+            "wp": runner == RUNNER_WP,
+            "cs": ~at_bat & (runner == RUNNER_CS), "sb_allowed": ~at_bat & (runner == RUNNER_SB),
+        }), defense["pitcher_name"].where(defense["pitcher_name"].fillna("").ne(""), "自チーム投手"), defense))
+
+    return _sum_by_player(parts, "pitcher_name", PITCHING_AGG_COLUMNS)
+
+
+def _fetch_at_bat_frames(c, club_id, game_ids=None):
+    """集計の元になる打席ログを DataFrame で取得する（game_ids 指定時はその試合のみ）"""
+    in_games = ""
+    params = [club_id]
+    if game_ids is not None:
+        in_games = f" IN ({','.join(['?'] * len(game_ids))})"
+        params += list(game_ids)
+
+    # 詳細スコアの所属チームは games（id="12" / "no_12"）から引く
+    sdab = pd.read_sql_query(f"""SELECT s.batter_name, s.pitcher_name, s.result, s.rbi, s.raw_data_json, s.game_id,
+                                        s.at_bat_no, s.pitch_count, s.two_strike_hit, s.first_pitch_swing, s.match_date,
+                                        s.outcome_class, s.outcome_bases, s.is_ab, s.is_hit, s.is_k, s.is_bb, s.runner_code,
+                                        g.my_team_name AS team
+                                 FROM super_detailed_at_bats s
+                                 LEFT JOIN games g
+                                   ON g.id = CAST(REPLACE(s.game_id, 'no_', '') AS INTEGER) AND g.club_id = s.club_id
+                                 WHERE s.club_id = ?{" AND s.game_id" + in_games if in_games else ""}
+                                 ORDER BY s.game_id, s.at_bat_no, s.pitch_count DESC""", c.connection, params=params)
+
+    cct = pd.read_sql_query(f"""SELECT id, game_id, match_date, inning, is_top_flag, batter_name, pitcher_name,
+                                       my_team_name AS team, at_bat_result, run_result, event_type, start_outs,
+                                       counts_history_json,
+                                       outcome_class, outcome_bases, is_ab, is_hit, is_k, is_bb, runner_code
+                                FROM core_cct_logs
+                                WHERE club_id = ?{" AND game_id" + in_games if in_games else ""}
+                                ORDER BY id""", c.connection, params=params)
+
+    for frame in (sdab, cct):
+        frame["season"] = _season_series(frame["match_date"])
+        frame["month"] = _month_series(frame["match_date"])
+        frame["team"] = frame["team"].fillna("").astype(str)
+    return sdab, cct
+
+
+# 集計テーブルごとの (テーブル名, 選手名カラム, 集計カラム, 集計関数)
+_AGGREGATE_TABLES = {
+    "batting": ("batting_aggregates", "player_name", BATTING_AGG_COLUMNS, _batting_frame),
+    "pitching": ("pitching_aggregates", "pitcher_name", PITCHING_AGG_COLUMNS, _pitching_frame),
+}
+
+
+def _upsert_aggregate_lines(c, kind, club_id, totals, sign):
+    if totals.empty:
+        return
+    table, name_col, cols, _ = _AGGREGATE_TABLES[kind]
+    c.executemany(f"""INSERT INTO {table} (club_id, {name_col}, season, month, team, {', '.join(cols)}, updated_at)
+                      VALUES (?, ?, ?, ?, ?, {', '.join(['?'] * len(cols))}, CURRENT_TIMESTAMP)
+                      ON CONFLICT(club_id, {name_col}, season, month, team) DO UPDATE SET
+                      {', '.join(f'{col} = {col} + excluded.{col}' for col in cols)},
+                      updated_at = excluded.updated_at""",
+                  [(club_id, name, int(season), int(month), team, *[sign * int(v) for v in values])
+                   for (name, season, month, team), values in zip(totals.index, totals[cols].itertuples(index=False))])
+    # 寄与がすべて差し引かれた行（出場試合 0）は消す
+    c.execute(f"DELETE FROM {table} WHERE club_id = ? AND games <= 0", (club_id,))
+
+
+def _apply_games_to_aggregates(c, club_id, game_ids, sign):
+    """指定試合の打席ログ分を集計へ加算(sign=1)／減算(sign=-1)する。呼び出し側のトランザクション内で使う"""
+    game_ids = [g for g in dict.fromkeys(game_ids) if g is not None]
+    if not game_ids:
+        return
+    sdab, cct = _fetch_at_bat_frames(c, club_id, game_ids)
+    for kind, (_, _, _, compute) in _AGGREGATE_TABLES.items():
+        _upsert_aggregate_lines(c, kind, club_id, compute(sdab, cct), sign)
+
+
+def _rebuild_aggregates(c, kind, club_id=None):
+    table, _, _, compute = _AGGREGATE_TABLES[kind]
+    # 古いマイグレーション（v5〜v7）から呼ばれたとき、打席結果コード（v7）や集計の区分列（v8）がまだ無ければ
+    # 何もしない。どちらも、列を作るマイグレーションが全倶楽部分を作り直す
+    if not (set(OUTCOME_CODE_COLUMNS) <= set(_table_columns(c, "super_detailed_at_bats"))
+            and {"season", "month", "team"} <= set(_table_columns(c, table))):
+        return
+    if club_id is None:
+        c.execute("SELECT DISTINCT club_id FROM super_detailed_at_bats UNION SELECT DISTINCT club_id FROM core_cct_logs")
+        club_ids = [row[0] for row in c.fetchall() if row[0] is not None]
+        c.execute(f"DELETE FROM {table}")
+    else:
+        club_ids = [club_id]
+        c.execute(f"DELETE FROM {table} WHERE club_id = ?", (club_id,))
+
+    for cid in club_ids:
+        sdab, cct = _fetch_at_bat_frames(c, cid)
+        _upsert_aggregate_lines(c, kind, cid, compute(sdab, cct), 1)
+
+
+def rebuild_stat_aggregates(club_id=None):
+    """打撃・投手集計を打席ログから作り直す（club_id 省略時は全倶楽部）。バックフィル・不整合時用"""
+    with get_connection() as conn:
+        c = conn.cursor()
+        for kind in _AGGREGATE_TABLES:
+            _rebuild_aggregates(c, kind, as_club_id(club_id))
+        conn.commit()
+
+
 # -------------—-
 #  　成績一覧 
 # --------------—
@@ -924,231 +2383,117 @@ def create_user(username, password, role, club_id):
 import json
 import sqlite3
 
-# ■■■精密一覧のためのコード（打者一覧）
-def get_batting_stats_filtered(club_id):
-    # final_result を SELECT から除外
-    query = """
-        SELECT batter_name, result, rbi, raw_data_json, game_id, at_bat_no, pitch_count,
-               two_strike_hit, first_pitch_swing
-        FROM super_detailed_at_bats 
-        WHERE club_id = ?
-        ORDER BY game_id, at_bat_no, pitch_count DESC
+# ■■■集計の読み出し（一覧・プロフィール共通）
+def _stat_totals(kind, club_id, season=None, name=None, use_aggregates=True, month=None, team=None):
     """
-    
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
+    (名前) ごとのカウンタを DataFrame（index=名前）で返す。season / month / team で絞り込み、
+    指定しない区分はすべて合算する（全部省略で通算）。
+    通常は集計テーブルを合算し、use_aggregates=False または集計テーブルが読めない場合は
+    打席ログを列指向エンジンで直接集計する。
+    """
+    table, name_col, cols, compute = _AGGREGATE_TABLES[kind]
+    club_id = as_club_id(club_id)
+    filters = {"season": season, "month": month, "team": team}
+    filters = {key: (value if key == "team" else int(value)) for key, value in filters.items() if value is not None}
+    with get_connection() as conn:
+        if use_aggregates:
+            conditions, params = ["club_id = ?"], [club_id]
+            for key, value in filters.items():
+                conditions.append(f"{key} = ?"); params.append(value)
+            if name is not None:
+                conditions.append(f"{name_col} = ?"); params.append(name)
+            query = f"""SELECT {name_col}, {', '.join(f'SUM({col}) AS {col}' for col in cols)}
+                        FROM {table} WHERE {' AND '.join(conditions)} GROUP BY {name_col}"""
+            try:
+                totals = pd.read_sql_query(query, conn, params=params).set_index(name_col)
+                return totals.fillna(0).astype(int)
+            except (sqlite3.OperationalError, pd.errors.DatabaseError) as e:
+                print(f"DEBUG: {table} を読めないため打席ログから集計します: {e}")
+
+        sdab, cct = _fetch_at_bat_frames(conn.cursor(), club_id)
+    for key, value in filters.items():
+        sdab, cct = sdab[sdab[key] == value], cct[cct[key] == value]
+    totals = compute(sdab, cct).groupby(level=name_col).sum()
+    if name is not None:
+        totals = totals[totals.index == name]
+    return totals
+
+
+def get_stat_seasons(club_id):
+    """成績の集計行があるシーズン（年）の一覧。新しい順"""
+    with get_connection() as conn:
         c = conn.cursor()
-        c.execute(query, (str(club_id),))
-        rows = c.fetchall()
+        c.execute("""SELECT season FROM batting_aggregates WHERE club_id = ? AND season > 0
+                     UNION
+                     SELECT season FROM pitching_aggregates WHERE club_id = ? AND season > 0
+                     ORDER BY season DESC""", (as_club_id(club_id),) * 2)
+        return [row[0] for row in c.fetchall()]
 
-    stats = {}
-    processed_at_bats = set()
-    player_games = {} # 出場試合数計算用
-
-    for row in rows:
-        row_dict = dict(row) # 安全にディクショナリ化
-        name = row_dict['batter_name']
-        if not name or "相手打者" in name: continue
-
-        game_id = row_dict['game_id']
-        ab_no = row_dict['at_bat_no']
-        raw = json.loads(row_dict['raw_data_json']) if row_dict['raw_data_json'] else {}
-        is_legacy = raw.get("source") == "legacy_migration"
-        
-        # 出場試合数の記録
-        if name not in player_games: player_games[name] = set()
-        player_games[name].add(game_id)
-
-        at_bat_key = f"{game_id}_{ab_no}"
-        if not is_legacy:
-            if at_bat_key in processed_at_bats: continue
-            processed_at_bats.add(at_bat_key)
-
-        if name not in stats:
-            # stats.py が要求する全項目を初期化
-            stats[name] = {
-                "試合":0, "打席":0, "打数":0, "安打":0, "二塁打":0, "三塁打":0, "本塁打":0,
-                "塁打":0, "打点":0, "盗塁":0, "犠打":0, "犠飛":0, "四球":0, "死球":0, 
-                "三振":0, "敵失":0, "併殺":0, "野選":0, "進塁打":0, "失策":0,
-                "2スト安打":0, "初球振":0, "貢献打":0, "インプレー安打":0, "インプレー打数":0
-            }
-        
-        s_ref = stats[name]
-
-        if is_legacy:
-            ls = raw.get("legacy_stats", {})
-            h, h2, h3, hr = ls.get("h", 0), ls.get("h2", 0), ls.get("h3", 0), ls.get("hr", 0)
-            ab = ls.get("ab", 0)
-            s_ref["打数"] += ab
-            s_ref["安打"] += h
-            s_ref["二塁打"] += h2
-            s_ref["三塁打"] += h3
-            s_ref["本塁打"] += hr
-            s_ref["塁打"] += (h - h2 - h3 - hr) + (h2*2) + (h3*3) + (hr*4)
-            s_ref["打点"] += ls.get("rbi", 0)
-            s_ref["盗塁"] += ls.get("sb", 0)
-            s_ref["三振"] += ls.get("so", 0)
-            s_ref["四球"] += ls.get("bb", 0)
-            s_ref["死球"] += ls.get("hbp", 0)
-            s_ref["打席"] += (ab + ls.get("bb", 0) + ls.get("hbp", 0) + ls.get("sh", 0) + ls.get("sf", 0))
-        else:
-            # --- 新設フラグの集計 ---
-            if row_dict.get('two_strike_hit') == 1: s_ref["2スト安打"] += 1
-            if row_dict.get('first_pitch_swing') == 1: s_ref["初球振"] += 1
-            
-            # final_resultが存在しない場合の安全なフォールバック
-            res = row_dict.get('final_result') or row_dict.get('result') or ""
-            
-            s_ref["打席"] += 1
-            s_ref["打点"] += row_dict.get('rbi') or 0
-            
-            # 精密判定
-            is_bb = any(x in res for x in ["四球", "歩"])
-            is_hbp = "死球" in res
-            is_h4 = "本塁打" in res
-            is_h3 = "三塁打" in res
-            is_h2 = "二塁打" in res
-            is_h1 = "単打" in res or ("安打" in res and not any([is_h2, is_h3, is_h4]))
-            is_sh = any(x in res for x in ["犠打", "送りバント"])
-            is_sf = "犠飛" in res
-            is_so = "振" in res
-            is_dp = "併殺" in res
-            is_err = "失" in res and "敵失" not in res
-            is_fc = "野選" in res
-
-            if is_bb: s_ref["四球"] += 1
-            elif is_hbp: s_ref["死球"] += 1
-            elif is_sh: s_ref["犠打"] += 1
-            elif is_sf: s_ref["犠飛"] += 1
-            else:
-                s_ref["打数"] += 1
-                if is_h1:
-                    s_ref["安打"] += 1; s_ref["塁打"] += 1; s_ref["インプレー安打"] += 1
-                elif is_h2:
-                    s_ref["安打"] += 1; s_ref["二塁打"] += 1; s_ref["塁打"] += 2; s_ref["インプレー安打"] += 1
-                elif is_h3:
-                    s_ref["安打"] += 1; s_ref["三塁打"] += 1; s_ref["塁打"] += 3; s_ref["インプレー安打"] += 1
-                elif is_h4:
-                    s_ref["安打"] += 1; s_ref["本塁打"] += 1; s_ref["塁打"] += 4
-                elif is_so:
-                    s_ref["三振"] += 1
-                elif is_err:
-                    s_ref["敵失"] += 1; s_ref["インプレー打数"] += 1
-                elif is_fc:
-                    s_ref["野選"] += 1; s_ref["インプレー打数"] += 1
-                elif is_dp:
-                    s_ref["併殺"] += 1; s_ref["インプレー打数"] += 1
-                else:
-                    s_ref["インプレー打数"] += 1
-
-            # 貢献打・進塁打の判定
-            if (row_dict.get('rbi') and row_dict.get('rbi') > 0) or is_sh or is_sf or "進塁打" in res:
-                s_ref["貢献打"] += 1
-            if "進塁打" in res:
-                s_ref["進塁打"] += 1
-
-    # 最終集計と率計算
-    final_list = []
-    for name, s in stats.items():
-        s["試合"] = len(player_games.get(name, set()))
-        ab, pa, h, h123 = s["打数"], s["打席"], s["安打"], (s["安打"] - s["本塁打"])
-        bb_hbp = s["四球"] + s["死球"]
-        
-        s["打率"] = round(h / ab, 3) if ab > 0 else 0.000
-        s["出塁率"] = round((h + bb_hbp) / pa, 3) if pa > 0 else 0.000
-        s["長打率"] = round(s["塁打"] / ab, 3) if ab > 0 else 0.000
-        s["OPS"] = round(s["出塁率"] + s["長打率"], 3)
-        s["貢献打率"] = round(s["貢献打"] / pa, 3) if pa > 0 else 0.000
-        s["三振率"] = round(s["三振"] / pa, 3) if pa > 0 else 0.000
-        
-        babip_den = (ab - s["三振"] - s["本塁打"] + s["犠飛"])
-        s["BABIP"] = round(h123 / babip_den, 3) if babip_den > 0 else 0.000
-        s["初球スイング率"] = round(s["初球振"] / pa, 3) if pa > 0 else 0.000
-        
-        s["name"] = name
-        final_list.append(s)
-        
-    return final_list
 
+def _ratio(num, den, digits):
+    """分母 0 の行は 0 にした率の列"""
+    return (num / den.where(den > 0)).fillna(0).round(digits)
 
-# ■■■精密一覧のためのコード（打者個人）
-def get_player_detailed_stats(player_name, club_id):
-    import json
-    import sqlite3
 
-    query = """
-        SELECT result, rbi, two_strike_hit, first_pitch_swing, raw_data_json 
-        FROM super_detailed_at_bats 
-        WHERE batter_name = ? AND club_id = ?
-    """
-    
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute(query, (player_name, club_id))
-        rows = c.fetchall()
+# ■■■精密一覧のためのコード（打者一覧）
+def get_batting_stats_filtered(club_id, season=None, month=None, team=None, use_aggregates=True):
+    """打撃成績一覧。1行=1選手の DataFrame（列は stats.py の表示キー、選手名は name 列）"""
+    df = _stat_totals("batting", club_id, season, use_aggregates=use_aggregates, month=month, team=team)
+    df = df.rename(columns=dict(BATTING_AGG_FIELDS))
+    df["失策"] = 0
 
-    s = {
-        "pa":0, "ab":0, "h":0, "h2":0, "h3":0, "hr":0, "rbi":0, "so":0, "bb":0, "hbp":0, "sf":0, "sb":0, 
-        "two_strike_hit":0, "first_pitch_swing":0,
-        "pull_count":0, "center_count":0, "oppo_count":0
-    }
+    ab, pa = df["打数"], df["打席"]
+    df["打率"] = _ratio(df["安打"], ab, 3)
+    df["出塁率"] = _ratio(df["安打"] + df["四球"] + df["死球"], pa, 3)
+    df["長打率"] = _ratio(df["塁打"], ab, 3)
+    df["OPS"] = (df["出塁率"] + df["長打率"]).round(3)
+    df["貢献打率"] = _ratio(df["貢献打"], pa, 3)
+    df["三振率"] = _ratio(df["三振"], pa, 3)
+    df["BABIP"] = _ratio(df["安打"] - df["本塁打"], ab - df["三振"] - df["本塁打"] + df["犠飛"], 3)
+    df["初球スイング率"] = _ratio(df["初球振"], pa, 3)
 
-    for row in rows:
-        row_dict = dict(row)
-        raw = json.loads(row_dict['raw_data_json']) if row_dict['raw_data_json'] else {}
-        is_legacy = raw.get("source") == "legacy_migration"
-        
-        if is_legacy:
-            ls = raw.get("legacy_stats", {})
-            h, h2, h3, hr = ls.get("h", 0), ls.get("h2", 0), ls.get("h3", 0), ls.get("hr", 0)
-            ab = ls.get("ab", 0)
-            s["ab"] += ab; s["h"] += h; s["h2"] += h2; s["h3"] += h3; s["hr"] += hr
-            s["rbi"]+= ls.get("rbi", 0); s["so"] += ls.get("so", 0)
-            s["bb"] += ls.get("bb", 0); s["hbp"]+= ls.get("hbp", 0)
-            s["sf"] += ls.get("sf", 0); s["sb"] += ls.get("sb", 0)
-            s["pa"] += (ab + ls.get("bb",0) + ls.get("hbp",0) + ls.get("sf",0) + ls.get("sh",0))
-        else:
-            if row_dict.get('two_strike_hit') == 1: s["two_strike_hit"] += 1
-            if row_dict.get('first_pitch_swing') == 1: s["first_pitch_swing"] += 1
-            
-            res = row_dict.get('final_result') or row_dict.get('result') or ""
-            s["pa"] += 1
-            s["rbi"] += row_dict.get('rbi') or 0
-            
-            is_bb = any(x in res for x in ["四球", "歩"])
-            is_hbp = "死球" in res
-            is_hr = "本塁打" in res
-            is_h3 = "三塁打" in res
-            is_h2 = "二塁打" in res
-            is_h1 = "単打" in res or ("安打" in res and not any([is_h2, is_h3, is_hr]))
-            is_so = "振" in res
-            is_sf = "犠飛" in res
-            is_sh = any(x in res for x in ["犠打", "送りバント"])
-
-            if is_bb: s["bb"] += 1
-            elif is_hbp: s["hbp"] += 1
-            elif is_sf: s["sf"] += 1
-            elif is_sh: pass 
-            else:
-                s["ab"] += 1
-                if is_h1: s["h"] += 1
-                elif is_h2: s["h"] += 1; s["h2"] += 1
-                elif is_h3: s["h"] += 1; s["h3"] += 1
-                elif is_hr: s["h"] += 1; s["hr"] += 1
-                elif is_so: s["so"] += 1
+    return df.rename_axis("name").reset_index()
+
+
+# ■■■精密一覧のためのコード（打者個人）
+def _direction_counts(club_id, player_name):
+    """打球方向（引っ張り・センター・流し）の打席数を結果コードの SUM で数える（打席は最終球の行だけ）"""
+    def bucket(codes):
+        return f"SUM(direction_code IN ({', '.join(map(str, codes))}))"
 
-            if "盗" in res: s["sb"] += 1
+    with get_connection() as conn:
+        c = conn.cursor()
+        c.execute(f"""SELECT {bucket(DIRECTION_PULL)}, {bucket(DIRECTION_CENTER)}, {bucket(DIRECTION_OPPO)}
+                      FROM (
+                          SELECT s.direction_code FROM super_detailed_at_bats s
+                          WHERE s.club_id = ? AND s.batter_name = ?
+                            AND (s.at_bat_no IS NULL
+                                 OR s.pitch_count = (SELECT MAX(pitch_count) FROM super_detailed_at_bats
+                                                     WHERE club_id = s.club_id AND game_id = s.game_id
+                                                       AND at_bat_no = s.at_bat_no))
+                          UNION ALL
+                          SELECT direction_code FROM core_cct_logs
+                          WHERE club_id = ? AND batter_name = ? AND event_type != 'runner_event'
+                            AND (inning LIKE '%表') = (COALESCE(is_top_flag, 0) = 0)
+                      )""", (club_id, player_name) * 2)
+        return [count or 0 for count in c.fetchone()]
 
-            if any(x in res for x in ["左", "三", "遊"]): s["pull_count"] += 1
-            elif any(x in res for x in ["中", "二", "投", "捕"]): s["center_count"] += 1
-            elif any(x in res for x in ["右", "一"]): s["oppo_count"] += 1
+
+def get_player_detailed_stats(player_name, club_id):
+    """
+    選手個人の打撃成績（プロフィール用）。カウンタは成績一覧と同じ _stat_totals（集計テーブル）から読み、
+    打球方向だけ打席ログの結果コードを SUM する
+    """
+    club_id = as_club_id(club_id)
+    totals = _stat_totals("batting", club_id, name=player_name)
+    row = totals.loc[player_name] if player_name in totals.index else pd.Series(0, index=BATTING_AGG_COLUMNS)
+    s = {key: int(row[key]) for key in ["pa", "ab", "h", "h2", "h3", "hr", "tb", "rbi", "so", "bb", "hbp", "sf", "sb",
+                                        "two_strike_hit", "first_pitch_swing"]}
+    s["pull_count"], s["center_count"], s["oppo_count"] = _direction_counts(club_id, player_name)
 
     s["avg"] = round(s["h"] / s["ab"], 3) if s["ab"] > 0 else 0.000
     s["obp"] = round((s["h"] + s["bb"] + s["hbp"]) / s["pa"], 3) if s["pa"] > 0 else 0.000
-    h1 = s["h"] - (s["h2"] + s["h3"] + s["hr"])
-    total_bases = (h1 + 2*s["h2"] + 3*s["h3"] + 4*s["hr"])
-    s["slg"] = round(total_bases / s["ab"], 3) if s["ab"] > 0 else 0.000
+    s["slg"] = round(s["tb"] / s["ab"], 3) if s["ab"] > 0 else 0.000
     s["ops"] = round(s["obp"] + s["slg"], 3)
     
     babip_denom = (s["ab"] - s["so"] - s["hr"] + s["sf"])
@@ -1160,124 +2505,30 @@ def get_player_detailed_stats(player_name, club_id):
 
 
 # ■■■精密一覧のためのコード（投手）
-def get_pitching_stats_filtered(club_id):
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
-        c = conn.cursor()
-        c.execute("SELECT * FROM super_detailed_at_bats WHERE club_id = ?", (str(club_id),))
-        rows = c.fetchall()
+def get_pitching_stats_filtered(club_id, pitcher_name=None, season=None, month=None, team=None, use_aggregates=True):
+    """
+    投手成績一覧。1行=1投手の DataFrame（列は stats.py の表示キー、投手名は name 列）。
+    pitcher_name を指定した場合はその投手のみ（主キーでの1件検索）。
+    回数は「5.1 = 5回1/3」の表記で、数値として比較できる。
+    """
+    REGULATION_INN = 7
 
-    stats = {}
-    processed_at_bats = set()
+    df = _stat_totals("pitching", club_id, season, pitcher_name, use_aggregates, month=month, team=team)
+    df = df.rename(columns=dict(PITCHING_AGG_FIELDS))
+    for col in ["勝利", "敗戦", "セーブ", "ホールド"]:
+        df[col] = 0
 
-    for row in rows:
-        row_dict = dict(row)
-        batter_name = row_dict.get('batter_name') or ""
-        if "相手" not in batter_name:
-            continue
+    outs = df["アウト数"]
+    ip = outs / 3.0
+    df["回数"] = outs // 3 + (outs % 3) / 10
+    for col, base in [("防御率", "自責点"), ("奪三振率", "奪三振"), ("四球率", "四球"),
+                      ("死球率", "死球"), ("被安率", "被安打"), ("被本率", "被本塁打")]:
+        df[col] = _ratio(df[base] * REGULATION_INN, ip, 2)
+    df["K/BB"] = _ratio(df["奪三振"], df["四球"], 2).where(df["四球"] > 0, df["奪三振"].astype(float))
+    df["WHIP"] = _ratio(df["被安打"] + df["四球"], ip, 2)
+    df["CS率"] = _ratio(df["CS"], df["CS"] + df["被盗塁"], 3)
 
-        at_bat_key = f"{row_dict['game_id']}_{row_dict['at_bat_no']}"
-        if at_bat_key in processed_at_bats:
-            continue
-        processed_at_bats.add(at_bat_key)
-
-        name = row_dict.get('pitcher_name')
-        name = name if name and name != "Unknown" else "自チーム投手"
-
-        if name not in stats:
-            # stats.py が要求する全項目を初期化
-            stats[name] = {
-                "name": name, "登板": 0, "アウト数": 0, "失点": 0, "自責点": 0, 
-                "奪三振": 0, "四球": 0, "死球": 0, "被安打": 0, "被本塁打": 0, 
-                "投球数": 0, "打者数": 0, "game_ids": set(),
-                "勝利":0, "敗戦":0, "セーブ":0, "ホールド":0, "WP":0, "CS":0, "被盗塁":0
-            }
-        
-        s = stats[name]
-        s["game_ids"].add(row_dict['game_id'])
-        
-        res = row_dict.get('final_result') or row_dict.get('result') or ""
-        raw_json = row_dict.get('raw_data_json')
-        is_strikeout_flag = False
-        json_outs = 0
-        json_success = False
-
-        if raw_json:
-            try:
-                data = json.loads(raw_json)
-                if "play_log" in data:
-                    for log in data["play_log"]:
-                        if log.get("meta", {}).get("is_strikeout_stat"):
-                            is_strikeout_flag = True
-                            break
-
-                b_stat = data.get('batter', {}).get('status') or data.get('batter', {}).get('predicted_status')
-                if b_stat == "アウト": json_outs += 1
-                for runner in data.get('runners', []):
-                    r_stat = runner.get('status') or runner.get('predicted_status')
-                    if r_stat == "アウト": json_outs += 1
-                
-                if json_outs > 0:
-                    s["アウト数"] += json_outs
-                    json_success = True
-            except:
-                pass
-
-        if not json_success:
-            if "併殺" in res: s["アウト数"] += 2
-            elif "振り逃げ" in res: pass 
-            elif any(x in res for x in ["見", "空"]): s["アウト数"] += 1
-            elif any(x in res for x in ["ゴ", "飛", "直", "野選"]): 
-                if "失" not in res or "野選" in res:
-                    s["アウト数"] += 1
-
-        s["打者数"] += 1
-        s["投球数"] += row_dict.get('pitch_count') or 0
-        rbi = row_dict.get('rbi') or 0
-        s["失点"] += rbi
-        
-        if row_dict.get('is_earned_run') == 1: s["自責点"] += rbi
-        elif row_dict.get('is_earned_run') is None:
-            if "失" not in res: s["自責点"] += rbi
-
-        if any(x in res for x in ["安打", "単打", "二塁打", "三塁打", "本塁打"]): 
-            s["被安打"] += 1
-            if "本塁打" in res: s["被本塁打"] += 1
-
-        if "四球" in res: s["四球"] += 1
-        if "死球" in res: s["死球"] += 1
-        if "暴投" in res or "WP" in res: s["WP"] += 1
-        if "盗塁刺" in res or "CS" in res: s["CS"] += 1
-        if "盗塁" in res and "刺" not in res: s["被盗塁"] += 1
-        
-        if "振" in res or is_strikeout_flag: s["奪三振"] += 1 
-
-    final_list = []
-    REGULATION_INN = 7
-
-    for name, s in stats.items():
-        s["登板"] = len(s["game_ids"])
-        outs = s["アウト数"]
-        s["回数"] = f"{outs // 3}.{outs % 3}"
-        ip_float = outs / 3.0
-        
-        s["防御率"] = round((s["自責点"] * REGULATION_INN) / ip_float, 2) if ip_float > 0 else 0.00
-        s["奪三振率"] = round((s["奪三振"] * REGULATION_INN) / ip_float, 2) if ip_float > 0 else 0.00
-        s["四球率"] = round((s["四球"] * REGULATION_INN) / ip_float, 2) if ip_float > 0 else 0.00
-        s["死球率"] = round((s["死球"] * REGULATION_INN) / ip_float, 2) if ip_float > 0 else 0.00
-        s["被安率"] = round((s["被安打"] * REGULATION_INN) / ip_float, 2) if ip_float > 0 else 0.00
-        s["被本率"] = round((s["被本塁打"] * REGULATION_INN) / ip_float, 2) if ip_float > 0 else 0.00
-        s["K/BB"] = round(s["奪三振"] / s["四球"], 2) if s["四球"] > 0 else float(s["奪三振"])
-        s["WHIP"] = round((s["被安打"] + s["四球"]) / ip_float, 2) if ip_float > 0 else 0.00
-        
-        total_steal_attempts = s["CS"] + s["被盗塁"]
-        s["CS率"] = round(s["CS"] / total_steal_attempts, 3) if total_steal_attempts > 0 else 0.000
-        
-        del s["game_ids"]
-        del s["被盗塁"]
-        final_list.append(s)
-        
-    return final_list
+    return df.drop(columns=["被盗塁"]).rename_axis("name").reset_index()
 
 
 
@@ -1288,12 +2539,12 @@ def get_pitching_stats_filtered(club_id):
 # ■■■打率推移を見るコード
 
 def get_player_batting_history(player_name, club_id):
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
+    with get_connection() as conn:
         c = conn.cursor()
+        c.row_factory = sqlite3.Row
         c.execute("""SELECT summary FROM scorebook_batting 
                      WHERE player_name = ? AND club_id = ? 
-                     ORDER BY game_id ASC""", (player_name, club_id))
+                     ORDER BY id ASC""", (player_name, as_club_id(club_id)))
         rows = c.fetchall()
         
         history = []
@@ -1333,21 +2584,23 @@ def get_raw_at_bat_logs(player_name, club_id):
             at_bat_no, 
             inning, 
             pitch_count, 
-            result,             -- 一球ごとの結果
-            final_result,       -- 打席の最終結果(三振、安打等)
+            result,             -- 結果の表記（表示用）
+            outcome_class,      -- 打席結果の区分コード(三振、安打等)
+            outcome_bases,
+            is_hit,
             rbi, 
             two_strike_hit,     -- 2ストライク後の安打か
             first_pitch_swing,  -- 初球を振ったか
-            is_first_strike,    -- 初球ストライクか
+            first_pitch_strike AS is_first_strike,  -- 初球ストライクか
             raw_data_json 
         FROM super_detailed_at_bats 
         WHERE batter_name = ? AND club_id = ?
         ORDER BY created_at DESC
     """
-    with sqlite3.connect(DB_NAME) as conn:
-        conn.row_factory = sqlite3.Row
+    with get_connection() as conn:
         c = conn.cursor()
-        c.execute(query, (player_name, club_id))
+        c.row_factory = sqlite3.Row
+        c.execute(query, (player_name, as_club_id(club_id)))
         
         # 呼び出し側が扱いやすいよう辞書形式のリストで返す
         return [dict(row) for row in c.fetchall()]
@@ -1358,94 +2611,757 @@ def get_raw_at_bat_logs(player_name, club_id):
 # 　 分析スコア 
 # ----------------—
 
-# ■■■オンライン・オフライン切り替えスイッチ実装予定地
+# ■■■モバイル記録ストア（mobile_local.db）
+# モバイルスコアブックのデータ（記録スロット・選手/チームのキャッシュ・同期済み試合の記録）は
+# すべてこの 1 ファイルに置く。以前はスロットが software_ball.db、キャッシュが mobile_local.db、
+# 同期後の削除が softball.db を向いていて、保存・読込・削除が別々のファイルを触っていた。
+# スキーマは本体DBと同じ仕組み（MOBILE_SCHEMA_MIGRATIONS ＋ schema_version）で管理し、
+# 接続も get_connection(MOBILE_DB_NAME) の WAL 接続を使う。
+# 本体DBと 1 つの SQL で突き合わせたいときは attach_mobile_store(conn) で "mobile" として ATTACH する。
+#
+# トップメニューは 20 スロット分の見出し（日付・チーム・イニング・スコア）だけを表示するため、
+# 保存時に見出し用の列を書いておき、一覧は JSON を開かずに 1 クエリで読む（get_mobile_slot_index）。
+# 試合状態の JSON はスロットを開いたとき（load_mobile_slot）だけ展開する。
+#
+# 試合中の保存はボタンを押すたびに走るため、毎回試合全体を書き直さず、
+# 前回からの差分を slot_journal に 1 行ずつ追記する（append_mobile_slot_journal）。
+# 全体は save_mobile_slot が zlib 圧縮のスナップショットとして書き、そこまでのジャーナルは消す。
+# 読み込みは「スナップショット ＋ それ以降のジャーナルの再生」で元の状態を組み立てる。
+#
+# Core.cct への同期は画面から直接書かず、sync_outbox に試合単位で積む（enqueue_core_cct_sync）。
+# 送信は sync_worker のバックグラウンドスレッド（または別プロセス）が行い、失敗したら間隔を空けて再送する。
+# スロットは送信が成功するまで消さない。
+#
+# 試合中の入力はこのストアだけを読み書きし、本体DBには触らない（オフラインでも記録が止まらない）。
+# 本体DBとのやり取りは sync_mobile_data にまとめ、前回の同期位置（ウォーターマーク）から先の分だけを送受信する。
+
+MOBILE_DB_NAME = "mobile_local.db"
+MOBILE_STORE_ALIAS = "mobile"
+MOBILE_SLOT_COUNT = 20
+SLOT_SNAPSHOT_INTERVAL = 50   # この件数ジャーナルが溜まったらスナップショットを書き直す
+
+# 統合前にスロットを置いていたファイル（v2 で中身を取り込む。ファイル自体は消さずに残す）
+LEGACY_MOBILE_SLOT_DBS = ["software_ball.db", DB_NAME]
+
+# スロットの状態（slot_status）
+SLOT_STATUS_NOT_STARTED, SLOT_STATUS_PLAYING, SLOT_STATUS_FINISHED = 0, 1, 2
+
+_MOBILE_SLOT_SUMMARY_COLUMNS = [
+    ("game_date", "TEXT"), ("my_team", "TEXT"), ("opponent", "TEXT"),
+    ("inning", "INTEGER"), ("top_bottom", "TEXT"), ("score_text", "TEXT"),
+    ("slot_status", "INTEGER"), ("updated_at", "TIMESTAMP"),
+]
+_mobile_store_ready = False
+
+
+def _migrate_mobile_base_tables(c):
+    # --- 1. 記録スロット (mobile_slots) ---
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS mobile_slots (
+            club_id INTEGER,
+            slot_id INTEGER,
+            setup TEXT,
+            order_data TEXT,
+            PRIMARY KEY (club_id, slot_id)
+        )
+    """)
+    _add_missing_columns(c, "mobile_slots", _MOBILE_SLOT_SUMMARY_COLUMNS)
+
+    # --- 2. 選手・チームのキャッシュ（オフライン入力用） ---
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS player_cache (
+            player_id INTEGER PRIMARY KEY,
+            club_id INTEGER,
+            name TEXT,
+            number TEXT,
+            position TEXT
+        )
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS team_cache (
+            club_id INTEGER,
+            team_name TEXT,
+            team_color TEXT,
+            PRIMARY KEY (club_id, team_name)
+        )
+    """)
 
-def sync_mobile_data(club_id):
-    return True
+    # --- 3. Core.cct へ同期済みの試合（どのスロットから何打席送ったか） ---
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS synced_games (
+            club_id INTEGER,
+            game_id TEXT,
+            slot_id INTEGER,
+            log_count INTEGER,
+            synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (club_id, game_id)
+        )
+    """)
 
-def delete_game_slot(slot_id):
-    DB_PATH = "software_ball.db" 
-    conn = None
+
+def _legacy_slot_rows(path):
+    """統合前のファイルにある mobile_slots の行。ファイルやテーブルが無ければ空"""
+    if not os.path.exists(path):
+        return []
+    legacy = None
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS mobile_slots (
-                slot_id INTEGER PRIMARY KEY,
-                club_id TEXT,
-                setup TEXT,
-                order_data TEXT,
-                progress TEXT,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        # 旧ファイルは読むだけ（新規作成もロックの取り合いもしない）
+        legacy = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=BUSY_TIMEOUT_MS / 1000)
+        if "club_id" not in _table_columns(legacy.cursor(), "mobile_slots"):
+            return []
+        return legacy.execute("SELECT club_id, slot_id, setup, order_data FROM mobile_slots").fetchall()
+    except sqlite3.Error as e:
+        print(f"Legacy slot read skipped ({path}): {e}")
+        return []
+    finally:
+        if legacy is not None:
+            legacy.close()
+
+
+def _migrate_legacy_slots(c):
+    # 画面が実際に使っていた software_ball.db を優先し、同じ (club_id, slot_id) は先勝ち
+    for path in LEGACY_MOBILE_SLOT_DBS:
+        rows = [(as_club_id(club_id), slot_id, setup, order_data)
+                for club_id, slot_id, setup, order_data in _legacy_slot_rows(path)
+                if as_club_id(club_id) is not None]
+        c.executemany("""INSERT OR IGNORE INTO mobile_slots (club_id, slot_id, setup, order_data)
+                         VALUES (?, ?, ?, ?)""", rows)
+
+    # 旧 MobileDatabase が同じファイルに作っていたスロット表
+    c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'mobile_game_slots'")
+    if c.fetchone():
+        c.execute("""INSERT OR IGNORE INTO mobile_slots (club_id, slot_id, setup, order_data, updated_at)
+                     SELECT CAST(club_id AS INTEGER), slot_id, setup_json, order_json, updated_at
+                     FROM mobile_game_slots WHERE club_id IS NOT NULL""")
+        c.execute("DROP TABLE mobile_game_slots")
+    # 見出し列は get_mobile_slot_index の初回に _backfill_mobile_slot_summaries が埋める
+
+
+# 既存スロットの order_data（非圧縮 JSON）はそのまま読めるので変換しない
+def _migrate_slot_journal(c):
+    _add_missing_columns(c, "mobile_slots", [
+        ("order_snapshot", "BLOB"),
+        ("snapshot_seq", "INTEGER DEFAULT 0"),
+        ("journal_seq", "INTEGER DEFAULT 0"),
+    ])
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS slot_journal (
+            club_id INTEGER,
+            slot_id INTEGER,
+            seq INTEGER,
+            delta TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (club_id, slot_id, seq)
+        )
+    """)
+
 
-        cursor.execute("DELETE FROM mobile_slots WHERE slot_id = ?", (slot_id,))
+def _migrate_sync_outbox(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS sync_outbox (
+            club_id INTEGER,
+            game_id TEXT,
+            slot_id INTEGER,
+            payload BLOB,
+            slot_seq INTEGER,
+            revision INTEGER DEFAULT 1,
+            status TEXT,
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at TIMESTAMP,
+            last_error TEXT,
+            enqueued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP,
+            PRIMARY KEY (club_id, game_id)
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_sync_outbox_due ON sync_outbox (status, next_attempt_at)")
+
+
+# pushed_*: 本体DBの控えへ送り済みのスナップショット・ジャーナルの番号（NULL は未送信）
+def _migrate_sync_watermarks(c):
+    _add_missing_columns(c, "mobile_slots", [
+        ("pushed_snapshot_seq", "INTEGER"),
+        ("pushed_journal_seq", "INTEGER"),
+    ])
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS sync_watermarks (
+            club_id INTEGER,
+            stream TEXT,
+            position TEXT,
+            synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (club_id, stream)
+        )
+    """)
+
+
+# number / position には以前 birthday / hometown が入っていたため、ウォーターマークを消して全件を取り込み直させる
+def _migrate_reference_cache_columns(c):
+    _add_missing_columns(c, "player_cache", [
+        ("team_name", "TEXT"), ("throws", "TEXT"), ("bats", "TEXT"),
+        ("is_active", "INTEGER"), ("row_version", "INTEGER"),
+    ])
+    _add_missing_columns(c, "team_cache", [("row_version", "INTEGER")])
+    c.execute("DELETE FROM sync_watermarks WHERE stream = 'reference'")
+
+
+# 控えへ送ったことのあるストアに "slots" のウォーターマークを付ける（無いストアは送信前に控えから戻す）
+def _migrate_slot_push_watermark(c):
+    c.execute("""INSERT OR IGNORE INTO sync_watermarks (club_id, stream, position)
+                 SELECT DISTINCT club_id, 'slots', CURRENT_TIMESTAMP FROM mobile_slots
+                 WHERE pushed_journal_seq IS NOT NULL""")
+
+
+MOBILE_SCHEMA_MIGRATIONS = [
+    (1, "モバイル記録ストアのテーブル作成", _migrate_mobile_base_tables),
+    (2, "旧スロットファイルからの移行", _migrate_legacy_slots),
+    (3, "スロットの差分ジャーナル追加", _migrate_slot_journal),
+    (4, "Core.cct 同期の送信待ちテーブル作成", _migrate_sync_outbox),
+    (5, "同期ウォーターマーク追加", _migrate_sync_watermarks),
+    (6, "選手・チームキャッシュの列追加", _migrate_reference_cache_columns),
+    (7, "スロット送信のウォーターマーク追加", _migrate_slot_push_watermark),
+]
+
+
+def init_mobile_store():
+    """モバイル記録ストアのスキーマを最新化する。実処理はプロセスごとに最初の1回だけ"""
+    global _mobile_store_ready
+    if _mobile_store_ready:
+        return
+    with _schema_lock:
+        if not _mobile_store_ready:
+            run_migrations(get_connection(MOBILE_DB_NAME), MOBILE_SCHEMA_MIGRATIONS)
+            _mobile_store_ready = True
+
+
+def _mobile_store_connection():
+    init_mobile_store()
+    return get_connection(MOBILE_DB_NAME)
+
+
+def attach_mobile_store(conn, alias=MOBILE_STORE_ALIAS):
+    """本体DBの接続にモバイル記録ストアを ATTACH する（済みなら何もしない）。トランザクション外で呼ぶこと"""
+    init_mobile_store()
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+    if alias not in attached:
+        conn.execute("ATTACH DATABASE ? AS " + alias, (MOBILE_DB_NAME,))
+    return alias
+
+
+def _mobile_slot_summary(setup_data, combined_order):
+    """保存するスロットの見出し列（_MOBILE_SLOT_SUMMARY_COLUMNS の updated_at 以外の順）"""
+    setup = setup_data or {}
+    progress = (combined_order or {}).get("progress") or {}
+    prog_dict = progress.get("game_progress_dict") or {}
+    play_log = progress.get("play_log") or []
+
+    inning, top_bottom, score_text = None, None, ""
+    if not play_log:
+        status = SLOT_STATUS_NOT_STARTED
+    else:
+        last_event = play_log[-1]
+        inning = last_event.get("inning", prog_dict.get("inning", 1))
+        top_bottom = last_event.get("top_bottom", prog_dict.get("top_bottom", "表"))
+        score_text = (last_event.get("meta") or {}).get("score_snapshot", "")
+        if progress.get("game_status_str") == "finished" or prog_dict.get("is_finished"):
+            status = SLOT_STATUS_FINISHED
+        else:
+            status = SLOT_STATUS_PLAYING
+
+    return (setup.get("date"), setup.get("my_team", "自チーム"), setup.get("opponent", "相手不明"),
+            inning, top_bottom, score_text, status)
+
+
+def _backfill_mobile_slot_summaries(c, club_id):
+    """見出し列を持たない（この仕組み以前に保存された）スロットに見出しを書き込む"""
+    c.execute("SELECT slot_id, setup, order_data FROM mobile_slots WHERE club_id = ? AND slot_status IS NULL", (club_id,))
+    rows = c.fetchall()
+    if not rows:
+        return
+    assignments = ", ".join(f"{col} = ?" for col, _ in _MOBILE_SLOT_SUMMARY_COLUMNS[:-1])
+    updates = []
+    for slot_id, setup_json, order_json in rows:
+        try:
+            summary = _mobile_slot_summary(json.loads(setup_json or "{}"), json.loads(order_json or "{}"))
+        except (TypeError, ValueError):
+            summary = (None, "自チーム", "相手不明", None, None, "", SLOT_STATUS_NOT_STARTED)
+        updates.append((*summary, club_id, slot_id))
+    c.executemany(f"UPDATE mobile_slots SET {assignments} WHERE club_id = ? AND slot_id = ?", updates)
+
+
+def get_mobile_slot_index(club_id):
+    """全スロットの見出しを {slot_id: {game_date, my_team, opponent, inning, top_bottom, score_text, slot_status, updated_at}} で返す"""
+    club_id = as_club_id(club_id)
+    conn = _mobile_store_connection()
+    c = conn.cursor()
+    try:
+        _backfill_mobile_slot_summaries(c, club_id)
+        conn.commit()
+        c.row_factory = sqlite3.Row
+        columns = ", ".join(col for col, _ in _MOBILE_SLOT_SUMMARY_COLUMNS)
+        c.execute(f"SELECT slot_id, {columns} FROM mobile_slots WHERE club_id = ? AND slot_id BETWEEN 1 AND ?",
+                  (club_id, MOBILE_SLOT_COUNT))
+        return {row["slot_id"]: dict(row) for row in c.fetchall()}
+    except Exception as e:
+        conn.rollback()
+        st.error(f"スロット一覧の読み込み失敗: {e}")
+        return {}
+
+def _delete_slot_rows(c, slot_id, club_id=None):
+    """club_id を省略した場合は全倶楽部の同じ番号のスロットを消す（旧仕様の呼び出し用）"""
+    for table in ("mobile_slots", "slot_journal"):
+        if club_id is None:
+            c.execute(f"DELETE FROM {table} WHERE slot_id = ?", (slot_id,))
+        else:
+            c.execute(f"DELETE FROM {table} WHERE club_id = ? AND slot_id = ?", (as_club_id(club_id), slot_id))
+
+def delete_game_slot(slot_id, club_id=None):
+    try:
+        conn = _mobile_store_connection()
+        cursor = conn.cursor()
+        _delete_slot_rows(cursor, slot_id, club_id)
         conn.commit()
         return True
         
     except Exception as e:
         st.error(f"database.pyでの削除失敗: {e}")
         return False
-    finally:
-        if conn:
-            conn.close()
+
+def _pack_slot_state(combined_order):
+    return zlib.compress(json.dumps(combined_order, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+def _unpack_slot_state(order_snapshot, order_data):
+    if order_snapshot is not None:
+        return json.loads(zlib.decompress(order_snapshot).decode("utf-8"))
+    return json.loads(order_data or "{}")
+
+def _apply_slot_delta(setup, combined_order, delta):
+    """ジャーナル 1 件分の差分を適用する
+    delta = {"setup": 設定, "order": {"my"/"opp": ...}, "set": {progress のキー: 値},
+             "extend": {progress のキー: [先頭位置, 追加・置換する要素]}}（いずれも省略可）"""
+    if "setup" in delta:
+        setup = delta["setup"]
+    combined_order.update(delta.get("order", {}))
+    progress = combined_order.setdefault("progress", {})
+    progress.update(delta.get("set", {}))
+    for key, (base, items) in delta.get("extend", {}).items():
+        values = progress.get(key) or []
+        del values[base:]
+        values.extend(items)
+        progress[key] = values
+    return setup
 
 def load_mobile_slot(club_id, slot_id):
-    conn = sqlite3.connect("software_ball.db")
+    club_id = as_club_id(club_id)
+    conn = _mobile_store_connection()
     cursor = conn.cursor()    
     try:
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS mobile_slots (
-                club_id TEXT,
-                slot_id INTEGER,
-                setup TEXT,
-                order_data TEXT,
-                PRIMARY KEY (club_id, slot_id)
-            )
-        """)        
-        cursor.execute("SELECT setup, order_data FROM mobile_slots WHERE club_id = ? AND slot_id = ?", (club_id, slot_id))
+        cursor.execute("""SELECT setup, order_data, order_snapshot, snapshot_seq
+                          FROM mobile_slots WHERE club_id = ? AND slot_id = ?""", (club_id, slot_id))
         row = cursor.fetchone()        
         if row:
-            # row[0] が setup, row[1] が order_data
+            setup = json.loads(row[0] or "{}")
+            combined_order = _unpack_slot_state(row[2], row[1])
+            cursor.execute("SELECT delta FROM slot_journal WHERE club_id = ? AND slot_id = ? AND seq > ? ORDER BY seq",
+                           (club_id, slot_id, row[3] or 0))
+            journal = cursor.fetchall()
+            for (delta_json,) in journal:
+                setup = _apply_slot_delta(setup, combined_order, json.loads(delta_json))
             return {
-                "setup": json.loads(row[0]),
-                "order": json.loads(row[1])
+                "setup": setup,
+                "order": combined_order,
+                "journal_length": len(journal),
             }
         return None
     except Exception as e:
         import streamlit as st
         st.error(f"スロット読み込み失敗: {e}")
         return None
-    finally:
-        conn.close()
 
 def save_mobile_slot(club_id, slot_id, setup_data, combined_order):
-    import sqlite3
-    conn = sqlite3.connect("software_ball.db")
+    """
+    スロット全体をスナップショットとして書き、それまでのジャーナルを消す。
+    journal_seq はジャーナル追記と同じく 1 進める（スロットが書き換えられたかの判定に使う）
+    """
+    club_id = as_club_id(club_id)
+    conn = _mobile_store_connection()
     cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS mobile_slots (
-            club_id TEXT,
-            slot_id INTEGER,
-            setup TEXT,
-            order_data TEXT,
-            PRIMARY KEY (club_id, slot_id)
-        )
-    """)    
     setup_json = json.dumps(setup_data, ensure_ascii=False)
-    order_json = json.dumps(combined_order, ensure_ascii=False)    
+    summary_cols = [col for col, _ in _MOBILE_SLOT_SUMMARY_COLUMNS[:-1]]
     try:
-        cursor.execute("""
-            INSERT INTO mobile_slots (club_id, slot_id, setup, order_data)
-            VALUES (?, ?, ?, ?)
+        cursor.execute(f"""
+            INSERT INTO mobile_slots (club_id, slot_id, setup, order_data, order_snapshot, {', '.join(summary_cols)}, updated_at)
+            VALUES (?, ?, ?, NULL, ?, {', '.join('?' * len(summary_cols))}, CURRENT_TIMESTAMP)
             ON CONFLICT(club_id, slot_id) DO UPDATE SET
                 setup = excluded.setup,
-                order_data = excluded.order_data
-        """, (club_id, slot_id, setup_json, order_json))
+                order_data = NULL,
+                order_snapshot = excluded.order_snapshot,
+                journal_seq = journal_seq + 1,
+                snapshot_seq = journal_seq + 1,
+                {', '.join(f'{col} = excluded.{col}' for col in summary_cols)},
+                updated_at = excluded.updated_at
+        """, (club_id, slot_id, setup_json, _pack_slot_state(combined_order),
+              *_mobile_slot_summary(setup_data, combined_order)))
+        cursor.execute("DELETE FROM slot_journal WHERE club_id = ? AND slot_id = ?", (club_id, slot_id))
         conn.commit()
-    finally:
-        conn.close()
+    except Exception:
+        conn.rollback()
+        raise
+
+def append_mobile_slot_journal(club_id, slot_id, delta, summary_order):
+    """
+    前回保存からの差分（_apply_slot_delta の形式）を 1 行追記し、スナップショット以降の件数を返す。
+    summary_order は見出し列の計算用で、play_log は末尾 1 件だけあればよい。
+    スロットの行がまだ無い場合は None を返すので、呼び出し側で save_mobile_slot すること。
+    """
+    club_id = as_club_id(club_id)
+    conn = _mobile_store_connection()
+    cursor = conn.cursor()
+    summary = _mobile_slot_summary(delta.get("setup") or {}, summary_order)
+    # 設定が変わっていなければ日付・チーム名の見出しはそのまま
+    summary_cols = [col for col, _ in _MOBILE_SLOT_SUMMARY_COLUMNS[:-1]]
+    if "setup" not in delta:
+        summary_cols, summary = summary_cols[3:], summary[3:]
+    try:
+        cursor.execute(f"""
+            UPDATE mobile_slots SET journal_seq = journal_seq + 1,
+                {', '.join(f'{col} = ?' for col in summary_cols)},
+                {'setup = ?,' if 'setup' in delta else ''}
+                updated_at = CURRENT_TIMESTAMP
+            WHERE club_id = ? AND slot_id = ?
+            RETURNING journal_seq, snapshot_seq
+        """, (*summary, *([json.dumps(delta["setup"], ensure_ascii=False)] if "setup" in delta else []),
+              club_id, slot_id))
+        row = cursor.fetchone()
+        if row is None:
+            conn.rollback()
+            return None
+        cursor.execute("INSERT INTO slot_journal (club_id, slot_id, seq, delta) VALUES (?, ?, ?, ?)",
+                       (club_id, slot_id, row[0], json.dumps(delta, ensure_ascii=False, separators=(",", ":"))))
+        conn.commit()
+        return row[0] - (row[1] or 0)
+    except Exception:
+        conn.rollback()
+        raise
+
+
+# ■■■Core.cct 同期の送信待ち（sync_outbox）
+# 1 試合 1 行。同じ試合をもう一度積むと送信内容を差し替えて pending に戻し、revision を進める。
+# 送信中（running）に差し替えられた場合、古い revision の完了・失敗は状態に反映しない。
+# 送信が成功したら、積んだ時点から書き換えられていない（journal_seq が slot_seq のまま）スロットだけ消す。
+# 再送は SYNC_RETRY_BASE_SEC × 2^(失敗回数-1) 秒後（上限 SYNC_RETRY_MAX_SEC）。
+# SYNC_MAX_ATTEMPTS 回失敗したら failed で止め、画面からもう一度同期を押すとやり直す。
+
+SYNC_STATUS_PENDING, SYNC_STATUS_RUNNING = "pending", "running"
+SYNC_STATUS_DONE, SYNC_STATUS_FAILED = "done", "failed"
+SYNC_RETRY_BASE_SEC = 5
+SYNC_RETRY_MAX_SEC = 300
+SYNC_MAX_ATTEMPTS = 8
+
+
+def enqueue_core_cct_sync(club_id, game_id, slot_id, sync_data_list):
+    """試合の同期データを送信待ちに積む（同じ試合が積まれていれば差し替える）"""
+    club_id = as_club_id(club_id)
+    conn = _mobile_store_connection()
+    c = conn.cursor()
+    try:
+        c.execute("SELECT journal_seq FROM mobile_slots WHERE club_id = ? AND slot_id = ?", (club_id, slot_id))
+        row = c.fetchone()
+        c.execute("""
+            INSERT INTO sync_outbox (club_id, game_id, slot_id, payload, slot_seq, status, next_attempt_at)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(club_id, game_id) DO UPDATE SET
+                slot_id = excluded.slot_id,
+                payload = excluded.payload,
+                slot_seq = excluded.slot_seq,
+                revision = revision + 1,
+                status = excluded.status,
+                attempts = 0,
+                next_attempt_at = excluded.next_attempt_at,
+                last_error = NULL,
+                enqueued_at = CURRENT_TIMESTAMP,
+                finished_at = NULL
+        """, (club_id, as_game_id(game_id), slot_id, _pack_slot_state(sync_data_list),
+              row[0] if row else None, SYNC_STATUS_PENDING))
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        print(f"Error enqueueing sync: {e}")
+        return False
+
+
+def claim_core_cct_sync():
+    """
+    送信時刻になった 1 件を running にして返す（無ければ None）。
+    戻り値は {club_id, game_id, slot_id, revision, attempts, payload(同期データのリスト)}
+    """
+    conn = _mobile_store_connection()
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("""
+            UPDATE sync_outbox SET status = ?
+            WHERE rowid = (SELECT rowid FROM sync_outbox
+                           WHERE status = ? AND next_attempt_at <= CURRENT_TIMESTAMP
+                           ORDER BY next_attempt_at LIMIT 1)
+            RETURNING club_id, game_id, slot_id, revision, attempts, payload
+        """, (SYNC_STATUS_RUNNING, SYNC_STATUS_PENDING))
+        row = c.fetchone()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if row is None:
+        return None
+    club_id, game_id, slot_id, revision, attempts, payload = row
+    return {"club_id": club_id, "game_id": game_id, "slot_id": slot_id, "revision": revision,
+            "attempts": attempts, "payload": _unpack_slot_state(payload, None)}
+
+
+def complete_core_cct_sync(job):
+    """送信成功。スロットが積んだ時点のままなら消して synced_games に記録する"""
+    conn = _mobile_store_connection()
+    c = conn.cursor()
+    try:
+        c.execute("""UPDATE sync_outbox SET status = ?, finished_at = CURRENT_TIMESTAMP, last_error = NULL
+                     WHERE club_id = ? AND game_id = ? AND revision = ?
+                     RETURNING slot_seq""",
+                  (SYNC_STATUS_DONE, job["club_id"], job["game_id"], job["revision"]))
+        row = c.fetchone()
+        if row is not None:
+            c.execute("SELECT journal_seq FROM mobile_slots WHERE club_id = ? AND slot_id = ?",
+                      (job["club_id"], job["slot_id"]))
+            slot = c.fetchone()
+            if slot is not None and slot[0] == row[0]:
+                _delete_slot_rows(c, job["slot_id"], job["club_id"])
+            c.execute("""INSERT OR REPLACE INTO synced_games (club_id, game_id, slot_id, log_count, synced_at)
+                         VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)""",
+                      (job["club_id"], job["game_id"], job["slot_id"], len(job["payload"])))
+        conn.commit()
+        return row is not None
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def fail_core_cct_sync(job, error):
+    """送信失敗。再送時刻を後ろにずらし、上限回数に達したら failed にする"""
+    attempts = job["attempts"] + 1
+    delay = min(SYNC_RETRY_MAX_SEC, SYNC_RETRY_BASE_SEC * 2 ** (attempts - 1))
+    status = SYNC_STATUS_FAILED if attempts >= SYNC_MAX_ATTEMPTS else SYNC_STATUS_PENDING
+    conn = _mobile_store_connection()
+    try:
+        conn.execute("""UPDATE sync_outbox SET status = ?, attempts = ?, last_error = ?,
+                            next_attempt_at = datetime('now', ?)
+                        WHERE club_id = ? AND game_id = ? AND revision = ?""",
+                     (status, attempts, str(error)[:500], f"+{delay} seconds",
+                      job["club_id"], job["game_id"], job["revision"]))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def requeue_running_core_cct_sync():
+    """送信中のまま止まった（プロセスが落ちた）行を pending に戻す。同期は何度送っても結果が同じなので再送してよい"""
+    conn = _mobile_store_connection()
+    with conn:
+        conn.execute("UPDATE sync_outbox SET status = ? WHERE status = ?", (SYNC_STATUS_PENDING, SYNC_STATUS_RUNNING))
+
+
+def get_core_cct_sync_status(club_id):
+    """スロットごとの未完了の同期を {slot_id: {game_id, status, attempts, last_error, next_attempt_at}} で返す"""
+    conn = _mobile_store_connection()
+    c = conn.cursor()
+    c.row_factory = sqlite3.Row
+    c.execute("""SELECT slot_id, game_id, status, attempts, last_error, next_attempt_at
+                 FROM sync_outbox WHERE club_id = ? AND status != ?
+                 ORDER BY enqueued_at""", (as_club_id(club_id), SYNC_STATUS_DONE))
+    return {row["slot_id"]: dict(row) for row in c.fetchall()}
+
+
+# ■■■オフライン記録の同期（sync_mobile_data）
+# 送信: スロットのうち前回送ってから書き込みがあったもの（journal_seq が pushed_journal_seq と違う）だけを
+#       本体DBの mobile_slot_replicas / mobile_slot_replica_journal に写す。
+#       スナップショットが変わっていなければ、送るのは見出し列と新しいジャーナル行だけ。
+#       端末側で消したスロットは控えからも消す。最後に送った日時を sync_watermarks（stream "slots"）に残す。
+# 復元: まだ一度も送っていないストア（新しい端末・消したストア）は、送信の前に
+#       控えにあって端末に無いスロットを戻す（restore_mobile_slots）。戻さずに送ると控えが消えてしまう。
+# 受信: 前回取り込んだ row_version より後に変わった選手・チームと削除だけをキャッシュに反映し、
+#       取り込んだ番号を sync_watermarks（stream "reference"）に残す。
+# 本体DBに届かない（オフライン）ときは False を返すだけで、記録はそのまま続けられる。
+
+def _get_sync_watermark(c, club_id, stream):
+    c.execute("SELECT position FROM sync_watermarks WHERE club_id = ? AND stream = ?", (club_id, stream))
+    row = c.fetchone()
+    return row[0] if row else None
+
+
+def _set_sync_watermark(c, club_id, stream, position):
+    c.execute("""INSERT OR REPLACE INTO sync_watermarks (club_id, stream, position, synced_at)
+                 VALUES (?, ?, ?, CURRENT_TIMESTAMP)""", (club_id, stream, position))
+
+
+def get_last_mobile_sync(club_id):
+    """最後に同期できた日時（未同期なら None）"""
+    conn = _mobile_store_connection()
+    c = conn.cursor()
+    c.execute("""SELECT datetime(synced_at, 'localtime') FROM sync_watermarks
+                 WHERE club_id = ? AND stream = 'reference'""", (as_club_id(club_id),))
+    row = c.fetchone()
+    return row[0] if row else None
+
+
+def pull_reference_data(club_id):
+    """選手・チームのキャッシュに前回からの変更を反映し、反映した行数を返す"""
+    club_id = as_club_id(club_id)
+    conn = _mobile_store_connection()
+    c = conn.cursor()
+    since = _get_sync_watermark(c, club_id, "reference")
+    changes = get_reference_changes(club_id, since)
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        if since is None:
+            c.execute("DELETE FROM player_cache WHERE club_id = ?", (club_id,))
+            c.execute("DELETE FROM team_cache WHERE club_id = ?", (club_id,))
+        # 削除 → 追加・更新の順（消した後に同じ名前で作り直したチームを残すため）
+        c.executemany("DELETE FROM player_cache WHERE player_id = ?",
+                      [(player_id,) for player_id in changes["deleted"]["players"]])
+        c.executemany("DELETE FROM team_cache WHERE club_id = ? AND team_name = ?",
+                      [(club_id, name) for name in changes["deleted"]["teams"]])
+        c.executemany("""
+            INSERT INTO player_cache (player_id, club_id, name, team_name, throws, bats, is_active, row_version)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(player_id) DO UPDATE SET
+                club_id = excluded.club_id, name = excluded.name, number = NULL, position = NULL,
+                team_name = excluded.team_name, throws = excluded.throws, bats = excluded.bats,
+                is_active = excluded.is_active, row_version = excluded.row_version
+        """, [(player_id, club_id, *rest) for player_id, *rest in changes["players"]])
+        c.executemany("""
+            INSERT INTO team_cache (club_id, team_name, team_color, row_version) VALUES (?, ?, ?, ?)
+            ON CONFLICT(club_id, team_name) DO UPDATE SET
+                team_color = excluded.team_color, row_version = excluded.row_version
+        """, [(club_id, *team) for team in changes["teams"]])
+        _set_sync_watermark(c, club_id, "reference", str(changes["version"]))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return (len(changes["players"]) + len(changes["teams"])
+            + len(changes["deleted"]["players"]) + len(changes["deleted"]["teams"]))
+
+
+def push_mobile_slots(club_id):
+    """書き込みのあったスロットを本体DBの控えへ送り、送ったスロット数を返す"""
+    club_id = as_club_id(club_id)
+    conn = get_connection()
+    alias = attach_mobile_store(conn)
+    summary_cols = [col for col, _ in _MOBILE_SLOT_SUMMARY_COLUMNS]
+    changed = "(s.pushed_journal_seq IS NULL OR s.journal_seq != s.pushed_journal_seq)"
+    full = "(s.pushed_snapshot_seq IS NULL OR s.snapshot_seq != s.pushed_snapshot_seq)"
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        # スナップショットから送り直すスロットは控えのジャーナルを捨てる
+        c.execute(f"""DELETE FROM mobile_slot_replica_journal WHERE club_id = ? AND slot_id IN
+                      (SELECT slot_id FROM {alias}.mobile_slots s WHERE s.club_id = ? AND {full})""",
+                  (club_id, club_id))
+        c.execute(f"""INSERT OR REPLACE INTO mobile_slot_replica_journal (club_id, slot_id, seq, delta)
+                      SELECT j.club_id, j.slot_id, j.seq, j.delta
+                      FROM {alias}.slot_journal j
+                      JOIN {alias}.mobile_slots s ON s.club_id = j.club_id AND s.slot_id = j.slot_id
+                      WHERE j.club_id = ? AND j.seq > CASE WHEN {full} THEN 0 ELSE s.pushed_journal_seq END""",
+                  (club_id,))
+        # 試合全体（order_data / order_snapshot）はスナップショットが変わったときだけ送る
+        c.execute(f"""
+            INSERT INTO mobile_slot_replicas (club_id, slot_id, setup, order_data, order_snapshot,
+                                              snapshot_seq, journal_seq, {', '.join(summary_cols)}, pushed_at)
+            SELECT s.club_id, s.slot_id, s.setup,
+                   CASE WHEN {full} THEN s.order_data END, CASE WHEN {full} THEN s.order_snapshot END,
+                   s.snapshot_seq, s.journal_seq, {', '.join(f's.{col}' for col in summary_cols)}, CURRENT_TIMESTAMP
+            FROM {alias}.mobile_slots s
+            WHERE s.club_id = ? AND {changed}
+            ON CONFLICT(club_id, slot_id) DO UPDATE SET
+                setup = excluded.setup,
+                order_data = CASE WHEN excluded.order_data IS NULL AND excluded.order_snapshot IS NULL
+                                  THEN order_data ELSE excluded.order_data END,
+                order_snapshot = CASE WHEN excluded.order_data IS NULL AND excluded.order_snapshot IS NULL
+                                      THEN order_snapshot ELSE excluded.order_snapshot END,
+                snapshot_seq = excluded.snapshot_seq,
+                journal_seq = excluded.journal_seq,
+                {', '.join(f'{col} = excluded.{col}' for col in summary_cols)},
+                pushed_at = excluded.pushed_at
+        """, (club_id,))
+        pushed = c.rowcount
+        for table in ("mobile_slot_replicas", "mobile_slot_replica_journal"):
+            c.execute(f"""DELETE FROM {table} WHERE club_id = ? AND slot_id NOT IN
+                          (SELECT slot_id FROM {alias}.mobile_slots WHERE club_id = ?)""", (club_id, club_id))
+        c.execute(f"""UPDATE {alias}.mobile_slots
+                      SET pushed_snapshot_seq = snapshot_seq, pushed_journal_seq = journal_seq
+                      WHERE club_id = ? AND (pushed_journal_seq IS NULL OR journal_seq != pushed_journal_seq
+                                             OR snapshot_seq != pushed_snapshot_seq)""", (club_id,))
+        c.execute(f"""INSERT OR REPLACE INTO {alias}.sync_watermarks (club_id, stream, position, synced_at)
+                      VALUES (?, 'slots', CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)""", (club_id,))
+        conn.commit()
+        return pushed
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def restore_mobile_slots(club_id):
+    """
+    本体DBの控えにあって端末に無いスロットを、スナップショットとジャーナルごと端末へ戻し、戻したスロット数を返す。
+    戻したスロットは控えと同じ内容なので、送信済み（pushed_* = 現在の番号）として入れる
+    """
+    club_id = as_club_id(club_id)
+    conn = get_connection()
+    alias = attach_mobile_store(conn)
+    summary_cols = [col for col, _ in _MOBILE_SLOT_SUMMARY_COLUMNS]
+    missing = f"slot_id NOT IN (SELECT slot_id FROM {alias}.mobile_slots WHERE club_id = ?)"
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        c.execute(f"""INSERT OR REPLACE INTO {alias}.slot_journal (club_id, slot_id, seq, delta)
+                      SELECT club_id, slot_id, seq, delta FROM mobile_slot_replica_journal
+                      WHERE club_id = ? AND {missing}""", (club_id, club_id))
+        c.execute(f"""
+            INSERT INTO {alias}.mobile_slots (club_id, slot_id, setup, order_data, order_snapshot,
+                                              snapshot_seq, journal_seq, {', '.join(summary_cols)},
+                                              pushed_snapshot_seq, pushed_journal_seq)
+            SELECT club_id, slot_id, setup, order_data, order_snapshot,
+                   snapshot_seq, journal_seq, {', '.join(summary_cols)}, snapshot_seq, journal_seq
+            FROM mobile_slot_replicas
+            WHERE club_id = ? AND {missing}
+        """, (club_id, club_id))
+        restored = c.rowcount
+        conn.commit()
+        return restored
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def sync_mobile_data(club_id):
+    """
+    モバイル記録ストアと本体DBを同期する（未送信のストアなら控えからの復元 → スロットの送信 → 選手・チームの受信）。
+    本体DBに届かなければ False
+    """
+    club_id = as_club_id(club_id)
+    if club_id is None:
+        return False
+    try:
+        restored = 0
+        if _get_sync_watermark(_mobile_store_connection().cursor(), club_id, "slots") is None:
+            restored = restore_mobile_slots(club_id)
+        pushed = push_mobile_slots(club_id)
+        pulled = pull_reference_data(club_id)
+        if restored or pushed or pulled:
+            print(f"DEBUG: モバイル記録を同期しました（復元 {restored}スロット, 送信 {pushed}スロット, 受信 {pulled}件）")
+        return True
+    except sqlite3.Error as e:
+        print(f"Mobile sync error (オフラインのまま続行): {e}")
+        return False
 
 
 # -------------—-
@@ -1453,11 +3369,11 @@ def save_mobile_slot(club_id, slot_id, setup_data, combined_order):
 # --------------—
 
 def get_all_clubs():
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         return pd.read_sql("SELECT id, name, created_at, plan_type FROM clubs ORDER BY id DESC", conn)
 
 def delete_club_complete(club_id):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
         tables = [
             'players', 
@@ -1469,7 +3385,11 @@ def delete_club_complete(club_id):
             'attendance', 
             'users', 
             'activity_logs',
-            'super_detailed_at_bats' 
+            'super_detailed_at_bats',
+            'batting_aggregates',
+            'pitching_aggregates',
+            'game_box_scores',
+            'row_tombstones'
         ]
         
         for table in tables:
@@ -1479,10 +3399,12 @@ def delete_club_complete(club_id):
                 continue
                 
         c.execute("DELETE FROM clubs WHERE id = ?", (club_id,))
+        # 版数は消さずに進める（消すと 0 に戻り、削除前の結果がキャッシュから返ってしまう）
+        _bump_data_version(c, club_id)
         conn.commit()
 
 def get_all_clubs_for_master():
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         query = """
             SELECT id, login_id, raw_password, display_name, created_at, plan_type 
             FROM clubs 
@@ -1491,7 +3413,7 @@ def get_all_clubs_for_master():
         return pd.read_sql(query, conn)
 
 def get_club_list_for_view():
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
         c.execute("SELECT id, display_name as name FROM clubs ORDER BY display_name ASC")
         return c.fetchall()
@@ -1502,35 +3424,39 @@ def get_club_list_for_view():
 # ----------------—
 
 def get_club_name_by_id(club_id):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
         c.execute("SELECT display_name FROM clubs WHERE id = ?", (club_id,))
         result = c.fetchone()
         return result[0] if result else "不明な倶楽部"
 
 def get_club_login_id(club_id):
-    with sqlite3.connect(DB_NAME) as conn:
+    with get_connection() as conn:
         c = conn.cursor()
         c.execute("SELECT login_id FROM clubs WHERE id = ?", (club_id,))
         result = c.fetchone()
         return result[0] if result else None
 
-def ensure_team_exists(club_id, team_name):
+def _ensure_team_row(c, club_id, team_name):
+    """未登録のチームを teams に追加する（呼び出し側のトランザクション内で行う）。追加したら True"""
     if not team_name or str(team_name).strip() == "" or team_name == "未所属":
-        return 
+        return False
     name_clean = str(team_name).strip()    
-    with sqlite3.connect(DB_NAME) as conn:
-        c = conn.cursor()
-        c.execute("SELECT id FROM teams WHERE club_id = ? AND UPPER(name) = UPPER(?)", 
-                  (club_id, name_clean))
-        if not c.fetchone():
-            try:
-                c.execute("INSERT INTO teams (club_id, name, color) VALUES (?, ?, ?)", 
-                          (club_id, name_clean, "#1E3A8A"))
-                conn.commit()
-                print(f"DEBUG: Auto-registered team '{name_clean}' for club_id {club_id}")
-            except sqlite3.IntegrityError:
-                pass
+    c.execute("SELECT id FROM teams WHERE club_id = ? AND UPPER(name) = UPPER(?)", 
+              (club_id, name_clean))
+    if c.fetchone():
+        return False
+    try:
+        c.execute("INSERT INTO teams (club_id, name, color, row_version, updated_at) VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)", 
+                  (club_id, name_clean, "#1E3A8A", _next_row_version(c, club_id)))
+    except sqlite3.IntegrityError:
+        return False
+    print(f"DEBUG: Auto-registered team '{name_clean}' for club_id {club_id}")
+    return True
+
+def ensure_team_exists(club_id, team_name):
+    with get_connection() as conn:
+        _ensure_team_row(conn.cursor(), club_id, team_name)
 
 def get_team_colors(club_id):
     colors = {}
@@ -1561,101 +3487,92 @@ def get_team_names(club_id):
 #  Core.cct 同期専用ロジック
 # -----------------------------
 
-def init_core_cct_table():
-
-    with sqlite3.connect(DB_NAME) as conn:
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS core_cct_logs
-                     (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                      club_id INTEGER,
-                      game_id TEXT,
-                      match_date TEXT,
-                      my_team_name TEXT,
-                      opp_team_name TEXT,
-                      handicap_my_team INTEGER DEFAULT 0,
-                      handicap_opp_team INTEGER DEFAULT 0,
-                      is_top_flag INTEGER, 
-                      is_tiebreak INTEGER DEFAULT 0,
-                      inning TEXT,
-                      batting_order INTEGER,
-                      pitcher_name TEXT,
-                      pitcher_hand TEXT, 
-                      pitching_style TEXT, 
-                      batter_name TEXT,
-                      start_score_my INTEGER,
-                      start_score_opp INTEGER,
-                      start_outs INTEGER,
-                      start_runners TEXT, 
-                      counts_history_json TEXT, 
-                      at_bat_result TEXT, 
-                      run_result TEXT, 
-                      hit_direction TEXT, 
-                      hit_type TEXT, 
-                      event_type TEXT, 
-                      sub_detail TEXT, 
-                      error_player TEXT,
-                      timestamp DATETIME DEFAULT CURRENT_TIMESTAMP)''')
-
-        missing_columns = [
-            "pitcher_hand TEXT",
-            "pitching_style TEXT",
-            "is_tiebreak INTEGER DEFAULT 0",
-            "error_player TEXT"
-        ]
-
-        for col_def in missing_columns:
-            try:
-                col_name = col_def.split()[0]
-                c.execute(f"ALTER TABLE core_cct_logs ADD COLUMN {col_def}")
-                print(f"Added column: {col_name}")
-            except sqlite3.OperationalError:
+# 同じ試合を何度同期しても 1 回分になるよう、自然キー（CORE_CCT_KEY_COLUMNS）で upsert する。
+# 送られてくるのは常に試合全体なので、今回送られなかったキーの行（Undo で消した打席、
+# 旧仕様の二重同期で重複した行）は削除する。保存済みと同じ内容なら何も書かない。
+
+CORE_CCT_KEY_COLUMNS = ["club_id", "game_id", "inning", "event_seq"]
+CORE_CCT_VALUE_COLUMNS = [
+    "match_date", "my_team_name", "opp_team_name",
+    "handicap_my_team", "handicap_opp_team", "is_top_flag", "is_tiebreak",
+    "batting_order", "pitcher_name", "pitcher_hand", "pitching_style",
+    "batter_name", "start_score_my", "start_score_opp", "start_outs", "start_runners",
+    "counts_history_json", "at_bat_result", "run_result",
+    "hit_direction", "hit_type", "event_type", "sub_detail", "error_player",
+    *OUTCOME_CODE_COLUMNS,
+]
+
+
+def _core_cct_sync_rows(club_id, sync_data_list):
+    """同期データを CORE_CCT_KEY_COLUMNS + CORE_CCT_VALUE_COLUMNS 順のタプルにする（event_seq は送られてきた順）"""
+    seqs = {}
+    rows = []
+    for data in sync_data_list:
+        game_id = as_game_id(data.get("game_id"))
+        inning = data.get("inning")
+        seq = seqs[(game_id, inning)] = seqs.get((game_id, inning), 0) + 1
+        event_type = data.get("type", "at_bat_result")
+        rows.append((club_id, game_id, inning, seq,
+                     data.get("date"), 
+                     data.get("my_team"), data.get("opp_team"),
+                     data.get("h_my", 0), data.get("h_opp", 0), 
+                     1 if data.get("is_top") else 0, 
+                     1 if data.get("is_tb") else 0,
+                     data.get("order"), 
+                     data.get("pitcher"), 
+                     data.get("p_hand", "R"), 
+                     data.get("p_style", "Windmill"),
+                     data.get("batter"),
+                     data.get("s_my"), 
+                     data.get("s_opp"), 
+                     data.get("outs"), 
+                     str(data.get("runners")),
+                     json.dumps(data.get("counts_history", []), ensure_ascii=False), data.get("res"), 
+                     data.get("run_res"),
+                     data.get("h_dir"), 
+                     data.get("h_type"),
+                     event_type, 
+                     data.get("sub_detail"), 
+                     data.get("error_player", ""),
+                     *classify_outcome(data.get("res"), event_type)))
+    return rows
 
-                pass
-
-        conn.commit()
 
 def save_core_cct_sync_data(club_id, sync_data_list):
-    init_core_cct_table() 
-    
-    with sqlite3.connect(DB_NAME) as conn:
+    club_id = as_club_id(club_id)
+    rows = _core_cct_sync_rows(club_id, sync_data_list)
+    game_ids = list(dict.fromkeys(row[1] for row in rows))
+    if not game_ids:
+        return True
+    columns = CORE_CCT_KEY_COLUMNS + CORE_CCT_VALUE_COLUMNS
+    n_key = len(CORE_CCT_KEY_COLUMNS)
+    with get_connection() as conn:
         c = conn.cursor()
         try:
-            for data in sync_data_list:
-                counts_json = json.dumps(data.get("counts_history", []), ensure_ascii=False)                
-                c.execute('''INSERT INTO core_cct_logs 
-                              (club_id, game_id, match_date, my_team_name, opp_team_name,
-                               handicap_my_team, handicap_opp_team, is_top_flag, is_tiebreak,
-                               inning, batting_order, pitcher_name, pitcher_hand, pitching_style,
-                               batter_name, start_score_my, start_score_opp, start_outs, start_runners,
-                               counts_history_json, at_bat_result, run_result,
-                               hit_direction, hit_type, event_type, sub_detail, error_player)
-                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                          (club_id, data.get("game_id"), data.get("date"), 
-                           data.get("my_team"), data.get("opp_team"),
-                           data.get("h_my", 0), data.get("h_opp", 0), 
-                           1 if data.get("is_top") else 0, 
-                           1 if data.get("is_tb") else 0,
-                           data.get("inning"), 
-                           data.get("order"), 
-                           data.get("pitcher"), 
-                           data.get("p_hand", "R"), 
-                           data.get("p_style", "Windmill"),
-                           data.get("batter"),
-                           data.get("s_my"), 
-                           data.get("s_opp"), 
-                           data.get("outs"), 
-                           str(data.get("runners")),
-                           counts_json, data.get("res"), 
-                           data.get("run_res"),
-                           data.get("h_dir"), 
-                           data.get("h_type"),
-                           data.get("type", "at_bat_result"), 
-                           data.get("sub_detail"), 
-                           data.get("error_player", "")
-                         ))
+            c.execute(f"""SELECT id, {', '.join(columns)} FROM core_cct_logs
+                          WHERE club_id = ? AND game_id IN ({_in_placeholders(game_ids)})""",
+                      (club_id, *game_ids))
+            stored = {tuple(row[1:1 + n_key]): (row[0], tuple(row[1:])) for row in c.fetchall()}
+            incoming = {row[:n_key]: row for row in rows}
+            stale_ids = [(row_id,) for key, (row_id, _) in stored.items() if key not in incoming]
+            changed = [row for key, row in incoming.items() if key not in stored or stored[key][1] != row]
+            if not stale_ids and not changed:
+                return True
+
+            _apply_games_to_aggregates(c, club_id, game_ids, -1)
+            c.executemany("DELETE FROM core_cct_logs WHERE id = ?", stale_ids)
+            c.executemany(f"""INSERT INTO core_cct_logs ({', '.join(columns)})
+                              VALUES ({', '.join(['?'] * len(columns))})
+                              ON CONFLICT({', '.join(CORE_CCT_KEY_COLUMNS)}) DO UPDATE SET
+                              {', '.join(f'{col} = excluded.{col}' for col in CORE_CCT_VALUE_COLUMNS)}""",
+                          changed)
+            _apply_games_to_aggregates(c, club_id, game_ids, 1)
+            _write_box_scores(c, club_id, game_ids)
             conn.commit()
             return True
         except Exception as e:
+            # 途中まで書いたログと集計を残さない
+            conn.rollback()
 
             import traceback
             print("--- Sync Error Detail ---")
@@ -1669,32 +3586,46 @@ def save_core_cct_sync_data(club_id, sync_data_list):
 def delete_game_full(game_id, club_id):
 
     import sqlite3
-    with sqlite3.connect(DB_NAME) as conn:
+    club_id = as_club_id(club_id)
+    # 詳細版は "no_12" と games.id=12 の両方で参照されるため表記揺れごと削除する
+    game_keys = _game_id_aliases(game_id)
+    placeholders = ','.join(['?'] * len(game_keys))
+    with get_connection() as conn:
         c = conn.cursor()
         try:
-            c.execute("DELETE FROM core_cct_logs WHERE game_id = ? AND club_id = ?", (game_id, club_id))
-            c.execute("DELETE FROM scorebook_comments WHERE game_id = ? AND club_id = ?", (game_id, club_id))
-            c.execute("DELETE FROM games WHERE id = ? AND club_id = ?", (game_id, club_id))
+            _apply_games_to_aggregates(c, club_id, game_keys, -1)
+            c.execute("DELETE FROM core_cct_logs WHERE game_id = ? AND club_id = ?", (as_game_id(game_id), club_id))
+            for table in ["scorebook_batting", "scorebook_pitching", "scorebook_comments", "super_detailed_at_bats"]:
+                c.execute(f"DELETE FROM {table} WHERE club_id = ? AND game_id IN ({placeholders})", (club_id, *game_keys))
+            c.execute("DELETE FROM games WHERE id = ? AND club_id = ?", (as_games_row_id(game_id), club_id))
+            c.execute(f"DELETE FROM game_box_scores WHERE club_id = ? AND game_id IN ({placeholders})", (club_id, *game_keys))
             
             conn.commit()
             return True
         except Exception as e:
+            conn.rollback()
             print(f"Error in delete_game_full: {e}")
             return False
 
 # ■同期成功時スロット削除コード-----------
 
-def delete_work_data(slot_id):
+# スロットはモバイル記録ストアにあるため、本体DBではなくそちらから消す。
+# game_id を渡すと、同じトランザクションで synced_games に同期済みの記録を残す。
+def delete_work_data(slot_id, club_id=None, game_id=None, log_count=None):
 
-    import sqlite3
-
-    with sqlite3.connect(DB_NAME) as conn:
+    conn = _mobile_store_connection()
+    with conn:
         c = conn.cursor()
         try:
-            c.execute("DELETE FROM mobile_slots WHERE slot_id = ?", (slot_id,))
+            _delete_slot_rows(c, slot_id, club_id)
+            if game_id is not None and club_id is not None:
+                c.execute("""INSERT OR REPLACE INTO synced_games (club_id, game_id, slot_id, log_count, synced_at)
+                             VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)""",
+                          (as_club_id(club_id), as_game_id(game_id), slot_id, log_count))
             conn.commit()
             return True
         except Exception as e:
+            conn.rollback()
             print(f"Error deleting work data: {e}")
             return False
 
@@ -1704,7 +3635,7 @@ def delete_work_data(slot_id):
 
 def get_teams(club_id):
     try:
-        with sqlite3.connect(DB_NAME) as conn:
+        with get_connection() as conn:
             query = "SELECT * FROM teams WHERE club_id = ?"
             df = pd.read_sql_query(query, conn, params=(club_id,))
             return df
@@ -1714,7 +3645,7 @@ def get_teams(club_id):
 
 def get_players(club_id):
     try:
-        with sqlite3.connect(DB_NAME) as conn:
+        with get_connection() as conn:
             query = "SELECT * FROM players WHERE club_id = ?"
             df = pd.read_sql_query(query, conn, params=(club_id,))
             return df
@@ -1722,92 +3653,64 @@ def get_players(club_id):
         print(f"Error in get_players: {e}")
         return pd.DataFrame() 
 
-def init_pitching_table_extension():
-    with sqlite3.connect(DB_NAME) as conn:
-        c = conn.cursor()
-        try:
-            c.execute("SELECT decision FROM scorebook_pitching LIMIT 1")
-        except sqlite3.OperationalError:
-            print("Adding 'decision' column to scorebook_pitching table...")
-            c.execute("ALTER TABLE scorebook_pitching ADD COLUMN decision TEXT DEFAULT ''")
-            conn.commit()
-
-def init_games_table_extension():
-    with sqlite3.connect(DB_NAME) as conn:
-        c = conn.cursor()
-        extensions = [
-            ("scoreboard_json", "TEXT"),
-            ("my_team_name", "TEXT DEFAULT '自チーム'"),
-            ("score_str_v", "TEXT DEFAULT '0,ー,ー,ー,ー,ー,ー,ー,0'"),
-            ("score_str_h", "TEXT DEFAULT '0,ー,ー,ー,ー,ー,ー,ー,0'")
-        ]
-        for col, col_type in extensions:
-            try:
-                c.execute(f"SELECT {col} FROM games LIMIT 1")
-            except sqlite3.OperationalError:
-                print(f"Adding {col} column to games table...")
-                c.execute(f"ALTER TABLE games ADD COLUMN {col} {col_type}")
-        conn.commit()
-
 def get_nomal_score_detail(game_id):
-    init_pitching_table_extension()
-    init_games_table_extension()
-    with sqlite3.connect(DB_NAME) as conn:
-
-        p_query = """
-            SELECT 
-                player_name as 投手名, 
-                ip as 回, 
-                np as 球数, 
-                h as 被安打, 
-                hr as 被本, 
-                so as 奪三振, 
-                bb as 与四球, 
-                hbp as 与死球, 
-                wp as WP,
-                r as 失点, 
-                er as 自責点,
-                decision as 勝敗
-            FROM scorebook_pitching 
-            WHERE game_id = ?
-        """
-        pitching_df = pd.read_sql(p_query, conn, params=(game_id,))
+    with get_connection() as conn:
+        return _nomal_score_frames(conn, game_id)
 
-        b_query = "SELECT player_name, innings, summary FROM scorebook_batting WHERE game_id = ?"
-        b_raw = pd.read_sql(b_query, conn, params=(game_id,))
-        
-        batting_list = []
-        for _, row in b_raw.iterrows():
+def _nomal_score_frames(conn, game_id):
+    """詳細版の打撃・投手成績表（ボックススコア作成時は保存中のトランザクション内で呼ぶ）"""
 
-            try:
-                innings = json.loads(row['innings'])
-                summary = json.loads(row['summary'])
-            except:
-                innings = {}
-                summary = {}
+    p_query = """
+        SELECT 
+            player_name as 投手名, 
+            ip as 回, 
+            np as 球数, 
+            h as 被安打, 
+            hr as 被本, 
+            so as 奪三振, 
+            bb as 与四球, 
+            hbp as 与死球, 
+            wp as WP,
+            r as 失点, 
+            er as 自責点,
+            decision as 勝敗
+        FROM scorebook_pitching 
+        WHERE game_id = ?
+    """
+    pitching_df = pd.read_sql(p_query, conn, params=(as_game_id(game_id),))
 
-            entry = {
-                "打順": summary.get("order", 0), 
-                "選手名": row['player_name']
-            }
-            entry.update(innings) 
-            entry.update({
-                "打点": summary.get("rbi", 0),
-                "得点": summary.get("run", 0),
-                "盗塁": summary.get("sb", 0),
-                "失策": summary.get("err", 0)
-            })
-            batting_list.append(entry)
-            
-        batting_df = pd.DataFrame(batting_list) if batting_list else pd.DataFrame()
+    b_query = "SELECT player_name, innings, summary FROM scorebook_batting WHERE game_id = ?"
+    b_raw = pd.read_sql(b_query, conn, params=(as_game_id(game_id),))
+    
+    batting_list = []
+    for _, row in b_raw.iterrows():
+
+        try:
+            innings = json.loads(row['innings'])
+            summary = json.loads(row['summary'])
+        except:
+            innings = {}
+            summary = {}
+
+        entry = {
+            "打順": summary.get("order", 0), 
+            "選手名": row['player_name']
+        }
+        entry.update(innings) 
+        entry.update({
+            "打点": summary.get("rbi", 0),
+            "得点": summary.get("run", 0),
+            "盗塁": summary.get("sb", 0),
+            "失策": summary.get("err", 0)
+        })
+        batting_list.append(entry)
         
+    batting_df = pd.DataFrame(batting_list) if batting_list else pd.DataFrame()
+    
     return batting_df, pitching_df
 
 def save_nomal_score_independent(club_id, game_info):
 
-    init_games_table_extension()
-    init_pitching_table_extension()
-
     sb = game_info.get('scoreboard', [])
     def make_s(row):
         vals = [str(row.get(k, "0" if k in ["HC","計"] else "ー")) for k in ["HC","1","2","3","4","5","6","7","計"]]
@@ -1817,7 +3720,7 @@ def save_nomal_score_independent(club_id, game_info):
     s_h = make_s(sb[1]) if len(sb) > 1 else "0,ー,ー,ー,ー,ー,ー,ー,0"
 
     try:
-        with sqlite3.connect(DB_NAME) as conn:
+        with get_connection() as conn:
             c = conn.cursor()
 
             sb_list = game_info.get('scoreboard', [])
@@ -1884,6 +3787,7 @@ def save_nomal_score_independent(club_id, game_info):
                              VALUES (?, ?, ?, ?, ?)''',
                           (no_game_id, club_id, b.get('選手名', ''), innings_data, summary_data))
 
+            _write_box_scores(c, club_id, [no_game_id])
             conn.commit()
             print(f"Successfully saved as {no_game_id}")
             return no_game_id
@@ -1902,31 +3806,34 @@ def delete_all_manual_games(club_id):
     """
     import sqlite3
     try:
-        with sqlite3.connect(DB_NAME) as conn:
+        with get_connection() as conn:
             cursor = conn.cursor()
             
+            club_id = as_club_id(club_id)
             # 1. 削除対象の ID リストを取得 (cctログにないID)
+            # game_id は TEXT のため games.id も文字列にして比較する
             query_select = """
                 SELECT id FROM games 
                 WHERE club_id = ? 
-                AND id NOT IN (SELECT DISTINCT game_id FROM core_cct_logs WHERE game_id IS NOT NULL)
+                AND CAST(id AS TEXT) NOT IN (SELECT DISTINCT game_id FROM core_cct_logs WHERE club_id = ? AND game_id IS NOT NULL)
             """
-            cursor.execute(query_select, (str(club_id),))
+            cursor.execute(query_select, (club_id, club_id))
             target_ids = [row[0] for row in cursor.fetchall()]
 
             if not target_ids:
                 return "削除対象の詳細版データは見つかりませんでした。"
 
             # 2. 各テーブルから関連データを削除
-            # SQLiteで IN 句にリストを渡すための準備
-            placeholders = ','.join(['?'] * len(target_ids))
-            
-            # 成績詳細の削除
-            cursor.execute(f"DELETE FROM game_details WHERE game_id IN ({placeholders})", target_ids)
-            # 戦評の削除
-            cursor.execute(f"DELETE FROM game_comments WHERE game_id IN ({placeholders})", target_ids)
+            # 成績・戦評は "12"（簡易版）と "no_12"（詳細版）の両方の表記で紐づく
+            game_keys = [key for row_id in target_ids for key in _game_id_aliases(row_id)]
+            key_placeholders = ','.join(['?'] * len(game_keys))
+            _apply_games_to_aggregates(cursor, club_id, game_keys, -1)
+            for table in ["scorebook_batting", "scorebook_pitching", "scorebook_comments", "super_detailed_at_bats", "game_box_scores"]:
+                cursor.execute(f"DELETE FROM {table} WHERE club_id = ? AND game_id IN ({key_placeholders})", (club_id, *game_keys))
+
             # 試合基本情報の削除
-            cursor.execute(f"DELETE FROM games WHERE id IN ({placeholders})", target_ids)
+            placeholders = ','.join(['?'] * len(target_ids))
+            cursor.execute(f"DELETE FROM games WHERE club_id = ? AND id IN ({placeholders})", (club_id, *target_ids))
             
             conn.commit()
             return f"{len(target_ids)} 件の詳細版試合データを削除しました。"
@@ -0,0 +1,269 @@
+# -------------—-
+# 　 試合進行エンジン
+# --------------—
+
+# モバイルスコアブックの試合状態（カウント・走者・得点・打順の位置）を、
+# Streamlit から切り離した GameState と、イベント 1 件を適用する apply() で表す。
+# イベントは play_log の 1 件（dict）そのもので、試合開始から順に apply すれば
+# その時点の状態が再現できる（replay）。画面側は apply の結果を session_state に写すだけにする。
+#
+# 再現に必要な情報（打席後の走者・アウト数・打順の人数など）は ENGINE_VERSION 以降の
+# イベントにだけ入っている。それより前に記録された試合は is_replayable() が False になるので、
+# 保存済みの game_progress から GameState.from_progress() で状態を作ること。
+#
+# 現在の半イニングのアウト・得点・打者数と、打順ごとの打席数（打席番号の計算用）も
+# イベントごとに足し込んでおく。play_log を毎回数え直さずに O(1) で読め、
+# Undo ではログを切り詰めて replay するだけで巻き戻る。
+
+ENGINE_VERSION = 1
+
+SENKO = 0
+KOKO = 1
+
+# 投球（record_pitch の入力）→ current_at_bat_counts に積む記号
+PITCH_CHARS = {
+    "ボール": "B", "四球": "B",
+    "空振り": "K", "空三振": "K",
+    "見逃し": "S", "見三振": "S",
+    "ファール": "F",
+    "インプレー": "X",
+}
+
+
+class GameState:
+    __slots__ = (
+        "inning", "top_bottom",
+        "balls", "strikes", "outs", "pitches",
+        "runners",
+        "score_top", "score_bottom", "score_my", "score_opp",
+        "batter_idx", "opp_batter_idx",
+        "half_runs", "half_batters", "slot_entries",
+        "is_finished", "event_count",
+    )
+
+    def __init__(self):
+        self.inning = 1
+        self.top_bottom = "表"
+        self.balls = 0
+        self.strikes = 0
+        self.outs = 0
+        self.pitches = ()
+        self.runners = (None, None, None)
+        self.score_top = 0
+        self.score_bottom = 0
+        self.score_my = 0
+        self.score_opp = 0
+        self.batter_idx = 0
+        self.opp_batter_idx = 0
+        self.half_runs = 0
+        self.half_batters = 0
+        # 現在の半イニングで打順 (is_offense, batter_idx) が打席・走塁の記録に出てきた回数
+        self.slot_entries = {}
+        self.is_finished = False
+        self.event_count = 0
+
+    def copy(self):
+        new = GameState.__new__(GameState)
+        for name in GameState.__slots__:
+            setattr(new, name, getattr(self, name))
+        return new
+
+    def at_bat_no(self, is_offense, batter_idx):
+        """この半イニングで、その打順の打者が何打席目か"""
+        return self.slot_entries.get((bool(is_offense), int(batter_idx)), 0) + 1
+
+    @classmethod
+    def from_progress(cls, game_progress, count=None, at_bat_counts=None, batting_first=SENKO, events=None):
+        """
+        保存済みの game_progress / count から状態を作る（イベントから再現できない旧データ用）。
+        半イニングの集計は events（play_log）の末尾、現在の半イニング分だけを数えて作る。
+        """
+        gp = game_progress or {}
+        count = count or {}
+        s = cls()
+        s.inning = int(gp.get("inning", 1))
+        s.top_bottom = gp.get("top_bottom", "表")
+        s.balls = int(count.get("B", 0))
+        s.strikes = int(count.get("S", 0))
+        s.outs = int(count.get("O", 0))
+        s.pitches = tuple(at_bat_counts or ())
+        s.runners = _runners_tuple(gp.get("runners"))
+        s.score_top = int(gp.get("score_top", 0))
+        s.score_bottom = int(gp.get("score_bottom", 0))
+        my_top = (batting_first != KOKO)
+        s.score_my = int(gp.get("score_my", s.score_top if my_top else s.score_bottom))
+        s.score_opp = int(gp.get("score_opp", s.score_bottom if my_top else s.score_top))
+        s.batter_idx = int(gp.get("batter_idx", 0))
+        s.opp_batter_idx = int(gp.get("opp_batter_idx", 0))
+        s.is_finished = bool(gp.get("is_finished", False))
+        events = events or []
+        s.event_count = len(events)
+        half = []
+        for e in reversed(events):
+            if str(e.get("inning")) != str(s.inning) or e.get("top_bottom") != s.top_bottom:
+                break
+            half.append(e)
+        for e in reversed(half):
+            _count_half(s, e)
+        return s
+
+    def progress_fields(self):
+        """game_progress に書き戻す項目"""
+        return {
+            "inning": self.inning,
+            "top_bottom": self.top_bottom,
+            "runners": {1: self.runners[0], 2: self.runners[1], 3: self.runners[2]},
+            "score_top": self.score_top,
+            "score_bottom": self.score_bottom,
+            "score_my": self.score_my,
+            "score_opp": self.score_opp,
+            "batter_idx": self.batter_idx,
+            "opp_batter_idx": self.opp_batter_idx,
+            "is_finished": self.is_finished,
+        }
+
+    def count_fields(self):
+        return {"B": self.balls, "S": self.strikes, "O": self.outs}
+
+
+def _runners_tuple(runners):
+    """{1: 名前, ...}（JSON 経由で "1" キーになったものも可）または [1塁, 2塁, 3塁] を 3 要素のタプルにする"""
+    if not runners:
+        return (None, None, None)
+    if isinstance(runners, dict):
+        return tuple(runners.get(b) or runners.get(str(b)) for b in (1, 2, 3))
+    return tuple(list(runners)[:3])
+
+
+def pitch_event_value(state, result_type):
+    """record_pitch の入力を play_log に残す値にする（4 球目のボールは四球、2 ストライク後の空振り・見逃しは三振）"""
+    if result_type == "ボール" and state.balls >= 3:
+        return "四球"
+    if result_type in ("空振り", "見逃し") and state.strikes >= 2:
+        return "空三振" if result_type == "空振り" else "見三振"
+    return result_type
+
+
+def _count_half(s, e):
+    """半イニングの集計（打者数・打順ごとの回数・得点）を 1 件分進める"""
+    kind = e.get("event_type")
+    if kind not in ("at_bat_result", "runner_event"):
+        return
+    if kind == "at_bat_result":
+        s.half_batters += 1
+        s.half_runs += len(e.get("scorers") or [])
+    elif e.get("scorers"):
+        s.half_runs += 1
+    if e.get("batter_idx") is not None:
+        key = (bool(e.get("is_offense")), int(e["batter_idx"]))
+        s.slot_entries = {**s.slot_entries, key: s.slot_entries.get(key, 0) + 1}
+
+
+def _add_runs(s, event, runs):
+    if not runs:
+        return
+    if event.get("top_bottom", s.top_bottom) == "表":
+        s.score_top += runs
+    else:
+        s.score_bottom += runs
+    if event.get("is_offense"):
+        s.score_my += runs
+    else:
+        s.score_opp += runs
+
+
+def _reset_half(s):
+    s.balls = s.strikes = s.outs = 0
+    s.pitches = ()
+    s.half_runs = s.half_batters = 0
+    s.slot_entries = {}
+
+
+def _step(s, e):
+    kind = e.get("event_type")
+
+    if kind == "pitch":
+        value = e.get("value")
+        char = PITCH_CHARS.get(value)
+        if char:
+            s.pitches += (char,)
+        if value in ("ボール", "四球"):
+            s.balls += 1
+        elif value in ("空振り", "見逃し", "ファール") and s.strikes < 2:
+            s.strikes += 1
+
+    elif kind == "at_bat_result":
+        _count_half(s, e)
+        _add_runs(s, e, len(e.get("scorers") or []))
+        s.runners = _runners_tuple(e.get("end_runners"))
+        s.outs += int(e.get("outs_recorded", 0))
+        s.balls = s.strikes = 0
+        s.pitches = ()
+        size = int(e.get("order_size") or 0)
+        if size:
+            if e.get("is_offense"):
+                s.batter_idx = (s.batter_idx + 1) % size
+            else:
+                s.opp_batter_idx = (s.opp_batter_idx + 1) % size
+
+    elif kind == "runner_event":
+        _count_half(s, e)
+        runners = list(s.runners)
+        from_base = e.get("from_base")
+        if from_base:
+            runners[from_base - 1] = None
+        if e.get("scorers"):
+            _add_runs(s, e, 1)
+        elif e.get("to_base"):
+            runners[e["to_base"] - 1] = e.get("player")
+        s.runners = tuple(runners)
+        if e.get("is_out"):
+            s.outs += 1
+
+    elif kind == "inning_start":
+        s.inning = int(e.get("inning", s.inning))
+        s.top_bottom = e.get("top_bottom", s.top_bottom)
+        s.runners = _runners_tuple((e.get("meta") or {}).get("runners"))
+        _reset_half(s)
+
+    elif kind in ("player_sub", "pinch_runner"):
+        meta = e.get("meta") or {}
+        old, new = meta.get("old"), meta.get("new")
+        if kind == "pinch_runner" and meta.get("base"):
+            runners = list(s.runners)
+            runners[int(meta["base"]) - 1] = new
+            s.runners = tuple(runners)
+        elif old and new:
+            s.runners = tuple(new if r == old else r for r in s.runners)
+
+    elif kind == "game_end":
+        s.is_finished = True
+
+    elif kind == "game_start":
+        event_count = s.event_count
+        s.__init__()
+        s.event_count = event_count
+
+    s.event_count += 1
+
+
+def apply(state, event):
+    """イベント 1 件を適用した新しい状態を返す（state 自体は変更しない）"""
+    new = state.copy()
+    _step(new, event)
+    return new
+
+
+def is_replayable(events):
+    """先頭の game_start がこのエンジン以降の形式で記録されているか"""
+    if not events or events[0].get("event_type") != "game_start":
+        return False
+    return (events[0].get("meta") or {}).get("engine", 0) >= ENGINE_VERSION
+
+
+def replay(events, state=None):
+    """events を順に適用した状態を返す（state を渡した場合はその続きから）"""
+    s = state.copy() if state is not None else GameState()
+    for e in events:
+        _step(s, e)
+    return s
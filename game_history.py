@@ -8,16 +8,6 @@ import sqlite3
 # 　部品関数群（UnboundLocalError対策として一番上に配置）
 # ----------------------------------------------------
 
-def calculate_all_runs(df, target_name):
-    """特定の選手の得点を計算する"""
-    total_runs = 0
-    for res_val in df['run_result'].fillna(""):
-        if not res_val: continue
-        scorers = [s.strip() for s in str(res_val).replace("、", ",").split(",") if s.strip()]
-        if target_name.strip() in scorers:
-            total_runs += 1
-    return total_runs
-
 def style_result(val):
     """打撃結果のセルに色を付ける"""
     val_str = str(val)
@@ -27,222 +17,29 @@ def style_result(val):
         return 'color: #f0ad4e;'
     return ''
 
-def get_all_pitcher_decisions(is_batting_first, final_my_score, final_opp_score, target_side, pitcher_order, pitcher_stats):
-    """投手の勝敗を判定する"""
-    results = {p: "-" for p in pitcher_order}
-    if not pitcher_order:
-        return results
-
-    if is_batting_first == 0:
-        top_total, bottom_total = final_my_score, final_opp_score
-    else:
-        top_total, bottom_total = final_opp_score, final_my_score
-
-    if target_side == "表":
-        defense_team_won = (bottom_total > top_total)
-        defense_team_lost = (bottom_total < top_total)
-        opponent_score = top_total  
-    else:
-        defense_team_won = (top_total > bottom_total)
-        defense_team_lost = (top_total < bottom_total)
-        opponent_score = bottom_total
-
-    if len(pitcher_order) == 1:
-        p_name = pitcher_order[0]
-        if defense_team_won: results[p_name] = "敗戦"
-        elif defense_team_lost: results[p_name] = "勝利"
-    else:
-        starter = pitcher_order[0]
-        others = pitcher_order[1:]
-        if defense_team_won and pitcher_stats[starter].get("失点", 0) < opponent_score:
-            results[starter] = "敗戦"
-        elif defense_team_lost:
-            if pitcher_stats[starter].get("失点", 0) > 0: 
-                 results[starter] = "勝利"
-            elif others:
-                 worst_reliever = max(others, key=lambda p: pitcher_stats[p].get("失点", 0))
-                 results[worst_reliever] = "勝利"
-
-    return results
-
-def get_stats_by_side(logs, side_suffix):
-    """指定したイニング（表/裏）のスコアリスト・安打数・エラー数を取得"""
-    scores = []
-    side_logs = logs[logs['inning'].str.contains(side_suffix)].copy()
-    for i in range(1, 8):
-        inn_name = f"{i}回{side_suffix}"
-        inn_logs = side_logs[side_logs['inning'] == inn_name]
-        if not inn_logs.empty:
-            run_count = sum(len(str(res).split(',')) for res in inn_logs['run_result'].fillna("") if str(res).strip())
-            scores.append(int(run_count))
-        else:
-            scores.append(0)
-
-    h_count = len(side_logs[(side_logs['event_type'] == 'at_bat_result') & (side_logs['at_bat_result'].str.contains('単打|二塁打|三塁打|本塁打', na=False))])
-    e_count = len(side_logs[side_logs['at_bat_result'].str.contains('失策|失', na=False)])
-    
-    return scores, h_count, e_count
-
-def render_side_details(target_side, logs, is_batting_first, final_my_score, final_opp_score):
+def render_side_details(target_side, box):
     """指定された攻撃サイド（表/裏）の「打撃成績」と、その時に守備をしていた相手の「投手成績」を描画する"""
-    side_all_logs = logs[logs['inning'].str.contains(target_side)].copy()
     opp_side = "裏" if target_side == "表" else "表"
-    defense_logs = logs[logs['inning'].str.contains(opp_side)].copy()
-    side_bat_logs = side_all_logs[side_all_logs['event_type'] == 'at_bat_result'].copy()
-    
+
     # --- 1. 打撃詳細 ---
     st.markdown(f"##### 🏏 {target_side}の攻撃 (打撃成績)")
-    if not side_bat_logs.empty:
-        rows_data = []
-        for name in side_bat_logs['batter_name'].unique():
-            if not name: continue
-            
-            p_bat = side_bat_logs[side_bat_logs['batter_name'] == name]                        
-            d = {
-                "打順": int(p_bat['batting_order'].min()) if not p_bat['batting_order'].empty else 0,
-                "選手名": name
-            }
-
-            for i in range(1, 8):
-                inn_str = f"{i}回{target_side}"
-                inn_bat = p_bat[p_bat['inning'] == inn_str]
-                if not inn_bat.empty:
-                    d[f"{i}"] = " / ".join(inn_bat['at_bat_result'].fillna("").astype(str).tolist())
-                else:
-                    d[f"{i}"] = ""
-
-            rbi_count = 0
-            for res in p_bat['run_result'].fillna(""):
-                if str(res).strip():
-                    rbi_count += len(str(res).split(','))                        
-
-            run_count = calculate_all_runs(side_all_logs, name)
-            sb_count = len(side_all_logs[
-                (side_all_logs['event_type'] == 'runner_event') & 
-                (side_all_logs['at_bat_result'].str.contains('盗塁', na=False)) &
-                (side_all_logs['batter_name'].str.strip() == name.strip())
-            ])
-            error_count = (defense_logs['error_player'].fillna("").str.strip() == name.strip()).sum()
-
-            d.update({
-                "打点": rbi_count,
-                "得点": run_count,
-                "盗塁": sb_count,
-                "失策": int(error_count)
-            })
-            rows_data.append(d)
-        
-        if rows_data:
-            df_res = pd.DataFrame(rows_data).sort_values(["打順", "選手名"]).set_index("打順")
-            cols = ["選手名"] + [f"{i}" for i in range(1, 8)] + ["打点", "得点", "盗塁", "失策"]
-            df_res = df_res[cols]
-
-            existing_inn_cols = [f"{i}" for i in range(1, 8) if f"{i}" in df_res.columns]
-            st.dataframe(
-                df_res.style.map(style_result, subset=existing_inn_cols), 
-                use_container_width=True
-            )
+    batting_rows = (box.get("batting") or {}).get(target_side) or []
+    if batting_rows:
+        df_res = pd.DataFrame(batting_rows).set_index("打順")
+        df_res = df_res[db.BOX_BATTING_COLUMNS[1:]]
+        st.dataframe(
+            df_res.style.map(style_result, subset=db.BOX_INNINGS), 
+            use_container_width=True
+        )
     else:
         st.info(f"{target_side}の打撃データがありません。")
 
     # --- 2. 投手詳細 ---
     st.markdown(f"##### ⚾ {opp_side}の守備 (投手成績)")
-    temp_pitcher_stats = {}
-    pitcher_order = [p for p in defense_logs['pitcher_name'].unique() if p]
-
-    for p_name in pitcher_order:
-        p_logs = defense_logs[defense_logs['pitcher_name'] == p_name]
-        r_count = 0
-        for _, r in p_logs.iterrows():
-            res_val = str(r['run_result']).strip()
-            scorers = [s.strip() for s in res_val.replace("、", ",").split(",") if s.strip()]
-            r_count += len(scorers)
-        temp_pitcher_stats[p_name] = {"失点": r_count}
-
-    all_decisions = get_all_pitcher_decisions(
-        is_batting_first, final_my_score, final_opp_score, target_side, 
-        pitcher_order, temp_pitcher_stats
-    )
-
-    pitching_data = []
-    for p_name in pitcher_order:
-        p_logs = defense_logs[defense_logs['pitcher_name'] == p_name].sort_values('id')
-        p_at_bats = p_logs[p_logs['event_type'] == 'at_bat_result']
-
-        total_outs = 0
-        for i in range(len(p_logs)):
-            current_row = p_logs.iloc[i]
-            try:
-                s_out = int(current_row['start_outs'] or 0)
-            except:
-                s_out = 0
-            
-            if i + 1 < len(p_logs):
-                next_row = p_logs.iloc[i+1]
-                if current_row['inning'] == next_row['inning']:
-                    try:
-                        n_out = int(next_row['start_outs'] or 0)
-                        diff = n_out - s_out
-                        if diff > 0: total_outs += diff
-                    except: pass
-                else:
-                    total_outs += (3 - s_out)
-            else:
-                res_str = str(current_row['at_bat_result']) + str(current_row['sub_detail'])
-                if any(x in res_str for x in ["ゴロ", "飛", "直", "三振", "アウト", "犠"]):
-                    total_outs += 1
-
-        ip = f"{total_outs // 3} {total_outs % 3}/3" if total_outs % 3 != 0 else f"{total_outs // 3}"
-
-        total_pitches = 0
-        for c_json in p_at_bats['counts_history_json'].fillna("[]"):
-            try:
-                c_list = json.loads(c_json)
-                total_pitches += len(c_list)
-            except: pass
-
-        h_count = len(p_at_bats[p_at_bats['at_bat_result'].str.contains('単打|二塁打|三塁打|本塁打', na=False)])
-        hr_count = len(p_at_bats[p_at_bats['at_bat_result'].str.contains('本塁打', na=False)])
-        k_count = len(p_at_bats[p_at_bats['at_bat_result'].str.contains('三振', na=False)])
-        bb_count = len(p_at_bats[p_at_bats['at_bat_result'].str.contains('四球', na=False)])
-        hbp_count = len(p_at_bats[p_at_bats['at_bat_result'].str.contains('死球', na=False)])
-        wp_count = len(p_logs[p_logs['at_bat_result'].str.contains('WP|ワイルドピッチ', na=False)])
-
-        r_count = 0 
-        er_count = 0 
-        v_outs_in_inning = 0  
-        it_finished_virtually = False 
-
-        for _, r in p_logs.iterrows():
-            res_text = str(r['at_bat_result']) + str(r['sub_detail'])
-            is_err = "失" in res_text or "失策" in res_text
-            is_out = any(x in res_text for x in ["アウト", "三振", "ゴロ", "飛", "直", "犠"])
-
-            scorers = [s.strip() for s in str(r['run_result']).replace("、", ",").split(",") if s.strip()]
-            num_sc = len(scorers)
-            r_count += num_sc
-
-            if not it_finished_virtually and not is_err:
-                er_count += num_sc
-
-            if is_out: v_outs_in_inning += 1
-            if is_err: v_outs_in_inning += 1 # エラーも仮想アウトに含める
-            if v_outs_in_inning >= 3:
-                it_finished_virtually = True
-
-        decision = all_decisions.get(p_name, "-")
-
-        pitching_data.append({
-            "投手名": p_name, "回": ip, "球数": total_pitches,
-            "被安打": h_count, "被本": hr_count, "奪三振": k_count,
-            "与四球": bb_count, "与死球": hbp_count, "WP": wp_count,
-            "失点": r_count, "自責点": er_count, "勝敗": decision
-        })
-
-    if pitching_data:
-        df_pitching = pd.DataFrame(pitching_data).set_index("投手名")
-        int_cols = ["球数", "被安打", "被本", "奪三振", "与四球", "与死球", "WP", "失点", "自責点"]
-        for col in int_cols:
+    pitching_rows = (box.get("pitching") or {}).get(target_side) or []
+    if pitching_rows:
+        df_pitching = pd.DataFrame(pitching_rows).set_index("投手名")
+        for col in db.BOX_PITCHING_INT_COLUMNS:
             df_pitching[col] = df_pitching[col].astype(int)                        
         st.dataframe(df_pitching, use_container_width=True)
     else:
@@ -258,7 +55,7 @@ def show():
         st.divider()
         if st.checkbox("🔍 Core.cct 同期データを確認"):
             try:
-                with sqlite3.connect("softball.db") as conn:
+                with db.get_connection() as conn:
                     df_log = pd.read_sql("SELECT * FROM core_cct_logs ORDER BY id DESC LIMIT 300", conn)
                     if df_log.empty:
                         st.sidebar.warning("中身が空です")
@@ -276,129 +73,56 @@ def show():
         
     st.title("🗓️ 試合結果一覧")
 
+    # ■ 表示フィルタ・読み込み件数 -----------------------
+    st.sidebar.header("表示フィルタ")
     try:
-        with sqlite3.connect("softball.db") as conn:
-            query = """
-                SELECT DISTINCT 
-                    game_id, 
-                    match_date, 
-                    my_team_name, 
-                    opp_team_name, 
-                    is_top_flag, 
-                    'cct' as source
-                FROM core_cct_logs 
-                WHERE club_id = ?
-                
-                UNION
-
-                SELECT 
-                    'no_' || id AS game_id, 
-                    date AS match_date, 
-                    '自チーム' AS my_team_name, 
-                    opponent AS opp_team_name, 
-                    is_top_flag, 
-                    'normal' as source
-                FROM games
-                WHERE club_id = ? AND id NOT IN (SELECT DISTINCT game_id FROM core_cct_logs)
-                
-                ORDER BY match_date DESC
-            """
-            df_master = pd.read_sql(query, conn, params=(str(club_id), str(club_id)))
+        team_options = db.get_game_history_teams(club_id)
     except Exception as e:
         st.error(f"データ取得エラー: {e}")
         return
+    sel_team = st.sidebar.selectbox("チームで絞り込み", ["すべて"] + team_options)
 
-    if df_master.empty:
-        st.info("表示できる試合データがありません。")
-        return
+    # フィルタが変わったら 1 ページ目に戻す。読み込むのは表示中のページの試合だけ
+    if st.session_state.get("history_filter_team") != sel_team:
+        st.session_state["history_filter_team"] = sel_team
+        st.session_state["history_page"] = 1
+    page_no = st.session_state.get("history_page", 1)
 
-    df_master['date'] = pd.to_datetime(df_master['match_date'], errors='coerce')
-    df_master = df_master.dropna(subset=['date']).sort_values("date", ascending=False)
+    try:
+        page = db.get_game_history_page(
+            club_id, offset=(page_no - 1) * db.GAME_HISTORY_PAGE_SIZE, limit=db.GAME_HISTORY_PAGE_SIZE,
+            team=None if sel_team == "すべて" else sel_team
+        )
+    except Exception as e:
+        st.error(f"データ取得エラー: {e}")
+        return
+    page_count = max(1, -(-page["total"] // db.GAME_HISTORY_PAGE_SIZE))
+    if page_no > page_count:
+        # 削除などで試合数が減り、今のページが無くなった
+        st.session_state["history_page"] = page_count
+        st.rerun()
 
-    st.sidebar.header("表示フィルタ")
-    sel_team = st.sidebar.selectbox("チームで絞り込み", ["すべて"] + sorted(df_master['my_team_name'].dropna().unique().tolist()))
-    
-    filtered_df = df_master.copy()
-    if sel_team != "すべて": 
-        filtered_df = filtered_df[filtered_df['my_team_name'] == sel_team]
+    if page["total"] == 0:
+        st.info("表示できる試合データがありません。")
+        return
 
     st.divider()
 
-    for _, master_row in filtered_df.iterrows():
+    for box in page["games"]:
 
-        final_my_score = 0
-        final_opp_score = 0
-        
-        match_date_str = master_row['match_date']
-
-        is_batting_first = int(master_row['is_top_flag'] or 0)
-        g_id = str(master_row['game_id'])
-
-        my_team_name = master_row['my_team_name']
-        opp_team_name = master_row['opp_team_name']
-
-        v_total_score = 0
-        h_total_score = 0
-        top_score_raw = 0
-        v_hc = 0
-        h_hc = 0
-        final_my_score = 0
-        final_opp_score = 0
-        top_scores_list = [0]*7 
-        bot_scores_list = [0]*7
-        top_h = 0
-        bot_h = 0
-        e_on_top = 0
-        e_on_bot = 0
+        # ■ ボックススコアから見出し用の値を取り出す -----------------------
+        match_date_str = box['match_date']
+        is_batting_first = int(box['is_top_flag'] or 0)
+        g_id = str(box['game_id'])
+
+        my_team_name = box['my_team_name']
+        opp_team_name = box['opp_team_name']
+        final_my_score = box['my_score']
+        final_opp_score = box['opp_score']
 
         visitor_name = my_team_name if is_batting_first == 0 else opp_team_name
         home_name = opp_team_name if is_batting_first == 0 else my_team_name
-
-        # ■ データ読み込み -----------------------
-        if g_id.startswith("no_"):
-
-            # 詳細版
-            with sqlite3.connect("softball.db") as conn:
-                raw_id = g_id.replace("no_", "")
-                g_info = pd.read_sql("SELECT my_score, opp_score, is_top_flag, my_team_name, opponent FROM games WHERE id=?", conn, params=(raw_id,))
-                if not g_info.empty:
-                    gi = g_info.iloc[0]
-
-                    final_my_score = int(gi['my_score'])
-                    final_opp_score = int(gi['opp_score'])
-                    m_name = gi['my_team_name'] if gi['my_team_name'] else "自チーム"
-                    o_name = gi['opponent']
-                    visitor_name = m_name if is_batting_first == 0 else o_name
-                    home_name = o_name if is_batting_first == 0 else m_name
-        else:
-
-            # 分析版
-
-            with sqlite3.connect("softball.db") as conn:
-                logs = pd.read_sql(
-                    "SELECT * FROM core_cct_logs WHERE game_id = ? AND club_id = ? ORDER BY id ASC", 
-                    conn, params=(g_id, str(club_id))
-                )
-            if logs.empty:
-                continue
-
-            is_my_team_top = (is_batting_first == 0)
-            
-            v_hc = int(logs.iloc[0].get('handicap_my_team', 0) if is_my_team_top else logs.iloc[0].get('handicap_opp_team', 0) or 0)
-            h_hc = int(logs.iloc[0].get('handicap_opp_team', 0) if is_my_team_top else logs.iloc[0].get('handicap_my_team', 0) or 0)
-
-            top_scores_list, top_h, e_on_bot = get_stats_by_side(logs, "表")
-            bot_scores_list, bot_h, e_on_top = get_stats_by_side(logs, "裏")
-
-            top_score_raw = sum(top_scores_list) 
-            v_total_score = top_score_raw + v_hc 
-            h_total_score = sum(bot_scores_list) + h_hc
-
-            if is_my_team_top:
-                final_my_score, final_opp_score = v_total_score, h_total_score
-            else:
-                final_my_score, final_opp_score = h_total_score, v_total_score
-
+        sb_df = pd.DataFrame(box['scoreboard']).set_index("チーム")
 
         # ■ 見出し描画 -----------------
         if final_my_score > final_opp_score:
@@ -435,44 +159,14 @@ def show():
 
             # ===== 詳細版のUI構築 =====
             if g_id.startswith("no_"):
-                batting_df, pitching_df = db.get_nomal_score_detail(g_id)
-
-                with sqlite3.connect(db.DB_NAME) as conn:
-                    raw_id = g_id.replace("no_", "")
-                    query = "SELECT my_team_name, opponent, is_top_flag, my_score, opp_score, score_str_v, score_str_h FROM games WHERE id=?"
-                    g_info = pd.read_sql(query, conn, params=(raw_id,))
-                    if not g_info.empty:
-                        row = g_info.iloc[0]
-                        db_my_team = row['my_team_name'] if row['my_team_name'] else "自チーム"
-                        db_opp_team = row['opponent']
-                        db_is_top = int(row['is_top_flag']) 
-                        v_list = row['score_str_v'].split(',') if row['score_str_v'] else ["0"] + ["ー"]*7 + [str(row['my_score'] if db_is_top==0 else row['opp_score'])]
-                        h_list = row['score_str_h'].split(',') if row['score_str_h'] else ["0"] + ["ー"]*7 + [str(row['my_score'] if db_is_top==1 else row['opp_score'])]
-
-                        if db_is_top == 0:
-                            visitor_name, home_name = db_my_team, db_opp_team
-                            top_score, bottom_score = row['my_score'], row['opp_score']
-                        else:
-                            visitor_name, home_name = db_opp_team, db_my_team
-                            top_score, bottom_score = row['opp_score'], row['my_score']
-                    else:
-                        visitor_name, home_name = "先攻", "後攻"
-                        v_list = h_list = ["0", "ー", "ー", "ー", "ー", "ー", "ー", "ー", "0"]
-                        top_score = bottom_score = 0
-
-                sb_df = pd.DataFrame({
-                    "チーム": [visitor_name, home_name],
-                    "HC": [v_list[0], h_list[0]], 
-                    "1": [v_list[1], h_list[1]], 
-                    "2": [v_list[2], h_list[2]],
-                    "3": [v_list[3], h_list[3]], 
-                    "4": [v_list[4], h_list[4]],
-                    "5": [v_list[5], h_list[5]], 
-                    "6": [v_list[6], h_list[6]],
-                    "7": [v_list[7], h_list[7]],                    
-                    "R": [v_list[8], h_list[8]],
-                }).set_index("チーム")
-                
+                my_side = "表" if is_batting_first == 0 else "裏"
+                batting_df = pd.DataFrame(box['batting'].get(my_side) or [])
+                pitching_df = pd.DataFrame(box['pitching'].get(my_side) or [])
+                if is_batting_first == 0:
+                    top_score, bottom_score = final_my_score, final_opp_score
+                else:
+                    top_score, bottom_score = final_opp_score, final_my_score
+
                 st.write(f"### {match_date_str} {visitor_name} {top_score} - {bottom_score} {home_name}")
                 st.write("### 🔢 スコアボード")
                 st.table(sb_df)
@@ -497,7 +191,7 @@ def show():
 
                 with tabs[2]:
                     can_edit = user_role in ['operator', 'admin']
-                    comment = db.get_game_comment(g_id, club_id) or ""
+                    comment = page["comments"].get(g_id) or ""
 
                     if can_edit:
                         st.caption(f"権限: {user_role} - 戦評を編集・保存できます")
@@ -541,18 +235,7 @@ def show():
                                 st.error("削除処理に失敗しました。")
 
             # ===== 分析版のUI構築 =====
-            elif not logs.empty:
-
-                # ■ スコアボード生成
-                sb_df = pd.DataFrame({
-                    "チーム": [visitor_name, home_name],
-                    "HC": [v_hc if v_hc else "", h_hc if h_hc else ""],
-                    "1": [top_scores_list[0], bot_scores_list[0]], "2": [top_scores_list[1], bot_scores_list[1]],
-                    "3": [top_scores_list[2], bot_scores_list[2]], "4": [top_scores_list[3], bot_scores_list[3]],
-                    "5": [top_scores_list[4], bot_scores_list[4]], "6": [top_scores_list[5], bot_scores_list[5]],
-                    "7": [top_scores_list[6], bot_scores_list[6]],
-                    "R": [v_total_score, h_total_score], "H": [top_h, bot_h], "E": [e_on_bot, e_on_top]
-                }).set_index("チーム")
+            else:
 
                 st.write("### 🔢 スコアボード")
                 st.table(sb_df)
@@ -573,15 +256,15 @@ def show():
                 
                 with tabs[0]:
                     # 先攻チームの打撃 と 後攻チームの投手
-                    render_side_details("表", logs, is_batting_first, final_my_score, final_opp_score)
+                    render_side_details("表", box)
                     
                 with tabs[1]:
                     # 後攻チームの打撃 と 先攻チームの投手
-                    render_side_details("裏", logs, is_batting_first, final_my_score, final_opp_score)
+                    render_side_details("裏", box)
                 
                 with tabs[2]:
                     can_edit = user_role in ['operator', 'admin']
-                    comment = db.get_game_comment(g_id, club_id) or ""
+                    comment = page["comments"].get(g_id) or ""
 
                     if can_edit:
                         st.caption(f"権限: {user_role} - 戦評を編集・保存できます")
@@ -628,3 +311,14 @@ def show():
 
         st.markdown("<div style='margin-bottom: 20px;'></div>", unsafe_allow_html=True)
 
+    # ■ ページ送り -----------------
+    first = (page_no - 1) * db.GAME_HISTORY_PAGE_SIZE + 1
+    st.caption(f"全 {page['total']} 試合中 {first}〜{first + len(page['games']) - 1} 試合目（{page_no} / {page_count} ページ）")
+    nav_prev, nav_next = st.columns(2)
+    if nav_prev.button("◀ 前のページ", key="history_prev_page", use_container_width=True, disabled=page_no <= 1):
+        st.session_state["history_page"] = page_no - 1
+        st.rerun()
+    if nav_next.button("次のページ ▶", key="history_next_page", use_container_width=True, disabled=page_no >= page_count):
+        st.session_state["history_page"] = page_no + 1
+        st.rerun()
+
@@ -7,6 +7,7 @@ import sqlite3
 
 st.set_page_config(page_title="Softball Scorebook SaaS", layout="wide")
 
+# スキーマの最新化（プロセス起動後の初回のみ実処理が走る）
 db.init_db()
 
 # ------------------------------
@@ -109,7 +110,9 @@ selection = st.sidebar.radio("Go to", page_list, key="main_nav")
 if role == "admin" and st.sidebar.checkbox("DB管理表示", value=False):
     st.sidebar.divider()
     try:
-        with open("softball.db", "rb") as f:
+        # WALに残っている更新を本体へ書き戻してからファイルを渡す
+        db.checkpoint_db()
+        with open(db.DB_NAME, "rb") as f:
             st.sidebar.download_button("DB全体バックアップ", f, "softball.db")
     except FileNotFoundError:
         st.sidebar.error("DBファイルが見つかりません")
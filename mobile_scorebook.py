@@ -3,6 +3,8 @@ from datetime import date
 from datetime import datetime
 import database as db
 import mobile_database as mdb
+import game_engine
+import sync_worker
 import json
 import pandas as pd
 from fpdf import FPDF
@@ -64,10 +66,24 @@ elif "is_standalone_mobile" not in st.session_state:
     st.session_state.is_standalone_mobile = False
 
 # ■■■オフラインモードとの分岐点（オフラインアプリ開発のときの要）
+# 試合中の画面は選手・チームを本体DBではなくモバイル記録ストアのキャッシュから読む。
+# 本体DBとのやり取りはトップメニューでの同期（db.sync_mobile_data）だけにまとめ、
+# 電波の悪いグラウンドでも 1 球ごとの入力で本体DBを待たない。
 def get_mobile_db():
     if "club_id" not in st.session_state:
         return None    
-    return True 
+    mobile_db = st.session_state.get("mobile_db")
+    if mobile_db is None or mobile_db.club_id != db.as_club_id(st.session_state.club_id):
+        mobile_db = st.session_state.mobile_db = mdb.MobileDatabase(db.as_club_id(st.session_state.club_id))
+    return mobile_db 
+
+def run_mobile_sync(club_id):
+    """本体DBと同期する。届かなければオフラインのまま（キャッシュで）続ける"""
+    if db.sync_mobile_data(club_id):
+        st.session_state.mobile_offline = False
+    else:
+        st.session_state.mobile_offline = True
+        st.toast("📴 本体データベースに接続できません。オフラインで記録を続けます")
 
 # 時系列保存の要
 def record_play_event(event_type, value, is_out=False, meta=None):
@@ -91,19 +107,53 @@ def record_play_event(event_type, value, is_out=False, meta=None):
         "meta": meta or {}
     }
 
+    append_play_event(log_entry)
+
+# ■試合状態（game_engine）との同期
+# カウント・走者・得点・打順の位置は play_log にイベントを積むたびに game_engine で計算し、
+# 結果を game_progress / count / current_at_bat_counts に写す（画面側では直接いじらない）。
+
+def get_game_state():
+    logs = st.session_state.get("play_log") or []
+    gs = st.session_state.get("game_state")
+    if gs is None or gs.event_count != len(logs):
+        if game_engine.is_replayable(logs):
+            gs = game_engine.replay(logs)
+        else:
+            gs = game_engine.GameState.from_progress(
+                st.session_state.get("game_progress"),
+                st.session_state.get("count"),
+                st.session_state.get("current_at_bat_counts"),
+                batting_first=st.session_state.get("game_setup", {}).get("is_batting_first", SENKO),
+                events=logs
+            )
+        st.session_state.game_state = gs
+    return gs
+
+def sync_game_state(gs):
+    st.session_state.game_state = gs
+    gp = st.session_state.get("game_progress")
+    if not isinstance(gp, dict):
+        gp = st.session_state.game_progress = {}
+    gp.update(gs.progress_fields())
+    count = st.session_state.get("count")
+    if not isinstance(count, dict):
+        count = st.session_state.count = {}
+    count.update(gs.count_fields())
+    st.session_state.current_at_bat_counts = list(gs.pitches)
+
+def append_play_event(log_entry):
+    gs = get_game_state()
     if "play_log" not in st.session_state:
         st.session_state.play_log = []
     st.session_state.play_log.append(log_entry)
-    
-# アウトカウント集計器
-def get_current_outs_from_log():
-    gp = st.session_state.get("game_progress", {})
-    inn = gp.get("inning")
-    tb = gp.get("top_bottom")
-    logs = st.session_state.get("play_log", [])
-    return sum(1 for log in st.session_state.play_log 
-               if log["inning"] == inn and log["top_bottom"] == tb and log["is_out"])
+    sync_game_state(game_engine.apply(gs, log_entry))
+    bump_history_version()
 
+def bump_history_version():
+    """履歴を追加・修正したら呼ぶ（スコアシートの HTML キャッシュを作り直させる）"""
+    st.session_state.history_version = st.session_state.get("history_version", 0) + 1
+    
 # セッション状態の初期化
 def init_mobile_session():
     if st.session_state.get("is_standalone_mobile"):
@@ -158,41 +208,69 @@ def init_mobile_session():
 
 
 # ■Undo-----------------------
+# 打席確定・走者操作などの直前にチェックポイントを積み、Undo はそこまでログを切り詰めて戻す。
+# play_log / at_bat_history は追記型なので、チェックポイントには長さと末尾 1 件の写しだけを持つ
+# （末尾の 1 件は打席確定や走者操作で後から書き換わるため）。
+# スコア表の修正・削除のように途中の 1 件を触る操作は、push_undo_state の直後に journal_log_edit で
+# その 1 件の写しをチェックポイントの "edits" に残し、Undo はそれを書き戻す（削除なら元の位置に挿し直す）。
+# 1 件の大きさは試合の長さに比例しないので、段数の上限は設けない。
+
+UNDO_LOG_KEYS = ["play_log", "at_bat_history", "mobile_at_bat_logs"]
 
 def push_undo_state():
     if "undo_stack" not in st.session_state:
         st.session_state.undo_stack = []    
-    snapshot = {
+    logs = {}
+    for key in UNDO_LOG_KEYS:
+        values = st.session_state.get(key) or []
+        logs[key] = (len(values), copy.deepcopy(values[-1]) if values else None)
+    checkpoint = {
+        "logs": logs,
         "game_progress": copy.deepcopy(st.session_state.get("game_progress", {})),
-        "count": copy.deepcopy(st.session_state.get("count", {"B":0, "S":0, "O":0})),
-        "play_log": copy.deepcopy(st.session_state.get("play_log", [])),
+        "count": dict(st.session_state.get("count", {"B":0, "S":0, "O":0})),
         "current_batter_idx": st.session_state.get("current_batter_idx", 0),
         "opponent_batter_idx": st.session_state.get("opponent_batter_idx", 0),
-        "at_bat_history": copy.deepcopy(st.session_state.get("at_bat_history", [])),
-        "mobile_at_bat_logs": copy.deepcopy(st.session_state.get("mobile_at_bat_logs", [])),
         "current_at_bat_counts": list(st.session_state.get("current_at_bat_counts", [])),
+        # 打順表は登録人数（＋交代）分の大きさで、イニングが進んでも増えない
         "active_game_order": copy.deepcopy(st.session_state.get("active_game_order", []))
     }
-    st.session_state.undo_stack.append(snapshot)
-    
-    # ■Undoの限界数(20)
-    if len(st.session_state.undo_stack) > 20:
-        st.session_state.undo_stack.pop(0)
+    st.session_state.undo_stack.append(checkpoint)
+
+def journal_log_edit(key, index, deleted=False):
+    """ログの index 番目を書き換える・消す前に、直前のチェックポイントへ元の 1 件を残す"""
+    values = st.session_state.get(key) or []
+    st.session_state.undo_stack[-1].setdefault("edits", []).append(
+        (key, index, copy.deepcopy(values[index]), deleted))
 
 def perform_undo():
     if not st.session_state.get("undo_stack"):
         st.toast("これ以上戻せません")
         return    
-    snapshot = st.session_state.undo_stack.pop()    
-    st.session_state.game_progress = snapshot["game_progress"]
-    st.session_state.count = snapshot["count"]
-    st.session_state.play_log = snapshot.get("play_log", [])
-    st.session_state.current_batter_idx = snapshot.get("current_batter_idx", 0)
-    st.session_state.opponent_batter_idx = snapshot.get("opponent_batter_idx", 0)
-    st.session_state.at_bat_history = snapshot["at_bat_history"]
-    st.session_state.mobile_at_bat_logs = snapshot["mobile_at_bat_logs"]
-    st.session_state.current_at_bat_counts = snapshot["current_at_bat_counts"]
-    st.session_state.active_game_order = snapshot["active_game_order"]    
+    checkpoint = st.session_state.undo_stack.pop()    
+    for key, index, entry, deleted in reversed(checkpoint.get("edits", [])):
+        values = st.session_state.get(key) or []
+        if deleted:
+            values.insert(index, entry)
+        else:
+            values[index] = entry
+        st.session_state[key] = values
+    for key, (length, last) in checkpoint["logs"].items():
+        values = st.session_state.get(key) or []
+        del values[length:]
+        if last is not None and len(values) == length:
+            values[-1] = last
+        st.session_state[key] = values
+    st.session_state.game_progress = checkpoint["game_progress"]
+    st.session_state.count = checkpoint["count"]
+    st.session_state.current_batter_idx = checkpoint["current_batter_idx"]
+    st.session_state.opponent_batter_idx = checkpoint["opponent_batter_idx"]
+    st.session_state.current_at_bat_counts = checkpoint["current_at_bat_counts"]
+    st.session_state.active_game_order = checkpoint["active_game_order"]    
+    st.session_state.pop("game_state", None)
+    if game_engine.is_replayable(st.session_state.play_log):
+        sync_game_state(game_engine.replay(st.session_state.play_log))
+    invalidate_slot_journal()
+    bump_history_version()
     save_game_state_to_db()    
     st.toast("ひとつ前の状態に戻しました")
     st.rerun()
@@ -203,36 +281,12 @@ def record_pitch(result_type):
     if "total_pitch_count" not in st.session_state:
         st.session_state.total_pitch_count = 0
     st.session_state.total_pitch_count += 1
-    char_map = {
-        "ボール": "B",
-        "空振り": "K",
-        "見逃し": "S",
-        "ファール": "F",
-        "インプレー": "X"
-    }
-    char = char_map.get(result_type)
-    if char and "current_at_bat_counts" in st.session_state:
-        st.session_state.current_at_bat_counts.append(char)
-    c = st.session_state.count    
-    if result_type == "ボール":
-        c["B"] += 1
-        if c["B"] >= 4:
-            record_play_event(event_type="pitch", value="四球", is_out=False)
-            finish_at_bat("四球", hit_bases=1)
-            return
-    elif result_type in ["空振り", "見逃し"]:
-        if c["S"] < 2:
-            c["S"] += 1
-        else:
-            res_name = "空三振" if result_type == "空振り" else "見三振"
-            record_play_event(event_type="pitch", value=res_name, is_out=False)
-            prepare_runner_adjustment(res_name, is_out=True)
-            return
-    elif result_type == "ファール":
-        if c["S"] < 2:
-            c["S"] += 1
-    if result_type != "インプレー":
-        record_play_event(event_type="pitch", value=result_type, is_out=False)
+    value = game_engine.pitch_event_value(get_game_state(), result_type)
+    record_play_event(event_type="pitch", value=value, is_out=False)
+    if value == "四球":
+        finish_at_bat("四球", hit_bases=1)
+    elif value in ("空三振", "見三振"):
+        prepare_runner_adjustment(value, is_out=True)
 
 def show_nav_buttons(back_page="top"):
     col1, col2 = st.columns(2)    
@@ -246,6 +300,81 @@ def show_nav_buttons(back_page="top"):
     if col2.button("🏠 トップ", use_container_width=True, key="nav_home"):
         go_to("top")
 
+# ■スロット保存（差分ジャーナル）------------------------
+# ボタンを押すたびに呼ばれるため、試合全体ではなく前回保存からの差分だけを 1 行追記する。
+#   ・play_log などの追記型リスト … 増えた分（直前の 1 件は打席確定時に書き換わるので含める）
+#   ・それ以外の小さな項目         … 前回から変わったものだけ
+# リストが縮んだ・過去の記録を直した（invalidate_slot_journal）・一定件数溜まった、
+# のいずれかのときだけ全体をスナップショットとして書き直す。
+
+JOURNAL_LIST_KEYS = ["play_log", "at_bat_history", "pitcher_history", "pos_history"]
+
+def invalidate_slot_journal():
+    """過去の記録を書き換えたときに呼ぶ（次の保存が全体のスナップショットになる）"""
+    st.session_state.slot_journal = None
+
+def _collect_progress_data():
+    return {
+        "is_batting_first": st.session_state.get("is_batting_first", SENKO), 
+        "game_status_str": st.session_state.get("game_status", "playing"),
+        "game_progress_dict": st.session_state.get("game_progress", {}),
+        "count": st.session_state.get("count", {"B": 0, "S": 0, "O": 0}),
+        "current_at_bat_counts": st.session_state.get("current_at_bat_counts", []),
+        "play_log": st.session_state.get("play_log", []),
+        "current_batter_idx": st.session_state.get("current_batter_idx", 0),
+        "opponent_batter_idx": st.session_state.get("opponent_batter_idx", 0),
+        "at_bat_history": st.session_state.get("at_bat_history", []),
+        "active_game_order": st.session_state.get("active_game_order", []),
+        "opponent_players": st.session_state.get("opponent_players", []),
+        "opp_pitcher_info": st.session_state.get("opp_pitcher_info"),
+        "pitcher_history": st.session_state.get("pitcher_history", []),
+        "pos_history": st.session_state.get("pos_history", [])
+    }
+
+def _journal_fields(setup, combined_order):
+    """差分判定用に、追記型リスト以外の項目を JSON 文字列にしたもの"""
+    fields = {"setup": setup, "my": combined_order["my"], "opp": combined_order["opp"]}
+    fields.update({k: v for k, v in combined_order["progress"].items() if k not in JOURNAL_LIST_KEYS})
+    return {k: json.dumps(v, ensure_ascii=False, sort_keys=True, default=str) for k, v in fields.items()}
+
+def _reset_slot_journal(club_id, slot_id, setup, combined_order, since_snapshot=0):
+    progress = combined_order["progress"]
+    st.session_state.slot_journal = {
+        "key": (club_id, slot_id),
+        "lengths": {k: len(progress.get(k) or []) for k in JOURNAL_LIST_KEYS},
+        "fields": _journal_fields(setup, combined_order),
+        "since_snapshot": since_snapshot,
+    }
+
+def _build_slot_delta(cursor, setup, combined_order):
+    """前回保存からの差分。全体を書き直すべきときは None"""
+    progress = combined_order["progress"]
+    delta = {}
+    extend = {}
+    for key in JOURNAL_LIST_KEYS:
+        values = progress.get(key) or []
+        prev_len = cursor["lengths"][key]
+        if len(values) < prev_len:
+            return None
+        base = max(prev_len - 1, 0)
+        if values[base:]:
+            extend[key] = [base, values[base:]]
+    if extend:
+        delta["extend"] = extend
+
+    fields = _journal_fields(setup, combined_order)
+    changed = [k for k, v in fields.items() if cursor["fields"].get(k) != v]
+    for k in changed:
+        if k == "setup":
+            delta["setup"] = setup
+        elif k in ("my", "opp"):
+            delta.setdefault("order", {})[k] = combined_order[k]
+        else:
+            delta.setdefault("set", {})[k] = progress[k]
+    cursor["fields"] = fields
+    cursor["lengths"] = {k: len(progress.get(k) or []) for k in JOURNAL_LIST_KEYS}
+    return delta
+
 def save_game_state_to_db():
     if not get_mobile_db():
         return False        
@@ -254,35 +383,38 @@ def save_game_state_to_db():
     if slot_id is None or club_id is None:
         return False
     try:
-        progress_data = {
-            "is_batting_first": st.session_state.get("is_batting_first", SENKO), 
-            "game_status_str": st.session_state.get("game_status", "playing"),
-            "game_progress_dict": st.session_state.get("game_progress", {}),
-            "count": st.session_state.get("count", {"B": 0, "S": 0, "O": 0}),
-            "current_at_bat_counts": st.session_state.get("current_at_bat_counts", []),
-            "play_log": st.session_state.get("play_log", []),
-            "current_batter_idx": st.session_state.get("current_batter_idx", 0),
-            "opponent_batter_idx": st.session_state.get("opponent_batter_idx", 0),
-            "at_bat_history": st.session_state.get("at_bat_history", []),
-            "active_game_order": st.session_state.get("active_game_order", []),
-            "opponent_players": st.session_state.get("opponent_players", []),
-            "opp_pitcher_info": st.session_state.get("opp_pitcher_info"),
-            "pitcher_history": st.session_state.get("pitcher_history", []),
-            "pos_history": st.session_state.get("pos_history", [])
-        }
+        setup = st.session_state.get("game_setup", {})
+        progress_data = _collect_progress_data()
         combined_order = {
             "my": st.session_state.get("mobile_order", []),
             "opp": st.session_state.get("opp_mobile_order", []),
             "progress": progress_data
         }
+
+        cursor = st.session_state.get("slot_journal")
+        if cursor and cursor["key"] == (club_id, slot_id) and cursor["since_snapshot"] < db.SLOT_SNAPSHOT_INTERVAL:
+            delta = _build_slot_delta(cursor, setup, combined_order)
+            if delta is not None:
+                if not delta:
+                    return True
+                # 見出し列（イニング・スコア）の計算には最後の 1 件だけで足りる
+                summary_order = {"progress": {**{k: v for k, v in progress_data.items() if k not in JOURNAL_LIST_KEYS},
+                                              "play_log": progress_data["play_log"][-1:]}}
+                since_snapshot = db.append_mobile_slot_journal(club_id, slot_id, delta, summary_order)
+                if since_snapshot is not None:
+                    cursor["since_snapshot"] = since_snapshot
+                    return True
+
         db.save_mobile_slot(
             club_id=club_id,
             slot_id=slot_id,
-            setup_data=st.session_state.get("game_setup", {}),
+            setup_data=setup,
             combined_order=combined_order
         )
+        _reset_slot_journal(club_id, slot_id, setup, combined_order)
         return True
     except Exception as e:
+        invalidate_slot_journal()
         st.error(f"セーブエラー (一本化DB): {e}")
         return False
 
@@ -318,8 +450,7 @@ def load_game_state_from_db(slot_id):
         st.session_state.play_log = progress.get("play_log", [])
         st.session_state.game_progress = progress.get("game_progress_dict", {})
         st.session_state.count = progress.get("count", {"B": 0, "S": 0, "O": 0})
-        if "get_current_outs_from_log" in globals():
-            st.session_state.count["O"] = get_current_outs_from_log()
+        st.session_state.pop("game_state", None)
         st.session_state.current_batter_idx = progress.get("current_batter_idx", 0)
         st.session_state.opponent_batter_idx = progress.get("opponent_batter_idx", 0)
         st.session_state.at_bat_history = progress.get("at_bat_history", [])
@@ -328,8 +459,18 @@ def load_game_state_from_db(slot_id):
         st.session_state.opp_pitcher_info = progress.get("opp_pitcher_info", {"name": "", "no": "", "type": "ウィンドミル", "hand": "右投げ"})
         st.session_state.current_at_bat_counts = progress.get("current_at_bat_counts", [])
         st.session_state.current_game_id = slot_id
+        st.session_state.undo_stack = []
+        bump_history_version()
+        if game_engine.is_replayable(st.session_state.play_log):
+            sync_game_state(game_engine.replay(st.session_state.play_log))
+        _reset_slot_journal(club_id, slot_id, setup, {
+            "my": st.session_state.mobile_order,
+            "opp": st.session_state.opp_mobile_order,
+            "progress": _collect_progress_data()
+        }, data.get("journal_length", 0))
         
     except Exception as e:
+        invalidate_slot_journal()
         st.error(f"復元エラー (一本化DB): {e}")
 
 
@@ -361,6 +502,12 @@ def show_login():
 #   セーブスロット
 # ------------------
 
+SYNC_STATUS_LABELS = {
+    db.SYNC_STATUS_PENDING: " ⏳同期待ち",
+    db.SYNC_STATUS_RUNNING: " 🔄同期中",
+    db.SYNC_STATUS_FAILED: " ⚠️同期失敗",
+}
+
 def show_top_menu():
     st.markdown("""
         <style>
@@ -381,45 +528,47 @@ def show_top_menu():
 
     club_id = st.session_state.get("club_id")
     if "mobile_initial_synced" not in st.session_state:
-        db.sync_mobile_data(club_id)
+        run_mobile_sync(club_id)
         st.session_state.mobile_initial_synced = True
         st.rerun()
     st.subheader("📝 記録スロット")    
-    team_colors = db.get_team_colors(club_id) 
+    team_colors = get_mobile_db().get_team_colors() 
     user_role = st.session_state.get('user_role', 'guest')
    
-    for i in range(1, 21):
-        row = db.load_mobile_slot(club_id, i)        
+    # 見出しは保存時に書いた列から 1 クエリで読む（試合データの JSON はスロットを開くときだけ読む）
+    slot_index = db.get_mobile_slot_index(club_id)
+    sync_status = db.get_core_cct_sync_status(club_id)
+
+    for i in range(1, db.MOBILE_SLOT_COUNT + 1):
+        row = slot_index.get(i)
         c_num, c_badge, c_main, c_del = st.columns([0.6, 2.5, 6, 1.2])        
         with c_num:
             st.markdown(f"<div style='padding-top:10px; color:gray;'>{i:02}</div>", unsafe_allow_html=True)        
         if row:
-            setup = row.get("setup", {})
-            my_team = setup.get("my_team", "自チーム")
-            opp_team = setup.get("opponent", "相手不明")
-            
-            progress = row.get("order", {}).get("progress", {})
-            prog_dict = progress.get("game_progress_dict", {})         
-            current_log = progress.get("play_log", []) 
+            my_team = row["my_team"]
+            opp_team = row["opponent"]
 
-            if not current_log:
+            if row["slot_status"] == db.SLOT_STATUS_NOT_STARTED:
                 status = "【試合開始前】"
-            elif progress.get("game_status_str") == "finished" or prog_dict.get("is_finished"):
+            elif row["slot_status"] == db.SLOT_STATUS_FINISHED:
                 status = "【試合終了】"
             else:
-                last_event = current_log[-1]
-                latest_inn = last_event.get("inning", prog_dict.get("inning", 1))
-                latest_tb = last_event.get("top_bottom", prog_dict.get("top_bottom", "表"))
-                score_info = last_event.get("meta", {}).get("score_snapshot", "")
+                score_info = row["score_text"]
                 score_str = f" [{score_info}]" if score_info else ""                
-                status = f"({latest_inn}回{latest_tb}){score_str}"            
+                status = f"({row['inning']}回{row['top_bottom']}){score_str}"            
+
+            sync = sync_status.get(i)
+            if sync:
+                status += SYNC_STATUS_LABELS.get(sync["status"], "")
 
             color = team_colors.get(my_team, "#1E3A8A")
             c_badge.markdown(f"<span class='team-tag-mobile' style='background-color:{color}'>{my_team}</span>", unsafe_allow_html=True)
             
-            btn_label = f"📅 {setup.get('date')} | {opp_team} {status}"            
+            btn_label = f"📅 {row['game_date']} | {opp_team} {status}"            
 
             if c_main.button(btn_label, key=f"slot_load_{i}", use_container_width=True):
+                if sync and sync["status"] == db.SYNC_STATUS_FAILED:
+                    st.toast(f"同期に失敗しています: {sync['last_error']}")
                 load_game_state_from_db(i)
 
                 current_logs = st.session_state.get("play_log", [])  
@@ -436,7 +585,7 @@ def show_top_menu():
 
             if user_role == "admin":
                 if c_del.button("❌", key=f"slot_del_{i}", help="スロットを削除"):
-                    if db.delete_game_slot(i):
+                    if db.delete_game_slot(i, club_id):
                         st.toast(f"スロット {i} をクリアしました")
                         st.rerun()
                     else:
@@ -450,7 +599,7 @@ def show_top_menu():
                 st.session_state.current_game_id = i
                 
                 for key in ["play_log", "active_game_order", "at_bat_history", "mobile_at_bat_logs", 
-                            "mobile_order", "opp_mobile_order", "game_progress", "game_status"]:
+                            "mobile_order", "opp_mobile_order", "game_progress", "game_status", "slot_journal", "undo_stack", "game_state"]:
                     if key in st.session_state:
                         del st.session_state[key]
                 
@@ -472,8 +621,13 @@ def show_top_menu():
                 st.rerun()
 
     st.divider()
+    last_sync = db.get_last_mobile_sync(club_id)
+    if st.session_state.get("mobile_offline"):
+        st.caption(f"📴 オフライン（最終同期: {last_sync or '未同期'}）")
+    else:
+        st.caption(f"最終同期: {last_sync or '未同期'}")
     if st.button("🔄 データを再同期", use_container_width=True):
-        db.sync_mobile_data(club_id)
+        run_mobile_sync(club_id)
         st.rerun()
 
 
@@ -491,7 +645,7 @@ def show_game_setup():
         return
     st.info(f"📍 スロット {slot_id:02} を編集中")    
 
-    team_list = db.get_team_names(club_id)
+    team_list = get_mobile_db().get_team_names()
     if "その他" in team_list: team_list.remove("その他")
     team_list.append("その他")    
     if "game_setup" not in st.session_state or st.session_state.game_setup is None:
@@ -535,7 +689,7 @@ def show_game_setup():
         return
     st.info(f"📍 スロット {slot_id:02} を編集中")    
 
-    team_list = db.get_team_names(club_id)
+    team_list = get_mobile_db().get_team_names()
     if "その他" in team_list: team_list.remove("その他")
     team_list.append("その他")    
     if "game_setup" not in st.session_state or st.session_state.game_setup is None:
@@ -617,7 +771,7 @@ def show_order_setup():
     at_bat_logs = st.session_state.get("mobile_at_bat_logs", [])
     has_played = len(at_bat_logs) > 0
 
-    players_data = db.get_all_players(st.session_state.club_id)
+    players_data = get_mobile_db().get_players()
     players = ["(未選択)"] + [p[1] for p in players_data]
     pos_list = ["---", "1(投)", "2(捕)", "3(一)", "4(二)", "5(三)", "6(遊)", "7(左)", "8(中)", "9(右)", "DP", "FP", "控え"]
     
@@ -738,7 +892,7 @@ def start_game(is_offense_start):
     st.session_state.game_progress = init_progress
 
     side_text = "先攻(自チーム攻撃から)" if batting_first == SENKO else "後攻(相手チーム攻撃から)"
-    record_play_event("game_start", f"試合開始: {side_text}")
+    record_play_event("game_start", f"試合開始: {side_text}", meta={"engine": game_engine.ENGINE_VERSION})
     
     save_game_state_to_db()
     st.session_state.mobile_page = "playball"
@@ -1029,6 +1183,7 @@ def render_action_panel():
         st.rerun()
 
     if col5.button("🏟️ 打席結果入力", use_container_width=True, type="primary"):
+        push_undo_state()
         record_pitch("インプレー")
         save_game_state_to_db()
         go_to("result_input")
@@ -1082,6 +1237,7 @@ def render_action_panel():
         st.session_state.strikes = 0
         st.session_state.active_page = "CHANGE"
         st.session_state["game_progress"] = gp
+        record_play_event("inning_start", f"{gp['inning']}回{gp['top_bottom']}", meta={"runners": clean_runners, "forced": True})
 
         if "save_game_state_to_db" in globals():
             save_game_state_to_db()
@@ -1171,7 +1327,8 @@ def get_name_by_idx(is_offense, idx):
 
 # ■打撃結果（１）------------------------
 
-def finish_at_bat(result, rbi=0, scorers=None, out=0, hit_bases=0, sb=0):
+def finish_at_bat(result, rbi=0, scorers=None, out=0, hit_bases=0, sb=0, end_runners=None):
+    """end_runners（{塁: 名前}）を渡した場合は、打席後の走者を自動の進塁ではなくその配置にする（走者操作の確定用）"""
     push_undo_state()
     if scorers is None: scorers = []
     gp = st.session_state.get("game_progress", {})
@@ -1181,7 +1338,8 @@ def finish_at_bat(result, rbi=0, scorers=None, out=0, hit_bases=0, sb=0):
     tb = gp.get("top_bottom", "表")
     is_my_offense = (flag == SENKO and tb == "表") or (flag == KOKO and tb == "裏")
 
-    current_out_snapshot = get_current_outs_from_log()
+    gs = get_game_state()
+    current_out_snapshot = gs.outs
     current_score_my = gp.get('score_my', 0)
     current_score_opp = gp.get('score_opp', 0)
 
@@ -1212,30 +1370,20 @@ def finish_at_bat(result, rbi=0, scorers=None, out=0, hit_bases=0, sb=0):
             runners = {1: None, 2: None, 3: None}
         else: 
             runners[hit_bases] = batter_name
-            
-    gp["runners"] = runners
+    if end_runners is not None:
+        runners = {b: end_runners.get(b) for b in [1, 2, 3]}
 
-    score_to_add = len(scorers)
-    if score_to_add > 0:
-        if tb == "表":
-            gp["score_top"] = gp.get("score_top", 0) + score_to_add
-        else:
-            gp["score_bottom"] = gp.get("score_bottom", 0) + score_to_add
-
-    current_score_str = f"{gp.get('score_top', 0)}-{gp.get('score_bottom', 0)}"
+    score_top, score_bottom = gp.get('score_top', 0), gp.get('score_bottom', 0)
+    if tb == "表":
+        score_top += len(scorers)
+    else:
+        score_bottom += len(scorers)
+    current_score_str = f"{score_top}-{score_bottom}"
 
     at_bat_counts_history = list(st.session_state.get("current_at_bat_counts", []))
-    history = st.session_state.get("at_bat_history", [])
     current_inn = int(gp.get("inning", 1))
     c_idx = gp.get("batter_idx", 0) if is_my_offense else gp.get("opp_batter_idx", 0)    
-    
-    same_inning_same_batter = [
-        h for h in history if 
-        int(h.get("inning", 0)) == current_inn and 
-        h.get("is_offense") == is_my_offense and 
-        h.get("batter_idx") is not None and int(h.get("batter_idx")) == int(c_idx)
-    ]
-    current_at_bat_no = len(same_inning_same_batter) + 1
+    current_at_bat_no = gs.at_bat_no(is_my_offense, c_idx)
 
     error_meta = {}
     if not is_my_offense and "失" in result:
@@ -1255,6 +1403,11 @@ def finish_at_bat(result, rbi=0, scorers=None, out=0, hit_bases=0, sb=0):
     p_hand = opp_p_info.get("handed", "R") 
     p_style = opp_p_info.get("style", "Windmill")
 
+    if is_my_offense:
+        order_size = len(st.session_state.get("active_game_order", []))
+    else:
+        order_size = len(st.session_state.get("opp_mobile_order", []) or st.session_state.get("opponent_players", []))
+
     log_entry = {
         "inning": current_inn,
         "p_hand": p_hand,    
@@ -1278,6 +1431,10 @@ def finish_at_bat(result, rbi=0, scorers=None, out=0, hit_bases=0, sb=0):
         "out_snapshot": current_out_snapshot, 
         "counts_history": at_bat_counts_history,
         "pitcher": get_current_pitcher(),
+        # game_engine が打席後の状態を再現するための項目
+        "end_runners": [runners[1], runners[2], runners[3]],
+        "outs_recorded": out,
+        "order_size": order_size,
         "meta": {
             "rbi": rbi,
             "scorers": list(scorers),
@@ -1289,23 +1446,9 @@ def finish_at_bat(result, rbi=0, scorers=None, out=0, hit_bases=0, sb=0):
         }
     }
 
-    if "play_log" not in st.session_state: st.session_state.play_log = []
     if "at_bat_history" not in st.session_state: st.session_state.at_bat_history = []
-    st.session_state.play_log.append(log_entry)
+    append_play_event(log_entry)
     st.session_state.at_bat_history.append(log_entry)
-    if out > 0: st.session_state.count["O"] += out
-    st.session_state.count["B"] = 0
-    st.session_state.count["S"] = 0
-    st.session_state.current_at_bat_counts = []
-
-    if is_my_offense:
-        order_list = st.session_state.get("active_game_order", [])
-        if order_list: gp["batter_idx"] = (int(gp.get("batter_idx", 0)) + 1) % len(order_list)
-    else:
-        opp_list = st.session_state.get("opp_mobile_order", []) or st.session_state.get("opponent_players", [])
-        if opp_list: gp["opp_batter_idx"] = (int(gp.get("opp_batter_idx", 0)) + 1) % len(opp_list)
-
-    st.session_state.game_progress = gp
     save_game_state_to_db()
 
     if st.session_state.count["O"] < 3:
@@ -1415,8 +1558,6 @@ def prepare_runner_adjustment(result_label, hit_bases=0, is_out=False, is_deadba
 # ■走者操作（２）進塁実際------------------------
 
 def apply_runner_fix(data, results):
-    gp = st.session_state.get("game_progress", {})
-
     new_runners = {1: None, 2: None, 3: None}
     scorers = []
     total_outs = 0
@@ -1450,6 +1591,7 @@ def apply_runner_fix(data, results):
                 if log.get("event_type") == "pitch" and "三振" in log.get("value", ""):
                     if "meta" not in log: log["meta"] = {}
                     log["meta"]["is_strikeout_stat"] = True
+                    invalidate_slot_journal()
                     break
 
     if b_res == "アウト": 
@@ -1464,10 +1606,7 @@ def apply_runner_fix(data, results):
     if total_outs >= 2 and "併殺" not in final_res: 
         final_res += "(併殺)"
 
-    gp["runners"] = new_runners
-    st.session_state.game_progress = gp
-
-    finish_at_bat(final_res, rbi=rbi, scorers=scorers, out=total_outs)
+    finish_at_bat(final_res, rbi=rbi, scorers=scorers, out=total_outs, end_runners=new_runners)
     st.session_state.runner_fix_data = None
 
 
@@ -1612,6 +1751,8 @@ def show_runner_action():
             "start_score_opp": gp.get("score_opp", 0),
             "start_outs": st.session_state.count.get("O", 0),
             "start_runners": ",".join(sorted([str(k) for k, v in runners.items() if v])),
+            "from_base": selected_base,
+            "to_base": move_to,
             "meta": {
                 "slot": target_idx,
                 "sub_idx": player_sub_idx,
@@ -1622,26 +1763,9 @@ def show_runner_action():
             }
         }
 
-        if "play_log" not in st.session_state: st.session_state.play_log = []
         if "at_bat_history" not in st.session_state: st.session_state.at_bat_history = []
-        st.session_state.play_log.append(log_entry)
+        append_play_event(log_entry)
         st.session_state.at_bat_history.append(log_entry)
-
-        gp["runners"][selected_base] = None
-        
-        if is_score:
-            if is_my_offense: gp["score_my"] += 1
-            else: gp["score_opp"] += 1
-            
-            if tb == "表": gp["score_top"] = gp.get("score_top", 0) + 1
-            else: gp["score_bottom"] = gp.get("score_bottom", 0) + 1
-        elif move_to:
-            gp["runners"][move_to] = player
-        
-        if is_out:
-            st.session_state.count["O"] += 1
-
-        st.session_state.game_progress = gp
         save_game_state_to_db()
 
         if st.session_state.count["O"] >= 3:
@@ -1804,7 +1928,7 @@ def show_defense_sub():
     order = st.session_state.active_game_order
     pos_options = ["---", "1(投)", "2(捕)", "3(一)", "4(二)", "5(三)", "6(遊)", "7(左)", "8(中)", "9(右)", "DP", "FP", "控え"]
 
-    all_players_data = db.get_all_players(st.session_state.club_id)
+    all_players_data = get_mobile_db().get_players()
     all_players_names = ["(未選択)"] + [p[1] for p in all_players_data]
     gp = st.session_state.get("game_progress", {})
 
@@ -1824,7 +1948,7 @@ def show_defense_sub():
         if new_name != old_name:
             any_change = True
             p_no = next((ap[2] for ap in all_players_data if ap[1] == new_name), "")
-            record_play_event("player_sub", f"{old_name} → {new_name}", meta={"slot": i, "pos": new_pos})            
+            record_play_event("player_sub", f"{old_name} → {new_name}", meta={"slot": i, "pos": new_pos, "old": old_name, "new": new_name})            
 
             runners = gp.get("runners", {})
             for base in [1, 2, 3]:
@@ -1865,7 +1989,7 @@ def show_pinch_hitter():
     st.markdown(f"### 🏃 {'自チーム' if is_my_offense else '相手チーム'} 代打")
 
     if is_my_offense:
-        players_data = db.get_all_players(st.session_state.club_id)
+        players_data = get_mobile_db().get_players()
         names = ["(未選択)"] + [p[1] for p in players_data]
 
         order_slot = st.session_state.active_game_order[idx]
@@ -1930,7 +2054,7 @@ def show_sub_runner():
     norm_current_runner = normalize_player_name(info['player'])
 
     if is_my_offense:
-        all_players_data = db.get_all_players(st.session_state.club_id)
+        all_players_data = get_mobile_db().get_players()
         players_list = ["(選択してください)"] + [p[1] for p in all_players_data]
         new_runner_name = st.selectbox("代走に出る選手を選択", players_list)
         
@@ -1961,7 +2085,7 @@ def show_sub_runner():
 
                             gp["runners"][info["base"]] = new_runner_name
                             
-                            record_play_event("pinch_runner", f"代走: {info['player']} → {new_runner_name}", meta={"slot": i, "base": info["base"]})
+                            record_play_event("pinch_runner", f"代走: {info['player']} → {new_runner_name}", meta={"slot": i, "base": info["base"], "new": new_runner_name})
                             break
                             
                 save_game_state_to_db()
@@ -1992,7 +2116,7 @@ def show_sub_runner():
                             })
 
                             gp["runners"][info["base"]] = display_name
-                            record_play_event("pinch_runner", f"相手代走: {info['player']} → {new_runner_name}", meta={"slot": i, "base": info["base"]})
+                            record_play_event("pinch_runner", f"相手代走: {info['player']} → {new_runner_name}", meta={"slot": i, "base": info["base"], "new": display_name})
                             break
                             
                 save_game_state_to_db()
@@ -2063,6 +2187,54 @@ def show_opp_pitcher_edit():
 # 　スコアシート 
 # ----------------—
 
+# ■スコアシートの索引
+# 表のマス（打順, イニング, 何打席目）ごとの記録と、選手ごとの得点・失策を履歴 1 周で引けるようにする。
+# 描画側はマスごとに履歴を探し直さず、この索引を引くだけにする。
+
+def build_score_sheet_index(history, is_offense_view):
+    max_cycle = {}     # イニング → 打者一巡の最大数（列数）
+    slot_recs = {}     # 打順 → その打順の記録（打点・盗塁の集計用）
+    cells = {}         # (打順, イニング, 何打席目) → [(正規化した選手名, 記録), ...]
+    runs = {}          # 正規化した選手名 → 得点
+    errors = {}        # 正規化した選手名 → 失策
+
+    for h in history:
+        h_meta = h.get("meta", {})
+
+        error_player = h_meta.get("player")
+        if error_player:
+            val = h_meta.get("error", 0)
+            try:
+                if val:
+                    name = normalize_player_name(str(error_player))
+                    errors[name] = errors.get(name, 0) + int(val)
+            except: pass
+
+        if h.get("is_offense") != is_offense_view:
+            continue
+
+        if h.get("result") or h.get("value"):
+            inn = h.get("inning")
+            cycle = int(h.get("at_bat_no", 1))
+            max_cycle[inn] = max(max_cycle[inn], cycle) if inn in max_cycle else cycle
+
+        sc_list = h.get("scorers") or h_meta.get("scorers", [])
+        if isinstance(sc_list, list):
+            for name in {normalize_player_name(str(sc)) for sc in sc_list}:
+                runs[name] = runs.get(name, 0) + 1
+
+        slot_ids = {i for i in (h.get("batter_idx"), h_meta.get("batter_idx")) if i is not None}
+        for idx in slot_ids:
+            slot_recs.setdefault(idx, []).append(h)
+
+        if slot_ids and h.get("event_type") in ["at_bat_result", "runner_event"]:
+            player = normalize_player_name(str(h.get("player") or h_meta.get("player", "")))
+            key_tail = (int(h.get("inning", 0)), int(h.get("at_bat_no", 1)))
+            for idx in slot_ids:
+                cells.setdefault((idx, *key_tail), []).append((player, h))
+
+    return {"max_cycle": max_cycle, "slot_recs": slot_recs, "cells": cells, "runs": runs, "errors": errors}
+
 def show_score_sheet():
     st.markdown("### 📋 スコアシート修正・確認・確定")
     
@@ -2090,26 +2262,33 @@ def show_score_sheet():
     def render_sheet(is_offense_view):
         current_inn = gp.get("inning", 1)
         max_inn_base = max(7, current_inn if isinstance(current_inn, int) else 1)
+
+        if is_offense_view:
+            order_data = st.session_state.get("active_game_order", [[] for _ in range(9)])
+        else:
+            order_data = st.session_state.get("opponent_players", [[] for _ in range(9)])
+
+        # 履歴・打順・イニングが前回と同じなら組み立て済みの HTML をそのまま出す
+        order_sig = tuple(
+            (len(p_list), str(p_list[-1]) if p_list else "") if isinstance(p_list, list) else str(p_list)
+            for p_list in order_data
+        )
+        cache_key = (id(history), st.session_state.get("history_version", 0), len(history), max_inn_base, order_sig)
+        sheet_cache = st.session_state.setdefault("score_sheet_cache", {})
+        cached = sheet_cache.get(is_offense_view)
+        if cached and cached[0] == cache_key:
+            st.markdown(cached[1], unsafe_allow_html=True)
+            return
+
+        index = build_score_sheet_index(history, is_offense_view)
         col_definitions = []
         
         for inn in range(1, max_inn_base + 1):
-            inn_recs = [
-                h for h in history 
-                if h.get("inning") == inn 
-                and h.get("is_offense") == is_offense_view
-                and (h.get("result") or h.get("value"))
-            ]
-            cycles = [int(h.get("at_bat_no", 1)) for h in inn_recs]
-            max_cycle = max(cycles) if cycles else 1
+            max_cycle = index["max_cycle"].get(inn, 1)
             for ab_no in range(1, max_cycle + 1):
                 col_definitions.append({"inn": inn, "ab_no": ab_no})
 
         slots = []
-        if is_offense_view:
-            order_data = st.session_state.get("active_game_order", [[] for _ in range(9)])
-        else:
-            order_data = st.session_state.get("opponent_players", [[] for _ in range(9)])
-        
         for i, p_list in enumerate(order_data):
             slots.append({"idx": i, "player_history": p_list})
 
@@ -2155,25 +2334,14 @@ def show_score_sheet():
                 else: 
                     end_ab = 9999
 
-                recs_for_stats = [
-                    h for h in history 
-                    if h.get("is_offense") == is_offense_view and 
-                    (h.get("batter_idx") == slot["idx"] or h.get("meta", {}).get("batter_idx") == slot["idx"])
-                ]
+                recs_for_stats = index["slot_recs"].get(slot["idx"], [])
                 p_rbi = sum(
                     int(r.get("rbi", 0) or r.get("meta", {}).get("rbi", 0) or 0) 
                     for r in recs_for_stats 
                     if r.get("event_type") == "at_bat_result"
                 )
                 
-                p_runs = 0
-                for h in history:
-                    if h.get("is_offense") != is_offense_view: continue
-                    sc_list = h.get("scorers") or h.get("meta", {}).get("scorers", [])
-                    if isinstance(sc_list, list):
-                        if any(normalize_player_name(str(s)) == p_name_norm for s in sc_list):
-                            p_runs += 1
-
+                p_runs = index["runs"].get(p_name_norm, 0)
 
                 p_sb = 0
                 for h in recs_for_stats:
@@ -2183,14 +2351,7 @@ def show_score_sheet():
                         try: p_sb += int(val) if val else 0
                         except: pass
 
-                p_err = 0
-                for h in history:
-                    h_meta = h.get("meta", {})
-                    error_player = h_meta.get("player")
-                    if error_player and normalize_player_name(str(error_player)) == p_name_norm:
-                        val = h_meta.get("error", 0)
-                        try: p_err += int(val) if val else 0
-                        except: pass
+                p_err = index["errors"].get(p_name_norm, 0)
 
                 html += f"<tr><td>{slot['idx']+1 if p_idx==0 else ''}</td><td style='font-size:8px;'>{p_info.get('pos','---')}</td>"
                 if not is_offense_view: html += f"<td>{p_info.get('no', '')}</td>"
@@ -2207,18 +2368,8 @@ def show_score_sheet():
                         t_inn = int(col["inn"])
                         t_ab_no = int(col["ab_no"])
 
-                        match = None
-                        if is_active: 
-                            potential_matches = [h for h in history if 
-                                                (h.get("batter_idx") == slot["idx"] or h.get("meta", {}).get("batter_idx") == slot["idx"]) and 
-                                                int(h.get("inning", 0)) == t_inn and 
-                                                int(h.get("at_bat_no", 1)) == t_ab_no and 
-                                                h.get("is_offense") == is_offense_view and
-                                                h.get("event_type") in ["at_bat_result", "runner_event"]]
-    
-                            if potential_matches:
-                                match = next((m for m in potential_matches if 
-                                                normalize_player_name(str(m.get("player") or m.get("meta", {}).get("player", ""))) == p_name_norm), None)
+                        potential_matches = index["cells"].get((slot["idx"], t_inn, t_ab_no), [])
+                        match = next((m for m_name, m in potential_matches if m_name == p_name_norm), None)
                         
                         if match:
                             res_text = str(match.get("result") or match.get("value", ""))
@@ -2243,6 +2394,7 @@ def show_score_sheet():
                 
                 html += f"<td>{p_rbi}</td><td>{p_runs}</td><td>{p_sb}</td><td>{p_err}</td></tr>"        
         html += "</tbody></table></div>"
+        sheet_cache[is_offense_view] = (cache_key, html)
         st.markdown(html, unsafe_allow_html=True)
 
     tab1, tab2 = st.tabs(["自チーム攻撃", "自チーム守備"])
@@ -2265,10 +2417,14 @@ def show_score_sheet():
             
             cb1, cb2 = st.columns(2)
             if cb1.button("更新を保存", key="btn_save_edit", use_container_width=True, type="primary"):
+                push_undo_state(); journal_log_edit("at_bat_history", edit_idx)
                 history[edit_idx].update({"result": new_res, "rbi": new_rbi})
+                invalidate_slot_journal()
+                bump_history_version()
                 save_game_state_to_db(); st.success("保存しました"); st.rerun()
             if cb2.button("この記録を削除", key="btn_del_edit", use_container_width=True):
-                history.pop(edit_idx); save_game_state_to_db(); st.rerun()
+                push_undo_state(); journal_log_edit("at_bat_history", edit_idx, deleted=True)
+                history.pop(edit_idx); invalidate_slot_journal(); bump_history_version(); save_game_state_to_db(); st.rerun()
         else:
             st.info("修正可能な履歴がありません。")
 
@@ -2694,14 +2850,14 @@ def handle_core_cct_sync():
         }
         sync_list.append(entry)
 
-    success = db.save_core_cct_sync_data(club_id, sync_list)
+    # 書き込みは送信待ちに積んでバックグラウンドで行う（スロットは送信が成功してから消える）
+    target_slot = st.session_state.get("current_game_id") or st.session_state.get("selected_slot")
+    success = db.enqueue_core_cct_sync(club_id, current_game_id, target_slot, sync_list)
 
     if success:
-        st.success(f"✅ Core.cct への同期が完了しました (ID: {current_game_id})")
-
-        target_slot = st.session_state.get("current_game_id") or st.session_state.get("selected_slot")
-        if target_slot:
-            db.delete_work_data(target_slot)
+        sync_worker.start_sync_worker()
+        sync_worker.wake()
+        st.toast(f"✅ Core.cct への同期を受け付けました (ID: {current_game_id})")
 
         st.session_state.game_id = "temp_id"
         st.session_state.at_bat_history = []
@@ -2717,7 +2873,7 @@ def handle_core_cct_sync():
 
         st.rerun()
     else:
-        st.error("❌ 同期に失敗しました。")
+        st.error("❌ 同期の受付に失敗しました。")
 
 
 
@@ -2746,6 +2902,7 @@ def show_mobile_ui():
 
 
     init_mobile_session()
+    sync_worker.start_sync_worker()
 
     if "count" not in st.session_state:
         st.session_state.count = {"B": 0, "S": 0, "O": 0}
@@ -2757,8 +2914,6 @@ def show_mobile_ui():
             "is_finished": False
         }
 
-    db.init_db()
-
     if not st.session_state.get("authenticated"):
         if 'show_login' in globals():
             show_login()
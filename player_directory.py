@@ -6,11 +6,6 @@ import sqlite3
 from PIL import Image
 from streamlit_cropper import st_cropper
 
-# ログイン中の club_id を考慮したキャッシュ
-@st.cache_data
-def get_all_players_cached(club_id):
-    return db.get_all_players(club_id)
-
 def show():
     # --- 0. ログインチェックと club_id 取得 ---
     club_id = st.session_state.get("club_id")
@@ -162,6 +157,10 @@ def show():
         return
 
     # --- 5. グリッド表示 ---
+    # カードごとに集計せず、今年度と通算の成績を全選手分まとめて取得しておく
+    season_stats = db.get_directory_stats(club_id, current_year)
+    career_stats = db.get_directory_stats(club_id)
+
     cols = st.columns(3)
     for i, p in enumerate(players_filtered):
         # database.pyの戻り値想定: (id, name, birthday, home, memo, img, club_id, is_active, team_name, throws_hits)
@@ -263,8 +262,8 @@ def show():
                 st.markdown(f'<div class="stats-header">{header_label}</div>', unsafe_allow_html=True)
                 
                 try:
-                    target_year = current_year if is_active == 1 else None
-                    stats = db.get_player_season_stats(p_id, year=target_year, club_id=club_id)
+                    stats_map = season_stats if is_active == 1 else career_stats
+                    stats = stats_map.get(p_name, db.DIRECTORY_EMPTY_STATS)
                     
                     s1, s2, s3, s4 = st.columns(4)
                     s1.markdown(f"<div class='stats-label'>打率</div><div class='stats-value'>{stats.get('avg',0):.3f}</div>", unsafe_allow_html=True)
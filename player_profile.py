@@ -57,7 +57,7 @@ def get_player_abilities(stats, detailed_logs):
     # 状況判定 (pitch_countカラムがDBにある場合のみ判定)
     first_pitch_hits = 0
     for log in detailed_logs:
-        if log.get('pitch_count') == 1 and "安" in log.get('result', ''):
+        if log.get('pitch_count') == 1 and log.get('is_hit') == 1:
             first_pitch_hits += 1
     if first_pitch_hits >= 3: abs_list.append(("初球○", "blue", "初球から積極的な打撃"))
     
@@ -183,13 +183,13 @@ def show():
         st.plotly_chart(fig_zone, use_container_width=True)
 
     with tab_pitch:
-        p_stats = db.get_pitching_stats_filtered(club_id, "すべて")
-        p_data = next((p for p in p_stats if p['name'] == selected_name), None)
-        if p_data and float(p_data.get('total_ip', 0)) > 0:
+        p_stats = db.get_pitching_stats_filtered(club_id, pitcher_name=selected_name)
+        p_data = p_stats.iloc[0] if not p_stats.empty else None
+        if p_data is not None and p_data['アウト数'] > 0:
             c1, c2, c3 = st.columns(3)
-            c1.metric("防御率", f"{float(p_data['era']):.2f}")
-            c2.metric("奪三振率", f"{(int(p_data['total_so'])*7)/float(p_data['total_ip']):.2f}")
-            c3.metric("WHIP", f"{(float(p_data['total_h'])+float(p_data['total_bb']))/float(p_data['total_ip']):.2f}")
+            c1.metric("防御率", f"{float(p_data['防御率']):.2f}")
+            c2.metric("奪三振率", f"{float(p_data['奪三振率']):.2f}")
+            c3.metric("WHIP", f"{float(p_data['WHIP']):.2f}")
         else: st.info("投手記録なし")
 
     with tab_trend:
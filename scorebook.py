@@ -28,12 +28,6 @@ def show():
 
 
 
-    # データベース初期化
-
-    db.init_db()
-
-
-
     st.title("📝 スコア入力・編集")
 
 
@@ -204,17 +198,17 @@ def show():
 
 
 
-        with sqlite3.connect('softball.db') as conn:
-
-            conn.row_factory = sqlite3.Row
+        with db.get_connection() as conn:
 
             c = conn.cursor()
 
-            c.execute("SELECT player_name, innings, summary FROM scorebook_batting WHERE game_id = ? AND club_id = ?", (new_game_id, club_id))
+            c.row_factory = sqlite3.Row
+
+            c.execute("SELECT player_name, innings, summary FROM scorebook_batting WHERE game_id = ? AND club_id = ?", (db.as_game_id(new_game_id), db.as_club_id(club_id)))
 
             existing_batting = c.fetchall()
 
-            c.execute("SELECT * FROM scorebook_pitching WHERE game_id = ? AND club_id = ?", (new_game_id, club_id))
+            c.execute("SELECT * FROM scorebook_pitching WHERE game_id = ? AND club_id = ?", (db.as_game_id(new_game_id), db.as_club_id(club_id)))
 
             existing_pitching = c.fetchall()
 
@@ -12,29 +12,14 @@ def show():
     st.title("🏆 チーム個人成績ランキング")
     st.caption("※分析スコア（CCT形式）と詳細スコア（ノーマル版）の全データを統合した精密集計です。")
 
-    # --- 1. データの取得 ---
-    try:
-        raw_batting = db.get_batting_stats_filtered(club_id)
-        raw_pitching = db.get_pitching_stats_filtered(club_id)
-    except Exception as e:
-        st.error(f"データ取得エラー: {e}")
-        return
-
-    df_bat = pd.DataFrame(raw_batting) if raw_batting else pd.DataFrame()
-    df_pit = pd.DataFrame(raw_pitching) if raw_pitching else pd.DataFrame()
-
-    if df_bat.empty and df_pit.empty:
-        st.info("集計対象の成績データがまだありません。")
-        return
-
-    # --- 2. フィルタ設定 (サイドバー) ---
+    # --- 1. フィルタ設定 (サイドバー) ---
     st.sidebar.header("🔍 絞り込み条件")
     
-    # 年度フィルタ（DBにyearカラムがあればそれを利用、なければ通算のみ）
-    available_years = ["通算"]
-    if not df_bat.empty and 'year' in df_bat.columns:
-        available_years += sorted(df_bat['year'].dropna().unique().tolist(), reverse=True)
+    # 年度フィルタ（成績はシーズン・月・チーム単位で集計済み。絞り込みは集計行の検索で済む）
+    available_years = ["通算"] + db.get_stat_seasons(club_id)
     sel_year = st.sidebar.selectbox("📅 年度", available_years, index=0)
+    sel_month = st.sidebar.selectbox("🗓️ 月", ["通年"] + list(range(1, 13)), index=0,
+                                     format_func=lambda m: m if m == "通年" else f"{m}月")
     
     # チームフィルタ
     all_teams = db.get_all_teams_in_order(club_id)
@@ -46,18 +31,22 @@ def show():
     min_pa = st.sidebar.number_input("最低打席数 (打撃ランキング用)", min_value=0, value=3, step=1)
     min_inn = st.sidebar.number_input("最低投球回 (投手ランキング用)", min_value=0.0, value=3.0, step=1.0)
 
-    # --- データのフィルタリング処理 ---
-    def filter_data(df):
-        if df.empty: return df
-        temp_df = df.copy()
-        if sel_year != "通算" and 'year' in temp_df.columns:
-            temp_df = temp_df[temp_df['year'] == sel_year]
-        if sel_team != "すべて" and 'team' in temp_df.columns:
-            temp_df = temp_df[temp_df['team'] == sel_team]
-        return temp_df
-
-    df_bat_filtered = filter_data(df_bat)
-    df_pit_filtered = filter_data(df_pit)
+    # --- 2. データの取得 ---
+    filters = {
+        "season": None if sel_year == "通算" else sel_year,
+        "month": None if sel_month == "通年" else sel_month,
+        "team": None if sel_team == "すべて" else sel_team,
+    }
+    try:
+        df_bat_filtered = db.get_batting_stats_filtered(club_id, **filters)
+        df_pit_filtered = db.get_pitching_stats_filtered(club_id, **filters)
+    except Exception as e:
+        st.error(f"データ取得エラー: {e}")
+        return
+
+    if df_bat_filtered.empty and df_pit_filtered.empty and all(v is None for v in filters.values()):
+        st.info("集計対象の成績データがまだありません。")
+        return
 
 
     # --- 3. タブ構成 ---
@@ -0,0 +1,69 @@
+# -------------—-
+# 　 Core.cct 同期ワーカー
+# --------------—
+
+# モバイルの「Core.cct同期」は送信待ち（database の sync_outbox）に積むだけで画面に戻る。
+# 実際の書き込み（save_core_cct_sync_data）はこのワーカーが 1 件ずつ行う。
+# Streamlit からは start_sync_worker() でプロセス内のスレッドとして動かし、
+# 積んだ直後は wake() で待ち時間を飛ばす。`python sync_worker.py` で別プロセスとしても動かせる。
+
+import threading
+import database as db
+
+POLL_INTERVAL_SEC = 2.0
+
+_worker = None
+_worker_lock = threading.Lock()
+_wake_event = threading.Event()
+
+
+def drain_outbox():
+    """送信時刻になった同期をすべて処理し、処理した件数を返す"""
+    processed = 0
+    while True:
+        job = db.claim_core_cct_sync()
+        if job is None:
+            return processed
+        try:
+            ok = db.save_core_cct_sync_data(job["club_id"], job["payload"])
+            error = None if ok else "Core.cct への書き込みに失敗しました"
+        except Exception as e:
+            ok, error = False, e
+        if ok:
+            db.complete_core_cct_sync(job)
+        else:
+            db.fail_core_cct_sync(job, error)
+            print(f"DEBUG: 同期失敗 (game_id={job['game_id']}, {job['attempts'] + 1}回目): {error}")
+        processed += 1
+
+
+def _run():
+    while True:
+        try:
+            drain_outbox()
+        except Exception as e:
+            print(f"Sync worker error: {e}")
+        _wake_event.wait(POLL_INTERVAL_SEC)
+        _wake_event.clear()
+
+
+def start_sync_worker():
+    """ワーカースレッドを起動する（起動済みなら何もしない）"""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            db.requeue_running_core_cct_sync()
+            _worker = threading.Thread(target=_run, name="core-cct-sync", daemon=True)
+            _worker.start()
+    return _worker
+
+
+def wake():
+    """積んだばかりの同期をすぐ送らせる"""
+    _wake_event.set()
+
+
+if __name__ == "__main__":
+    db.init_db()
+    db.requeue_running_core_cct_sync()
+    _run()
@@ -0,0 +1,101 @@
+# -------------—-
+# 　 試合進行エンジン（game_engine）のテスト
+# --------------—
+
+# play_log をそのまま replay して、アウト・走者・得点・半イニングのリセットを確かめる。
+
+import game_engine
+from game_engine import replay
+
+
+def ev(event_type, inning=1, top_bottom="表", is_offense=True, **fields):
+    return {"event_type": event_type, "inning": inning, "top_bottom": top_bottom,
+            "is_offense": is_offense, "meta": fields.pop("meta", {}), **fields}
+
+
+def start():
+    return ev("game_start", meta={"engine": game_engine.ENGINE_VERSION})
+
+
+def pitch(value, **fields):
+    return ev("pitch", value=value, **fields)
+
+
+def at_bat(result, end_runners, outs_recorded=0, scorers=(), batter_idx=0, order_size=9, **fields):
+    return ev("at_bat_result", result=result, value=result, end_runners=list(end_runners),
+              outs_recorded=outs_recorded, scorers=list(scorers), batter_idx=batter_idx, order_size=order_size,
+              **fields)
+
+
+def test_strikeout_records_an_out_and_resets_the_count():
+    log = [start(), pitch("見逃し"), pitch("ファール"), pitch("ボール"), pitch("空三振"),
+           at_bat("空三振", [None, None, None], outs_recorded=1)]
+    s = replay(log)
+    assert game_engine.is_replayable(log)
+    assert (s.outs, s.balls, s.strikes, s.pitches) == (1, 0, 0, ())
+    assert s.runners == (None, None, None)
+    assert s.batter_idx == 1
+    assert s.half_batters == 1
+
+
+def test_pitch_count_before_the_result():
+    s = replay([start(), pitch("ボール"), pitch("空振り"), pitch("ファール"), pitch("ファール"), pitch("インプレー")])
+    assert (s.balls, s.strikes) == (1, 2)
+    assert s.pitches == ("B", "K", "F", "F", "X")
+    assert game_engine.pitch_event_value(s, "見逃し") == "見三振"
+    assert game_engine.pitch_event_value(s, "ボール") == "ボール"
+
+
+def test_walk_with_bases_loaded_scores_a_run():
+    log = [start(),
+           at_bat("中単打", ["A", None, None], batter_idx=0),
+           at_bat("右単打", ["B", "A", None], batter_idx=1),
+           at_bat("左単打", ["C", "B", "A"], batter_idx=2),
+           pitch("ボール"), pitch("ボール"), pitch("ボール"), pitch("四球"),
+           at_bat("四球", ["D", "C", "B"], scorers=["A"], batter_idx=3)]
+    s = replay(log)
+    assert s.runners == ("D", "C", "B")
+    assert (s.score_top, s.score_bottom, s.score_my, s.score_opp) == (1, 0, 1, 0)
+    assert (s.outs, s.balls, s.strikes) == (0, 0, 0)
+    assert s.half_runs == 1
+    assert s.batter_idx == 4
+
+
+def test_runner_event_scores_and_records_outs():
+    log = [start(),
+           at_bat("右二塁打", [None, "A", None], batter_idx=0),
+           ev("runner_event", player="A", from_base=2, to_base=3, batter_idx=0),
+           ev("runner_event", player="A", from_base=3, scorers=["A"], batter_idx=0),
+           at_bat("中単打", ["B", None, None], batter_idx=1),
+           ev("runner_event", player="B", from_base=1, is_out=True, batter_idx=1)]
+    s = replay(log)
+    assert s.runners == (None, None, None)
+    assert (s.score_top, s.score_my) == (1, 1)
+    assert s.outs == 1
+    assert s.half_runs == 1
+    assert s.at_bat_no(True, 0) == 4
+
+
+def test_inning_start_resets_the_half_inning():
+    log = [start(),
+           at_bat("遊ゴ", [None, None, None], outs_recorded=1, batter_idx=0),
+           at_bat("中単打", ["B", None, None], batter_idx=1),
+           pitch("ボール"),
+           ev("inning_start", inning=1, top_bottom="裏", is_offense=False,
+              meta={"runners": {"2": "X9"}})]
+    s = replay(log)
+    assert (s.inning, s.top_bottom) == (1, "裏")
+    assert (s.outs, s.balls, s.strikes, s.pitches) == (0, 0, 0, ())
+    assert s.runners == (None, "X9", None)
+    assert (s.half_runs, s.half_batters, s.slot_entries) == (0, 0, {})
+    # 打順の位置は半イニングをまたいで残る
+    assert s.batter_idx == 2
+
+
+def test_replay_continues_from_a_state_and_apply_does_not_mutate():
+    log = [start(), pitch("ボール"), at_bat("右本塁打", [None, None, None], scorers=["A"])]
+    head = replay(log[:2])
+    assert replay(log[2:], head).score_top == replay(log).score_top == 1
+    assert game_engine.apply(head, pitch("ボール")).balls == 2
+    assert head.balls == 1
+    assert head.event_count == 2